@@ -1,47 +1,201 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+from operator import eq, gt, itemgetter
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+
+
 class Node:
     def __init__(self, is_leaf=False):
         self.is_leaf = is_leaf  # Whether the node is a leaf node
         self.keys = []  # List of keys in the node
         self.children = []  # List of child nodes (for internal nodes) or pointers to data (for leaf nodes)
+        self.next = None  # Right neighbour in the leaf chain (leaf nodes only)
+        self.prev = None  # Left neighbour in the leaf chain (leaf nodes only)
+
+    @staticmethod
+    def key_buffer(keys=()):
+        return list(keys)
+
+
+class Compact_Node:
+    # same interface as Node without a per-object __dict__; the keys are packed int64 values in one buffer
+    __slots__ = ("is_leaf", "keys", "children", "next", "prev")
+
+    def __init__(self, is_leaf=False):
+        self.is_leaf = is_leaf
+        self.keys = array("q")
+        self.children = []
+        self.next = None
+        self.prev = None
+
+    @staticmethod
+    def key_buffer(keys=()):
+        return keys if isinstance(keys, array) else array("q", keys)
 
 
 class B_Plus_Tree:
-    def __init__(self, degree=4):
+    def __init__(self, degree=4, unique=True, compact=False):
         self.degree = degree  # Maximum number of keys a node can have
-        self.root = Node(is_leaf=True)  # Initially, the root is a leaf node(only 1 node)
+        # compact trees use Compact_Node and only accept integer keys that fit in 64 bits
+        self.node_class = Compact_Node if compact else Node
+        self.root = self.node_class(is_leaf=True)  # Initially, the root is a leaf node(only 1 node)
+        # unique: each key maps to one value (put overwrites it)
+        # otherwise each key maps to a posting list and put appends to it
+        self.unique = unique
+
+    @classmethod
+    def bulk_load(cls, iterable, degree=4, fill_factor=1.0, presorted=False, values=None, unique=True,
+                  compact=False):
+        # build the tree bottom-up: pack sorted keys into chained leaves, then stack internal levels on top
+        # values is an optional iterable parallel to the keys; equal keys keep the last value (unique)
+        # or are gathered into one posting list in input order
+        keys, payloads = cls.bulk_payloads(iterable, fill_factor, presorted, values, unique)
+        tree = cls(degree=degree, unique=unique, compact=compact)
+        keys = tree.node_class.key_buffer(keys)
+        if len(keys) <= 2 * degree - 1:
+            tree.root.keys = keys
+            tree.root.children = payloads
+            return tree
+        levels = cls.bulk_levels(len(keys), degree, fill_factor)
+        level = []
+        for group in levels[0]:
+            leaf = tree.node_class(is_leaf=True)
+            leaf.keys = keys[group[0]:group[1]]
+            leaf.children = payloads[group[0]:group[1]]
+            if level:
+                level[-1].next = leaf
+                leaf.prev = level[-1]
+            level.append(leaf)
+        lowest = [leaf.keys[0] for leaf in level]  # smallest key under each node of the current level
+        for groups in levels[1:]:
+            parents = []
+            for start, end in groups:
+                parent = tree.node_class()
+                parent.children = level[start:end]
+                parent.keys = tree.node_class.key_buffer(lowest[start + 1:end])
+                parents.append(parent)
+            lowest = [lowest[start] for start, end in groups]
+            level = parents
+        tree.root = level[0]
+        return tree
+
+    @classmethod
+    def bulk_payloads(cls, iterable, fill_factor, presorted, values, unique):
+        # the sorted distinct keys of a bulk load and the leaf payloads parallel to them
+        if not 0 < fill_factor <= 1:
+            raise ValueError("fill_factor must be in (0, 1]")
+        keys = list(iterable)
+        if values is None:
+            pairs = None
+            if not presorted:
+                keys.sort()
+        else:
+            pairs = list(zip(keys, values))
+            if not presorted:
+                pairs.sort(key=itemgetter(0))  # stable, so equal keys keep their input order
+            keys = [pair[0] for pair in pairs]
+        if presorted and any(map(gt, keys, islice(keys, 1, None))):
+            raise ValueError("bulk_load got presorted=True but the keys are not sorted")
+        return cls.group_payloads(keys, pairs, unique)
+
+    @classmethod
+    def bulk_levels(cls, total, degree, fill_factor):
+        # the (start, end) runs each level of a bulk-loaded tree takes from the level below: the leaves'
+        # runs of the `total` keys first, the root's single run over the top internal level last
+        # leaves hold between degree - 1 and 2 * degree - 1 keys
+        leaf_size = max(degree - 1, 1, round((2 * degree - 1) * fill_factor))
+        levels = [cls.pack_groups(total, leaf_size, degree - 1, 2 * degree - 1)]
+        # internal nodes hold between degree and 2 * degree children
+        fan_out = max(degree, round(2 * degree * fill_factor))
+        while len(levels[-1]) > 1:
+            count = len(levels[-1])
+            if count <= 2 * degree:
+                levels.append([(0, count)])
+            else:
+                levels.append(cls.pack_groups(count, fan_out, degree, 2 * degree))
+        return levels
 
-    def insert(self, key):
+    @staticmethod
+    def group_payloads(keys, pairs, unique):
+        # collapse runs of equal sorted keys and build the leaf payload list parallel to the keys
+        if unique and not any(map(eq, keys, islice(keys, 1, None))):
+            return keys, [None] * len(keys) if pairs is None else [pair[1] for pair in pairs]
+        out_keys, payloads = [], []
+        for i, key in enumerate(keys):
+            value = None if pairs is None else pairs[i][1]
+            if out_keys and out_keys[-1] == key:
+                if unique:
+                    payloads[-1] = value
+                else:
+                    payloads[-1].append(value)
+            else:
+                out_keys.append(key)
+                payloads.append(value if unique else [value])
+        return out_keys, payloads
+
+    @staticmethod
+    def pack_groups(total, size, minimum, maximum):
+        # cut range(total) into (start, end) runs of `size`, folding an underfull tail into its neighbour
+        bounds = [[start, min(start + size, total)] for start in range(0, total, size)]
+        if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < minimum:
+            last = bounds.pop()
+            if last[1] - bounds[-1][0] <= maximum:
+                bounds[-1][1] = last[1]
+            else:
+                # too many for one node: split the last two runs evenly, both stay above the minimum
+                middle = (bounds[-1][0] + last[1]) // 2
+                bounds[-1][1] = middle
+                bounds.append([middle, last[1]])
+        return [tuple(bound) for bound in bounds]
+
+    def insert(self, key, value=None):
+        self.put(key, value)
+
+    def put(self, key, value=None):
+        # upsert: overwrite the value of an existing key, or append to its posting list
         if self.is_root_full():
             self.insert_full()
-        self.insert_not_full(self.root, key)
+        self.insert_not_full(self.root, key, value)
 
     def is_root_full(self):     # whether the root is full
         return len(self.root.keys) == 2 * self.degree - 1
 
     def insert_full(self):
         # if the root is full, we should first divide then insert      
-        new_root = Node()
+        new_root = self.node_class()
         new_root.children.append(self.root)
         self.split_node(new_root, 0)
         self.root = new_root
 
-    def insert_not_full(self, node, key):
+    def insert_not_full(self, node, key, value=None):
         # if the root is not full, insert the key into the leaf node
         if node.is_leaf:
-            node.keys.append(key)
-            node.keys.sort()
+            i = bisect_left(node.keys, key)  # binary search for the slot instead of re-sorting the leaf
+            if i < len(node.keys) and node.keys[i] == key:
+                if self.unique:
+                    node.children[i] = value
+                else:
+                    node.children[i].append(value)
+            else:
+                node.keys.insert(i, key)
+                node.children.insert(i, value if self.unique else [value])
         else:
             # Find the correct child to recurse into
-            i = len(node.keys) - 1
-            while i >= 0 and key < node.keys[i]:
-                i -= 1
-            i += 1  # The index of the child to insert into
+            i = bisect_right(node.keys, key)  # The index of the child to insert into
             child = node.children[i]
             if len(child.keys) == 2 * self.degree - 1:
                 self.split_node(node, i)
-                if key > node.keys[i]:
+                if key >= node.keys[i]:
                     i += 1
-            self.insert_not_full(node.children[i], key)
+            self.insert_not_full(node.children[i], key, value)
 
     def split_node(self, parent, index):
         # method to split the node
@@ -49,10 +203,21 @@ class B_Plus_Tree:
         mid_index = len(node.keys) // 2
         mid_key = node.keys[mid_index]
         # Create a new node for the right half
-        new_node = Node(is_leaf=node.is_leaf)
-        new_node.keys = node.keys[mid_index + 1:]
-        node.keys = node.keys[:mid_index]
-        if not node.is_leaf:
+        new_node = self.node_class(is_leaf=node.is_leaf)
+        if node.is_leaf:
+            # a leaf keeps the middle key (it is only copied up) and is linked into the leaf chain
+            new_node.keys = node.keys[mid_index:]
+            node.keys = node.keys[:mid_index]
+            new_node.children = node.children[mid_index:]
+            node.children = node.children[:mid_index]
+            new_node.next = node.next
+            if node.next is not None:
+                node.next.prev = new_node
+            node.next = new_node
+            new_node.prev = node
+        else:
+            new_node.keys = node.keys[mid_index + 1:]
+            node.keys = node.keys[:mid_index]
             new_node.children = node.children[mid_index + 1:]
             node.children = node.children[:mid_index + 1]
         # Insert the middle key into the parent node
@@ -60,39 +225,97 @@ class B_Plus_Tree:
         parent.children.insert(index + 1, new_node)
 
     def search(self, key):
+        result = self.contains(key)
+        print(result)
+        return result
+
+    def contains(self, key):
+        # same as search but silent, for callers that probe many keys
+        return self.locate(key)[0] is not None
+
+    def locate(self, key):
+        # the leaf holding key and its slot there, or (None, -1)
         node = self.root
-        while True:
-            if node.is_leaf:
-                if key in node.keys:
-                    print(True)
-                    return True
-                else:
-                    print(False)
-                    return False
-            else:
-                i = len(node.keys) - 1
-                while i >= 0 and key < node.keys[i]:
-                    i -= 1
-                i += 1
-                node = node.children[i]
-
-    def delete(self, key):
-        if self.delete_method(self.root, key):
-            print(f"Key {key} deleted.")
-        else:
-            print(f"Key {key} not found.")
+        while not node.is_leaf:
+            node = node.children[bisect_right(node.keys, key)]
+        i = bisect_left(node.keys, key)
+        if i < len(node.keys) and node.keys[i] == key:
+            return node, i
+        return None, -1
+
+    def get(self, key, default=None):
+        # the value stored under key (a copy of the posting list when the tree is not unique)
+        node, i = self.locate(key)
+        if node is None:
+            return default
+        return node.children[i] if self.unique else list(node.children[i])
+
+    def get_many(self, keys, default=None):
+        # look up a batch of keys in one walk: the probes are sorted and every node on the way is visited once,
+        # so neighbouring keys share their descent. Results come back in the order of `keys`.
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        sorted_keys = [keys[p] for p in order]
+        results = [default] * len(keys)
+        if keys:
+            self.get_many_method(self.root, sorted_keys, order, 0, len(keys), results)
+        return results
+
+    def get_many_method(self, node, sorted_keys, order, lo, hi, results):
+        # resolve the probes sorted_keys[lo:hi], which all fall under node
+        if node.is_leaf:
+            j = 0
+            for n in range(lo, hi):
+                j = bisect_left(node.keys, sorted_keys[n], j)
+                if j < len(node.keys) and node.keys[j] == sorted_keys[n]:
+                    value = node.children[j]
+                    results[order[n]] = value if self.unique else list(value)
+            return
+        start = lo
+        while start < hi:
+            i = bisect_right(node.keys, sorted_keys[start])
+            # the probes below the next separator go to the same child
+            end = hi if i == len(node.keys) else bisect_left(sorted_keys, node.keys[i], start, hi)
+            self.get_many_method(node.children[i], sorted_keys, order, start, end, results)
+            start = end
+
+    def search_many(self, keys):
+        # batched contains(): a list of booleans in the order of `keys`, nothing is printed
+        missing = object()
+        return [result is not missing for result in self.get_many(keys, missing)]
+
+    def delete(self, key, value=None):
+        found = self.remove(key, value)
+        target = f"Value {value} of key {key}" if value is not None and not self.unique else f"Key {key}"
+        print(f"{target} deleted." if found else f"{target} not found.")
+
+    def remove(self, key, value=None):
+        # same as delete but silent: drop the key and its payload and report whether it was there;
+        # on a non-unique tree a given value removes just that posting
+        if value is not None and not self.unique:
+            node, i = self.locate(key)
+            if node is None or value not in node.children[i]:
+                return False
+            if len(node.children[i]) > 1:
+                node.children[i].remove(value)
+                return True
+        if not self.delete_method(self.root, key):
+            return False
+        # the root lost its last separator after a merge, so its only child becomes the root
+        if not self.root.is_leaf and not self.root.keys:
+            self.root = self.root.children[0]
+        return True
 
     def delete_method(self, node, key):
         if node.is_leaf:
-            if key in node.keys:
-                node.keys.remove(key)
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                del node.keys[i]
+                del node.children[i]
                 return True
             return False
         else:
-            i = len(node.keys) - 1
-            while i >= 0 and key < node.keys[i]:
-                i -= 1
-            i += 1
+            i = bisect_right(node.keys, key)
             child = node.children[i]
             if self.delete_method(child, key):
                 if len(child.keys) < self.degree - 1:
@@ -102,6 +325,9 @@ class B_Plus_Tree:
 
     def re_balance_method(self, parent, index):
         child = parent.children[index]
+        if child.is_leaf:
+            self.re_balance_leaf(parent, index)
+            return
         if index > 0 and len(parent.children[index - 1].keys) > self.degree - 1:
             # Borrow from the left sibling
             left_sibling = parent.children[index - 1]
@@ -135,32 +361,1130 @@ class B_Plus_Tree:
                 parent.children.pop(index + 1)
                 parent.keys.pop(index)
 
+    def re_balance_leaf(self, parent, index):
+        # leaves hold every key, so the separators in the parent are only copies and never move down
+        child = parent.children[index]
+        if index > 0 and len(parent.children[index - 1].keys) > self.degree - 1:
+            # Borrow from the left sibling
+            left_sibling = parent.children[index - 1]
+            child.keys.insert(0, left_sibling.keys.pop())
+            child.children.insert(0, left_sibling.children.pop())
+            parent.keys[index - 1] = child.keys[0]
+        elif index < len(parent.children) - 1 and len(parent.children[index + 1].keys) > self.degree - 1:
+            # Borrow from the right sibling
+            right_sibling = parent.children[index + 1]
+            child.keys.append(right_sibling.keys.pop(0))
+            child.children.append(right_sibling.children.pop(0))
+            parent.keys[index] = right_sibling.keys[0]
+        else:
+            # Merge with a sibling and unlink the emptied leaf from the chain
+            if index > 0:
+                left_sibling = parent.children[index - 1]
+                left_sibling.keys.extend(child.keys)
+                left_sibling.children.extend(child.children)
+                self.unlink_leaf(child)
+                parent.children.pop(index)
+                parent.keys.pop(index - 1)
+            else:
+                right_sibling = parent.children[index + 1]
+                child.keys.extend(right_sibling.keys)
+                child.children.extend(right_sibling.children)
+                self.unlink_leaf(right_sibling)
+                parent.children.pop(index + 1)
+                parent.keys.pop(index)
+
+    def unlink_leaf(self, leaf):
+        if leaf.prev is not None:
+            leaf.prev.next = leaf.next
+        if leaf.next is not None:
+            leaf.next.prev = leaf.prev
+        leaf.next = leaf.prev = None
+
+    def find_leaf(self, key):
+        # descend to the leftmost leaf that may hold a key >= key (None means the first leaf)
+        node = self.root
+        while not node.is_leaf:
+            node = node.children[0 if key is None else bisect_left(node.keys, key)]
+        return node
+
+    def iter_from(self, key=None):
+        # stream the keys >= key in order: one descent, then follow the leaf chain
+        node = self.find_leaf(key)
+        i = 0 if key is None else bisect_left(node.keys, key)
+        while node is not None:
+            yield from node.keys[i:]
+            node = node.next
+            i = 0
+
+    def items(self, lo=None, hi=None):
+        # stream (key, value) pairs with lo <= key < hi in key order
+        node = self.find_leaf(lo)
+        i = 0 if lo is None else bisect_left(node.keys, lo)
+        while node is not None:
+            for key, value in zip(node.keys[i:], node.children[i:]):
+                if hi is not None and key >= hi:
+                    return
+                yield key, value if self.unique else list(value)
+            node = node.next
+            i = 0
+
+    def range(self, lo=None, hi=None):
+        # stream the keys in the half-open interval [lo, hi); None leaves that side unbounded
+        for key in self.iter_from(lo):
+            if hi is not None and key >= hi:
+                return
+            yield key
+
+    def __iter__(self):
+        return self.iter_from()
+
+    @staticmethod
+    def same_node(a, b):
+        # whether two references (or None) are the same node
+        return a is b
+
+    def check_invariants(self):
+        # raise AssertionError if key order, node occupancy, leaf depth or the leaf chain is broken
+        leaves = []
+
+        def check_node(node, lo, hi, depth, is_root):
+            assert len(node.keys) <= 2 * self.degree - 1, "node overflow"
+            assert is_root or len(node.keys) >= self.degree - 1, "node underflow"
+            assert all(node.keys[j] < node.keys[j + 1] for j in range(len(node.keys) - 1)), "keys out of order"
+            assert all((lo is None or key >= lo) and (hi is None or key < hi) for key in node.keys), \
+                "key outside its separators"
+            if node.is_leaf:
+                assert len(node.children) == len(node.keys), "leaf payloads out of step with keys"
+                leaves.append((node, depth))
+                return
+            assert len(node.children) == len(node.keys) + 1, "wrong number of children"
+            bounds = [lo] + list(node.keys) + [hi]
+            for j, child in enumerate(node.children):
+                check_node(child, bounds[j], bounds[j + 1], depth + 1, False)
+
+        check_node(self.root, None, None, 0, True)
+        assert len({depth for leaf, depth in leaves}) == 1, "leaves at different depths"
+        for left, right in zip(leaves, leaves[1:]):
+            assert self.same_node(left[0].next, right[0]) and self.same_node(right[0].prev, left[0]), \
+                "broken leaf chain"
+        assert leaves[0][0].prev is None and leaves[-1][0].next is None, "leaf chain has loose ends"
+
     def display(self):
-        display_result = []
-        self.display_method(self.root, display_result)
-        print(" ".join(map(str, display_result)))
+        print(" ".join(map(str, self.iter_from())))
 
-    def display_method(self, node, result_output):
-        if node.is_leaf:
-            result_output.extend(node.keys)
+
+class Page_List:
+    # child list of an internal Paged_Node: stores page ids, hands out nodes fetched through the buffer pool
+    def __init__(self, pool, ids=()):
+        self.pool = pool
+        self.ids = list(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Page_List(self.pool, self.ids[index])
+        return self.pool.fetch(self.ids[index])
+
+    def __iter__(self):
+        for page_id in list(self.ids):
+            yield self.pool.fetch(page_id)
+
+    def insert(self, index, node):
+        self.ids.insert(index, node.page_id)
+
+    def append(self, node):
+        self.ids.append(node.page_id)
+
+    def extend(self, nodes):
+        self.ids.extend(nodes.ids if isinstance(nodes, Page_List) else [node.page_id for node in nodes])
+
+    def pop(self, index=-1):
+        return self.pool.fetch(self.ids.pop(index))
+
+
+class Paged_Node:
+    # a Node that lives in one page of a Pager file; links to other nodes are page ids (-1 for none)
+    def __init__(self, pool, page_id, is_leaf=False):
+        self.pool = pool
+        self.page_id = page_id
+        self.is_leaf = is_leaf
+        self.keys = []
+        self.child_list = [] if is_leaf else Page_List(pool)  # values (leaf) or child page ids (internal)
+        self.next_id = -1
+        self.prev_id = -1
+
+    @property
+    def children(self):
+        return self.child_list
+
+    @children.setter
+    def children(self, items):
+        if self.is_leaf:
+            self.child_list = list(items)
+        else:
+            self.child_list = Page_List(self.pool)
+            self.child_list.extend(items)
+
+    @property
+    def next(self):
+        return None if self.next_id == -1 else self.pool.fetch(self.next_id)
+
+    @next.setter
+    def next(self, node):
+        self.next_id = -1 if node is None else node.page_id
+
+    @property
+    def prev(self):
+        return None if self.prev_id == -1 else self.pool.fetch(self.prev_id)
+
+    @prev.setter
+    def prev(self, node):
+        self.prev_id = -1 if node is None else node.page_id
+
+    def dump(self):
+        children = self.child_list if self.is_leaf else self.child_list.ids
+        return self.is_leaf, self.keys, children, self.next_id, self.prev_id
+
+
+class Pager:
+    # fixed-size pages in a single file; page 0 is the header, freed pages form a linked free list
+    HEADER = struct.Struct("<8sIIBqqq")  # magic, page size, degree, unique, root, page count, free list head
+    MAGIC = b"BPTREE01"
+
+    def __init__(self, path, page_size=4096, degree=4, unique=True):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        header = os.pread(self.fd, self.HEADER.size, 0)
+        if len(header) == self.HEADER.size:
+            magic, page_size, degree, unique, self.root_id, self.page_count, self.free_head = \
+                self.HEADER.unpack(header)
+            if magic != self.MAGIC:
+                os.close(self.fd)
+                raise ValueError(f"{path} is not a B+ tree page file")
+        else:
+            self.root_id, self.page_count, self.free_head = -1, 1, -1
+        # an existing file keeps the layout it was created with
+        self.page_size = page_size
+        self.degree = degree
+        self.unique = bool(unique)
+        self.reads = 0
+        self.writes = 0
+
+    def write_header(self):
+        header = self.HEADER.pack(self.MAGIC, self.page_size, self.degree, self.unique, self.root_id,
+                                  self.page_count, self.free_head)
+        os.pwrite(self.fd, header.ljust(self.page_size, b"\0"), 0)
+
+    def read_page(self, page_id):
+        self.reads += 1
+        return self.decode(os.pread(self.fd, self.page_size, page_id * self.page_size))
+
+    @staticmethod
+    def decode(data):
+        length = int.from_bytes(data[:4], "little")
+        return pickle.loads(data[4:4 + length])
+
+    def encode(self, page_id, record):
+        # the bytes of a page; ValueError when the record does not fit in one
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        if len(data) + 4 > self.page_size:
+            raise ValueError(f"page {page_id} needs {len(data) + 4} bytes but pages hold {self.page_size}; "
+                             f"use a smaller degree or a larger page_size")
+        return (len(data).to_bytes(4, "little") + data).ljust(self.page_size, b"\0")
+
+    def write_page(self, page_id, record):
+        self.write_data(page_id, self.encode(page_id, record))
+
+    def write_data(self, page_id, data):
+        self.writes += 1
+        os.pwrite(self.fd, data, page_id * self.page_size)
+
+    def read_node(self, page_id, pool):
+        return self.make_node(page_id, self.read_page(page_id), pool)
+
+    @staticmethod
+    def make_node(page_id, record, pool):
+        is_leaf, keys, children, next_id, prev_id = record
+        node = Paged_Node(pool, page_id, is_leaf)
+        node.keys = keys
+        node.child_list = children if is_leaf else Page_List(pool, children)
+        node.next_id, node.prev_id = next_id, prev_id
+        return node
+
+    def write_node(self, node):
+        self.write_page(node.page_id, node.dump())
+
+    def allocate(self):
+        if self.free_head != -1:
+            page_id = self.free_head
+            self.free_head = self.read_page(page_id)[1]
+            return page_id
+        self.page_count += 1
+        return self.page_count - 1
+
+    def free(self, page_id):
+        self.write_page(page_id, ("free", self.free_head))
+        self.free_head = page_id
+
+    def close(self):
+        self.write_header()
+        os.close(self.fd)
+
+
+class Buffer_Pool:
+    # at most `capacity` unpinned pages stay in memory; the least recently used one is evicted first
+    # and written back when dirty. During a write batch every fetched page is pinned and marked dirty,
+    # because split_node and re_balance_method change nodes in place.
+    # A batch is all or nothing. When it ends, each page it touched is encoded, which also proves the page
+    # fits; if one does not (a posting list that outgrew its leaf) or the batch raised, the pages are put
+    # back as they were and the error raised, so the pool never holds a page it cannot write back. Pages
+    # only change in batches, so the encoded bytes of a dirty page are what write-back writes and what a
+    # later failed batch restores it from; a clean page is read back from the file. An internal page a
+    # batch only walked through keeps its bytes (and stays clean): its keys and child ids are compared with
+    # a copy taken when it was fetched. Leaves are always encoded, their posting lists change in place.
+    def __init__(self, pager, capacity=64):
+        self.pager = pager
+        self.capacity = capacity
+        self.pages = OrderedDict()  # page id -> Paged_Node, least recently used first
+        self.dirty = set()
+        self.encoded = {}  # dirty page id -> its bytes as of the end of the batch that last changed it
+        self.pinned = set()
+        self.writing = False
+        self.before = {}  # during a batch: page id -> its bytes before the batch, None if the file has them
+        self.copies = {}  # during a batch: internal page id -> its keys and child ids when fetched
+        self.allocated = set()  # during a batch: pages it allocated
+        self.freed = []  # during a batch: pages to free when it succeeds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_backs = 0
+
+    def fetch(self, page_id):
+        node = self.pages.get(page_id)
+        if node is None:
+            self.misses += 1
+            node = self.pager.read_node(page_id, self)
+            self.pages[page_id] = node
+        else:
+            self.hits += 1
+            self.pages.move_to_end(page_id)
+        if self.writing:
+            if page_id not in self.before:
+                self.before[page_id] = self.encoded.get(page_id)
+                if not node.is_leaf:
+                    self.copies[page_id] = node.keys[:], node.child_list.ids[:], node.next_id, node.prev_id
+            self.pinned.add(page_id)
+            self.dirty.add(page_id)
+        self.evict(keep=page_id)
+        return node
+
+    def allocate(self, is_leaf=False):
+        # only inside a write batch
+        page_id = self.pager.allocate()
+        node = Paged_Node(self, page_id, is_leaf)
+        self.pages[page_id] = node
+        self.dirty.add(page_id)
+        self.before[page_id] = None
+        self.allocated.add(page_id)
+        self.pinned.add(page_id)
+        self.evict(keep=page_id)
+        return node
+
+    def free(self, page_id):
+        if self.writing:
+            self.freed.append(page_id)
+            return
+        self.pages.pop(page_id, None)
+        self.dirty.discard(page_id)
+        self.encoded.pop(page_id, None)
+        self.pinned.discard(page_id)
+        self.pager.free(page_id)
+
+    def evict(self, keep=None):
+        excess = len(self.pages) - self.capacity
+        if excess <= 0:
+            return
+        victims = []
+        for page_id in self.pages:
+            if page_id not in self.pinned and page_id != keep:
+                victims.append(page_id)
+                if len(victims) == excess:
+                    break
+        for page_id in victims:
+            # a page leaves the pool only once it is written
+            if page_id in self.dirty:
+                self.pager.write_data(page_id, self.encoded[page_id])
+                self.dirty.discard(page_id)
+                del self.encoded[page_id]
+                self.write_backs += 1
+            del self.pages[page_id]
+            self.evictions += 1
+
+    @contextmanager
+    def write_batch(self):
+        pager = self.pager
+        state = pager.root_id, pager.page_count, pager.free_head
+        self.writing = True
+        try:
+            yield
+            for page_id in self.before:
+                if page_id in self.freed:
+                    continue
+                node = self.pages[page_id]
+                copy = self.copies.get(page_id)
+                if copy is not None and copy == (node.keys, node.child_list.ids, node.next_id, node.prev_id):
+                    if self.before[page_id] is None:
+                        self.dirty.discard(page_id)
+                else:
+                    try:
+                        self.encoded[page_id] = pager.encode(page_id, node.dump())
+                    except ValueError as error:
+                        raise ValueError(f"{error}; the write was undone") from None
+        except BaseException:
+            self.roll_back(state)
+            raise
         else:
-            for i in range(len(node.children)):
-                self.display_method(node.children[i], result_output)
-                if i < len(node.keys):
-                    result_output.append(node.keys[i])
+            self.writing = False
+            for page_id in self.freed:
+                self.free(page_id)
+        finally:
+            self.writing = False
+            self.before = {}
+            self.copies = {}
+            self.allocated = set()
+            self.freed = []
+            self.pinned.clear()
+            self.evict()
+
+    def roll_back(self, state):
+        # the pages a failed batch touched as they were before it; the pages it allocated go back unused
+        for page_id in self.allocated:
+            self.pages.pop(page_id, None)
+            self.dirty.discard(page_id)
+            self.encoded.pop(page_id, None)
+        for page_id, data in self.before.items():
+            if page_id in self.allocated:
+                continue
+            if data is None:
+                self.pages[page_id] = self.pager.read_node(page_id, self)
+                self.dirty.discard(page_id)
+                self.encoded.pop(page_id, None)
+            else:
+                self.pages[page_id] = self.pager.make_node(page_id, self.pager.decode(data), self)
+                self.encoded[page_id] = data
+        self.pager.root_id, self.pager.page_count, self.pager.free_head = state
+
+    def flush(self):
+        for page_id in sorted(self.dirty):
+            self.pager.write_data(page_id, self.encoded.pop(page_id))
+            self.dirty.discard(page_id)
+            self.write_backs += 1
+        self.pager.write_header()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions, "write_backs": self.write_backs, "cached_pages": len(self.pages),
+                "capacity": self.capacity}
+
+
+class Disk_B_Plus_Tree(B_Plus_Tree):
+    # B_Plus_Tree whose nodes are pages of one file, read through a bounded Buffer_Pool.
+    # insert/search/delete/range and the split and re-balance logic are inherited unchanged.
+    def __init__(self, path, degree=4, unique=True, page_size=4096, pool_size=64):
+        self.pager = Pager(path, page_size, degree, unique)
+        self.degree = self.pager.degree
+        self.unique = self.pager.unique
+        self.pool = Buffer_Pool(self.pager, pool_size)
+        self.node_class = self.pool.allocate
+        if self.pager.root_id == -1:
+            with self.pool.write_batch():
+                self.root = self.node_class(is_leaf=True)
+
+    @property
+    def root(self):
+        return self.pool.fetch(self.pager.root_id)
+
+    @root.setter
+    def root(self, node):
+        self.pager.root_id = node.page_id
+
+    @classmethod
+    def bulk_load(cls, path, iterable, degree=4, fill_factor=1.0, presorted=False, values=None, unique=True,
+                  page_size=4096, pool_size=64):
+        # B_Plus_Tree.bulk_load into an empty page file: the pages of each level get their ids up front, so
+        # every page is written once, straight through the pager, and no node is held in memory.
+        # An existing file keeps its degree and unique setting.
+        tree = cls(path, degree, unique, page_size, pool_size)
+        root = tree.root
+        if not root.is_leaf or root.keys:
+            tree.close()
+            raise ValueError(f"{path} already holds keys; bulk_load fills an empty tree")
+        keys, payloads = cls.bulk_payloads(iterable, fill_factor, presorted, values, tree.unique)
+        degree = tree.degree
+        if len(keys) <= 2 * degree - 1:
+            with tree.pool.write_batch():
+                root = tree.root
+                root.keys = keys
+                root.children = payloads
+            tree.flush()
+            return tree
+        pager = tree.pager
+        tree.pool.free(pager.root_id)  # the empty root; its page is reused for the first leaf
+        below = lowest = None  # page ids and smallest keys of the level below
+        for depth, groups in enumerate(cls.bulk_levels(len(keys), degree, fill_factor)):
+            ids = [pager.allocate() for _ in groups]
+            for i, (start, end) in enumerate(groups):
+                node = Paged_Node(tree.pool, ids[i], is_leaf=depth == 0)
+                if depth == 0:
+                    node.keys = keys[start:end]
+                    node.child_list = payloads[start:end]
+                    node.prev_id = ids[i - 1] if i else -1
+                    node.next_id = ids[i + 1] if i + 1 < len(ids) else -1
+                else:
+                    node.keys = lowest[start + 1:end]
+                    node.child_list = Page_List(tree.pool, below[start:end])
+                pager.write_node(node)
+            lowest = [keys[start] if depth == 0 else lowest[start] for start, end in groups]
+            below = ids
+        pager.root_id = below[0]
+        tree.flush()
+        return tree
+
+    @staticmethod
+    def same_node(a, b):
+        # a page fetched again after it was evicted is a new object
+        return a is b or (a is not None and b is not None and a.page_id == b.page_id)
+
+    def put(self, key, value=None):
+        with self.pool.write_batch():
+            super().put(key, value)
+
+    def remove(self, key, value=None):
+        with self.pool.write_batch():
+            old_root = self.pager.root_id
+            found = super().remove(key, value)
+            if self.pager.root_id != old_root:
+                self.pool.free(old_root)
+        return found
+
+    def re_balance_method(self, parent, index):
+        # a merge drops one child from the parent; its page goes back to the free list
+        before = set(parent.children.ids)
+        super().re_balance_method(parent, index)
+        for page_id in before.difference(parent.children.ids):
+            self.pool.free(page_id)
+
+    def flush(self):
+        self.pool.flush()
+
+    def close(self):
+        self.pool.flush()
+        self.pager.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RW_Latch:
+    # many readers or one writer; waiting writers hold back new readers so they are not starved
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+class Latched_Node(Node):
+    def __init__(self, is_leaf=False):
+        super().__init__(is_leaf)
+        self.latch = RW_Latch()
+        self.version = 0  # bumped whenever a writer latches the node, lets range scans validate leaf hops
+
+
+class Latched_Compact_Node(Compact_Node):
+    __slots__ = ("latch", "version")
+
+    def __init__(self, is_leaf=False):
+        super().__init__(is_leaf)
+        self.latch = RW_Latch()
+        self.version = 0
+
+
+class Concurrent_B_Plus_Tree(B_Plus_Tree):
+    # thread-safe B_Plus_Tree using latch crabbing on the nodes:
+    # - readers latch top-down in shared mode and release the parent once the child is latched
+    # - put splits full nodes on the way down, so a writer only holds the current node and its child
+    # - remove keeps exclusive latches from the deepest node that cannot underflow down to the leaf
+    # - range scans release a leaf before latching the next one and re-descend if the leaf changed meanwhile
+    # Latches are only taken top-down, then left to right, so the protocol cannot deadlock.
+    def __init__(self, degree=4, unique=True, compact=False):
+        super().__init__(degree, unique, compact)
+        self.node_class = Latched_Compact_Node if compact else Latched_Node
+        self.root = self.node_class(is_leaf=True)
+        self.root_latch = RW_Latch()  # guards the root pointer itself
+
+    @staticmethod
+    def latch_write(node):
+        node.latch.acquire_write()
+        node.version += 1
+
+    def read_root(self):
+        # the current root, latched in shared mode
+        self.root_latch.acquire_read()
+        root = self.root
+        root.latch.acquire_read()
+        self.root_latch.release_read()
+        return root
+
+    def read_leaf(self, key, exact=True):
+        # crab down to the leaf for key and return it latched in shared mode; exact follows the point
+        # lookup path, otherwise the leftmost leaf that may hold a key >= key (None for the first leaf)
+        node = self.read_root()
+        while not node.is_leaf:
+            if key is None:
+                i = 0
+            else:
+                i = bisect_right(node.keys, key) if exact else bisect_left(node.keys, key)
+            child = node.children[i]
+            child.latch.acquire_read()
+            node.latch.release_read()
+            node = child
+        return node
+
+    def read_entry(self, key):
+        # (True, value) for a stored key, (False, None) otherwise; posting lists are copied under the latch
+        leaf = self.read_leaf(key)
+        try:
+            i = bisect_left(leaf.keys, key)
+            if i < len(leaf.keys) and leaf.keys[i] == key:
+                value = leaf.children[i]
+                return True, value if self.unique else list(value)
+            return False, None
+        finally:
+            leaf.latch.release_read()
+
+    def contains(self, key):
+        return self.read_entry(key)[0]
+
+    def get(self, key, default=None):
+        found, value = self.read_entry(key)
+        return value if found else default
+
+    def get_many(self, keys, default=None):
+        keys = list(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        sorted_keys = [keys[p] for p in order]
+        results = [default] * len(keys)
+        if keys:
+            root = self.read_root()
+            try:
+                self.get_many_method(root, sorted_keys, order, 0, len(keys), results)
+            finally:
+                root.latch.release_read()
+        return results
+
+    def get_many_method(self, node, sorted_keys, order, lo, hi, results):
+        # node is latched by the caller; every child is latched while its probes are resolved
+        if node.is_leaf:
+            super().get_many_method(node, sorted_keys, order, lo, hi, results)
+            return
+        start = lo
+        while start < hi:
+            i = bisect_right(node.keys, sorted_keys[start])
+            end = hi if i == len(node.keys) else bisect_left(sorted_keys, node.keys[i], start, hi)
+            child = node.children[i]
+            child.latch.acquire_read()
+            try:
+                self.get_many_method(child, sorted_keys, order, start, end, results)
+            finally:
+                child.latch.release_read()
+            start = end
+
+    def items(self, lo=None, hi=None):
+        last, after = lo, False  # where to resume: keys >= last, or keys > last once something was yielded
+        while True:
+            # resuming after `last` must take the point lookup path: a separator equal to `last` would send
+            # the leftmost descent one leaf too far left, and the leaf after it would repeat `last`
+            leaf = self.read_leaf(last, exact=after)
+            i = 0 if last is None else bisect_right(leaf.keys, last) if after else bisect_left(leaf.keys, last)
+            while True:
+                batch = list(zip(leaf.keys[i:], leaf.children[i:]))
+                next_leaf, version = leaf.next, leaf.version
+                leaf.latch.release_read()
+                for key, value in batch:
+                    if hi is not None and key >= hi:
+                        return
+                    yield key, value if self.unique else list(value)
+                    last, after = key, True
+                if next_leaf is None:
+                    return
+                next_leaf.latch.acquire_read()
+                if leaf.version != version:
+                    # a writer touched the leaf after we let go, so next_leaf may be stale: re-descend
+                    next_leaf.latch.release_read()
+                    break
+                leaf, i = next_leaf, 0
+
+    def iter_from(self, key=None):
+        for item in self.items(key):
+            yield item[0]
+
+    def put(self, key, value=None):
+        self.root_latch.acquire_write()
+        node = self.root
+        self.latch_write(node)
+        if self.is_root_full():
+            new_root = self.node_class()
+            self.latch_write(new_root)
+            new_root.children.append(node)
+            self.split_node(new_root, 0)
+            self.root = new_root
+            node.latch.release_write()
+            node = new_root
+        # the root is not full any more, so it cannot split and the root pointer stays put
+        self.root_latch.release_write()
+        while not node.is_leaf:
+            i = bisect_right(node.keys, key)
+            child = node.children[i]
+            self.latch_write(child)
+            if len(child.keys) == 2 * self.degree - 1:
+                self.split_node(node, i)
+                if key >= node.keys[i]:
+                    sibling = node.children[i + 1]
+                    self.latch_write(sibling)
+                    child.latch.release_write()
+                    child = sibling
+            node.latch.release_write()
+            node = child
+        try:
+            self.insert_not_full(node, key, value)
+        finally:
+            node.latch.release_write()
+
+    def split_node(self, parent, index):
+        # a leaf split also rewires the prev pointer of the right neighbour, which may sit under another parent
+        node = parent.children[index]
+        right = node.next if node.is_leaf else None
+        if right is not None:
+            self.latch_write(right)
+        try:
+            super().split_node(parent, index)
+        finally:
+            if right is not None:
+                right.latch.release_write()
+
+    def remove(self, key, value=None):
+        self.root_latch.acquire_write()
+        root_held = True
+        node = self.root
+        self.latch_write(node)
+        held = [node]  # exclusively latched nodes, top-down
+        path = []  # (parent, child index) for every held node below the first one
+        if node.is_leaf or len(node.keys) > 1:
+            # the root cannot collapse
+            self.root_latch.release_write()
+            root_held = False
+        try:
+            while not node.is_leaf:
+                i = bisect_right(node.keys, key)
+                child = node.children[i]
+                self.latch_write(child)
+                if len(child.keys) > self.degree - 1:
+                    # losing one key cannot underflow the child, so nothing above it will change
+                    for ancestor in held:
+                        ancestor.latch.release_write()
+                    held, path = [], []
+                    if root_held:
+                        self.root_latch.release_write()
+                        root_held = False
+                else:
+                    path.append((node, i))
+                held.append(child)
+                node = child
+            i = bisect_left(node.keys, key)
+            if i == len(node.keys) or node.keys[i] != key:
+                return False
+            if value is not None and not self.unique:
+                if value not in node.children[i]:
+                    return False
+                if len(node.children[i]) > 1:
+                    node.children[i].remove(value)
+                    return True
+            del node.keys[i]
+            del node.children[i]
+            for parent, index in reversed(path):
+                if len(parent.children[index].keys) >= self.degree - 1:
+                    break
+                self.re_balance_method(parent, index)
+            if root_held and not self.root.is_leaf and not self.root.keys:
+                self.root = self.root.children[0]
+            return True
+        finally:
+            for node in held:
+                node.latch.release_write()
+            if root_held:
+                self.root_latch.release_write()
+
+    def re_balance_method(self, parent, index):
+        # parent and child are held; latch the siblings and, for leaves, the right neighbour of the pair
+        # that may merge, since unlinking a leaf rewires that neighbour's prev pointer
+        child = parent.children[index]
+        neighbours = [parent.children[j] for j in (index - 1, index + 1) if 0 <= j < len(parent.children)]
+        for sibling in neighbours:
+            self.latch_write(sibling)
+        if child.is_leaf:
+            outer = (parent.children[index + 1] if index + 1 < len(parent.children) else child).next
+            if outer is not None:
+                self.latch_write(outer)
+                neighbours.append(outer)
+        try:
+            super().re_balance_method(parent, index)
+        finally:
+            for sibling in neighbours:
+                sibling.latch.release_write()
+
+
+'''Benchmark Part'''
+def benchmark_degree(n=200000, degrees=(4, 16, 64, 128, 256, 512), seed=3170):
+    # insert and search throughput (operations per second) for each degree on the same random keys
+    import random
+    rng = random.Random(seed)
+    keys = rng.sample(range(n * 10), n)
+    probes = rng.sample(keys, min(n, 100000))
+    print(f"{'degree':>8} {'insert ops/s':>14} {'search ops/s':>14}")
+    for degree in degrees:
+        tree = B_Plus_Tree(degree=degree)
+        start = time.perf_counter()
+        for key in keys:
+            tree.insert(key)
+        insert_rate = n / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for key in probes:
+            tree.contains(key)
+        search_rate = len(probes) / (time.perf_counter() - start)
+        print(f"{degree:>8} {insert_rate:>14,.0f} {search_rate:>14,.0f}")
+
+
+def benchmark_bulk_load(n=500000, degree=64, seed=3170):
+    # building the same tree with repeated insert() against one bottom-up bulk_load()
+    import random
+    keys = random.Random(seed).sample(range(n * 10), n)
+    start = time.perf_counter()
+    tree = B_Plus_Tree(degree=degree)
+    for key in keys:
+        tree.insert(key)
+    insert_time = time.perf_counter() - start
+    start = time.perf_counter()
+    B_Plus_Tree.bulk_load(keys, degree=degree)
+    unsorted_time = time.perf_counter() - start
+    sorted_keys = sorted(keys)
+    start = time.perf_counter()
+    B_Plus_Tree.bulk_load(sorted_keys, degree=degree, presorted=True)
+    sorted_time = time.perf_counter() - start
+    print(f"{n} keys, degree {degree}:")
+    print(f"  repeated insert()      {insert_time:8.3f} s")
+    print(f"  bulk_load (unsorted)   {unsorted_time:8.3f} s  ({insert_time / unsorted_time:.1f}x)")
+    print(f"  bulk_load (presorted)  {sorted_time:8.3f} s  ({insert_time / sorted_time:.1f}x)")
+
+
+def benchmark_search_many(n=500000, batch=50000, degree=64, seed=3170):
+    # one get_many/search_many batch against a loop of single-key lookups; search() itself prints every
+    # result, so the loop uses its silent counterparts get() and contains()
+    import random
+    rng = random.Random(seed)
+    tree = B_Plus_Tree.bulk_load(range(0, 2 * n, 2), degree=degree, values=range(n), presorted=True)
+    workloads = {
+        "random": [rng.randrange(2 * n) for _ in range(batch)],
+        "clustered": [2 * n // 3 + k for k in range(batch)],
+    }
+    print(f"{n} keys, degree {degree}, {batch} probes per batch:")
+    for name, probes in workloads.items():
+        start = time.perf_counter()
+        single = [tree.get(key) for key in probes]
+        get_time = time.perf_counter() - start
+        start = time.perf_counter()
+        batched = tree.get_many(probes)
+        get_many_time = time.perf_counter() - start
+        assert single == batched
+        start = time.perf_counter()
+        found = [tree.contains(key) for key in probes]
+        contains_time = time.perf_counter() - start
+        start = time.perf_counter()
+        assert tree.search_many(probes) == found
+        search_many_time = time.perf_counter() - start
+        print(f"  {name:>9}: get loop {get_time:.3f} s, get_many {get_many_time:.3f} s "
+              f"({get_time / get_many_time:.1f}x); contains loop {contains_time:.3f} s, "
+              f"search_many {search_many_time:.3f} s ({contains_time / search_many_time:.1f}x)")
+
+
+def benchmark_concurrent(thread_counts=(1, 2, 4, 8), n=100000, ops_per_thread=50000, write_ratio=0.1,
+                         degree=64, seed=3170):
+    # total throughput of a mixed get/put/remove workload, Concurrent_B_Plus_Tree against a plain
+    # B_Plus_Tree behind one global lock; on CPython the GIL caps what extra threads can add
+    import random
+
+    def run(tree, call, threads):
+        def worker(worker_seed):
+            rng = random.Random(worker_seed)
+            for _ in range(ops_per_thread):
+                key = rng.randrange(2 * n)
+                roll = rng.random()
+                if roll < write_ratio / 2:
+                    call(tree.put, key, key)
+                elif roll < write_ratio:
+                    call(tree.remove, key)
+                else:
+                    call(tree.get, key)
+        pool = [threading.Thread(target=worker, args=(seed + t,)) for t in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        return threads * ops_per_thread / (time.perf_counter() - start)
+
+    global_lock = threading.Lock()
+
+    def locked_call(method, *args):
+        with global_lock:
+            return method(*args)
+
+    def direct_call(method, *args):
+        return method(*args)
+
+    print(f"{n} keys, degree {degree}, {write_ratio:.0%} writes, {ops_per_thread} ops per thread:")
+    print(f"{'threads':>8} {'global lock ops/s':>18} {'latch crabbing ops/s':>21}")
+    for threads in thread_counts:
+        locked_tree = B_Plus_Tree.bulk_load(range(0, 2 * n, 2), degree=degree)
+        latched_tree = Concurrent_B_Plus_Tree.bulk_load(range(0, 2 * n, 2), degree=degree)
+        locked_rate = run(locked_tree, locked_call, threads)
+        latched_rate = run(latched_tree, direct_call, threads)
+        print(f"{threads:>8} {locked_rate:>18,.0f} {latched_rate:>21,.0f}")
+
+
+def stress_test_concurrent(writers=4, readers=4, rounds=3000, stable=2000, degree=3, seed=3170):
+    # writers churn their own keys while readers check that keys nobody touches never go missing and that
+    # range scans stay sorted; the final tree must match what the writers left behind
+    import random
+    tree = Concurrent_B_Plus_Tree.bulk_load(range(0, 2 * stable, 2), degree=degree, values=range(0, 2 * stable, 2))
+    final = [dict() for _ in range(writers)]
+    errors = []
+
+    def writer(w):
+        rng = random.Random(seed + w)
+        mine = final[w]
+        for _ in range(rounds):
+            key = 2 * (writers * rng.randrange(stable) + w) + 1  # odd keys, each writer owns its own
+            if rng.random() < 0.6:
+                tree.put(key, -key)
+                mine[key] = -key
+            else:
+                tree.remove(key)
+                mine.pop(key, None)
+
+    def reader(r):
+        rng = random.Random(seed + 100 + r)
+        try:
+            for _ in range(rounds // 4):
+                key = 2 * rng.randrange(stable)
+                assert tree.get(key) == key, f"stable key {key} went missing"
+                lo = 2 * rng.randrange(stable)
+                scanned = list(tree.range(lo, lo + 60))
+                assert all(a < b for a, b in zip(scanned, scanned[1:])), "range scan out of order"
+                assert set(range(lo, min(lo + 60, 2 * stable), 2)) <= set(scanned), "range scan lost keys"
+                probes = [2 * rng.randrange(stable) for _ in range(20)]
+                assert tree.get_many(probes) == probes, "get_many lost stable keys"
+        except AssertionError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    threads += [threading.Thread(target=reader, args=(r,)) for r in range(readers)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)  # hand the GIL over often so the threads really interleave
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert not errors, errors[0]
+    expected = {key: key for key in range(0, 2 * stable, 2)}
+    for mine in final:
+        expected.update(mine)
+    assert list(tree.items()) == sorted(expected.items())
+    tree.check_invariants()
+    print(f"concurrent stress test passed: {writers} writers, {readers} readers, {len(expected)} keys left")
+
+
+def benchmark_memory(sizes=(1000000, 10000000), degree=64):
+    # traced memory held by a bulk-loaded tree of integer keys, generic Node against Compact_Node
+    import gc
+    import tracemalloc
+    print(f"{'keys':>10} {'layout':>8} {'tree MB':>10} {'peak MB':>10} {'bytes/key':>10}")
+    for n in sizes:
+        for compact in (False, True):
+            gc.collect()
+            tracemalloc.start()
+            # keys above the small-int cache so the generic layout pays for its int objects
+            tree = B_Plus_Tree.bulk_load(range(10 ** 9, 10 ** 9 + n), degree=degree, presorted=True,
+                                         compact=compact)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            layout = "compact" if compact else "generic"
+            print(f"{n:>10} {layout:>8} {current / 2 ** 20:>10.1f} {peak / 2 ** 20:>10.1f} {current / n:>10.1f}")
+            del tree
 
 
 '''Test Part'''
-# Create a B+ Tree with a specified degree.
-tree = B_Plus_Tree(degree=4)
-# Insertion
-tree.insert(10)
-tree.insert(20)
-tree.insert(5)
-tree.insert(15)
-# Search
-result = tree.search(15)
-# Deletion
-tree.delete(10)
-# Display the elements in the tree
-tree.display()
+if __name__ == "__main__":
+    # Create a B+ Tree with a specified degree.
+    tree = B_Plus_Tree(degree=4)
+    # Insertion
+    tree.insert(10)
+    tree.insert(20)
+    tree.insert(5)
+    tree.insert(15)
+    # Search
+    result = tree.search(15)
+    # Deletion
+    tree.delete(10)
+    # Display the elements in the tree
+    tree.display()
+    # Range scans over the leaf chain
+    big_tree = B_Plus_Tree(degree=3)
+    for k in range(100, 0, -1):
+        big_tree.insert(k)
+    assert list(big_tree) == list(range(1, 101))
+    assert list(big_tree.range(20, 30)) == list(range(20, 30))
+    assert list(big_tree.iter_from(95)) == [95, 96, 97, 98, 99, 100]
+    for k in range(1, 101, 2):
+        big_tree.delete(k)
+    assert list(big_tree) == list(range(2, 101, 2))
+    assert list(big_tree.range(None, 11)) == [2, 4, 6, 8, 10]
+    print(list(big_tree.range(40, 50)))
+    # Bulk loading builds the same key order and stays usable for inserts and deletes
+    loaded_tree = B_Plus_Tree.bulk_load(range(500, 0, -1), degree=3, fill_factor=0.7)
+    assert list(loaded_tree) == list(range(1, 501))
+    loaded_tree.insert(0)
+    loaded_tree.delete(250)
+    assert loaded_tree.contains(0) and not loaded_tree.contains(250)
+    # Key -> value payloads: index the Players rows by player_id and by (season, team)
+    import csv
+    with open("DB_System_NBA/Player_Totals.csv", encoding="gbk") as player_file:
+        player_rows = list(csv.DictReader(player_file))
+    by_player = B_Plus_Tree(degree=32, unique=False)
+    for row_id, row in enumerate(player_rows):
+        by_player.put(int(row["player_id"]), row_id)
+    by_season_team = B_Plus_Tree.bulk_load([(int(row["season"]), row["team"]) for row in player_rows], degree=32,
+                                           values=range(len(player_rows)), unique=False)
+    lakers_2023 = by_season_team.get((2023, "LAL"))
+    assert lakers_2023 and all(player_rows[r]["team"] == "LAL" for r in lakers_2023)
+    first_id = int(player_rows[0]["player_id"])
+    assert 0 in by_player.get(first_id)
+    print(f"{len(lakers_2023)} LAL rows in 2023, player {first_id} has rows {by_player.get(first_id)}")
+    scores = B_Plus_Tree(degree=3)
+    for k in range(20):
+        scores.put(k, k * k)
+    scores.put(4, -1)
+    assert scores.get(4) == -1 and scores.get(99, "missing") == "missing"
+    assert list(scores.items(3, 6)) == [(3, 9), (4, -1), (5, 25)]
+    # Batched lookups keep the order of the probes, including repeats and misses
+    assert scores.get_many([19, 4, 50, 0, 19], default="missing") == [361, -1, "missing", 0, 361]
+    assert by_season_team.search_many([(2023, "LAL"), (1990, "LAL"), (2015, "BOS")]) == [True, False, True]
+    scores.check_invariants()
+    by_season_team.check_invariants()
+    # Concurrent readers and writers on one tree
+    stress_test_concurrent()
+    # Compact layout: __slots__ nodes with int64 key buffers behave like the generic layout
+    compact_tree = B_Plus_Tree(degree=3, compact=True)
+    for k in range(200, 0, -1):
+        compact_tree.put(k, str(k))
+    for k in range(1, 201, 3):
+        compact_tree.delete(k)
+    assert list(compact_tree.range(10, 20)) == [k for k in range(10, 20) if k % 3 != 1]
+    assert compact_tree.get(200) == "200" and compact_tree.get(199) is None
+    compact_loaded = B_Plus_Tree.bulk_load(range(1000), degree=8, compact=True)
+    assert isinstance(compact_loaded.root.keys, array) and list(compact_loaded) == list(range(1000))
+    # Disk-backed tree: a small buffer pool forces evictions and write-backs, the file survives a reopen
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_path = os.path.join(tmp_dir, "players.idx")
+        expected = B_Plus_Tree(degree=8, unique=False)
+        with Disk_B_Plus_Tree(index_path, degree=8, unique=False, pool_size=8) as disk_tree:
+            for target in (disk_tree, expected):
+                for row_id, row in enumerate(player_rows):
+                    target.put((int(row["season"]), int(row["player_id"])), row_id)
+                for row_id in range(0, len(player_rows), 2):
+                    row = player_rows[row_id]
+                    assert target.remove((int(row["season"]), int(row["player_id"])), row_id)
+            print("buffer pool after load:", disk_tree.pool.stats())
+        with Disk_B_Plus_Tree(index_path, pool_size=8) as disk_tree:
+            assert list(disk_tree.items()) == list(expected.items())
+            assert list(disk_tree.range((2020, 0), (2021, 0))) == list(expected.range((2020, 0), (2021, 0)))
+            disk_tree.check_invariants()
+        # bulk_load writes each page of a new file once
+        loaded_path = os.path.join(tmp_dir, "loaded.idx")
+        rows_by_key = [((int(row["season"]), int(row["player_id"])), row_id) for row_id, row in enumerate(player_rows)]
+        with Disk_B_Plus_Tree.bulk_load(loaded_path, [key for key, _ in rows_by_key], degree=8,
+                                        values=[row_id for _, row_id in rows_by_key], unique=False,
+                                        fill_factor=0.8, pool_size=8) as disk_tree:
+            disk_tree.check_invariants()
+            print("pages written by bulk_load:", disk_tree.pager.writes)
+        loaded = B_Plus_Tree.bulk_load([key for key, _ in rows_by_key], degree=8,
+                                       values=[row_id for _, row_id in rows_by_key], unique=False)
+        with Disk_B_Plus_Tree(loaded_path, pool_size=8) as disk_tree:
+            assert list(disk_tree.items()) == list(loaded.items())
+            disk_tree.check_invariants()
+        # a posting list that outgrows its page is refused and undone, the file stays readable
+        hot_path = os.path.join(tmp_dir, "hot.idx")
+        with Disk_B_Plus_Tree(hot_path, degree=8, unique=False, pool_size=8) as disk_tree:
+            postings = 0
+            try:
+                while True:
+                    disk_tree.put((2023, 1610612747), postings)
+                    postings += 1
+            except ValueError as error:
+                print("hot key refused after", postings, "postings:", error)
+            assert disk_tree.get((2023, 1610612747)) == list(range(postings))
+            disk_tree.check_invariants()
+        with Disk_B_Plus_Tree(hot_path, pool_size=8) as disk_tree:
+            assert disk_tree.get((2023, 1610612747)) == list(range(postings))
+            disk_tree.check_invariants()
+    # Run the benchmarks with: python B+Tree.py bench
+    if "bench" in sys.argv[1:]:
+        benchmark_degree()
+        benchmark_bulk_load()
+        benchmark_search_many()
+        benchmark_concurrent()
+        benchmark_memory()
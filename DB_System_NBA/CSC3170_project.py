@@ -1,24 +1,50 @@
-import sqlite3
-import pandas as pd
+from db_bootstrap import create_meta_tables, refresh_statistics, sync_csv, sync_indexes
+from db_cache import get_cache
+from db_pool import get_connection
+from db_results import write_rows
+from nba_aggregates import sync_aggregates
+from nba_sessions import get_sessions
+from nba_store import NBAStore
 
 # Database System file
 db_file = 'NBA_STATS.db'
 csv_player = 'Player_Totals.csv'
-df_player = pd.read_csv(csv_player, encoding='gbk')
 csv_team = 'Team_Totals.csv'
-df_team = pd.read_csv(csv_team, encoding='gbk')
 csv_user = 'Users_Totals.csv'
-df_user = pd.read_csv(csv_user, encoding='gbk')
+# bumped whenever the table definitions below change; an older database is rebuilt from the CSV files
+schema_version = 1
+player_columns = ['season', 'player_id', 'player', 'position', 'age', 'team', 'total_points',
+                  'field_goals_percent', 'three_points_percent', 'two_points_percent', 'free_throw_percent',
+                  'total_rebound', 'assist', 'steal', 'block', 'turnover', 'personal_foul']
+team_columns = ['season', 'team', 'playoffs', 'total_points', 'field_goals_percent', 'three_points_percent',
+                'two_points_percent', 'free_throw_percent', 'total_rebound', 'assist', 'steal', 'block',
+                'turnover', 'personal_foul']
+# secondary indexes for the lookups below, name -> (table, columns); initialize_data() creates the missing
+# ones and drops any other idx_ index, so this is the complete set. The primary keys already serve the
+# season-first filters on Players and Teams and the username lookups on Users.
+indexes = {
+    'idx_players_player_season': ('Players', ('player', 'season')),
+    'idx_players_team_season': ('Players', ('team', 'season')),
+    'idx_players_season_age_position': ('Players', ('season', 'age', 'position')),
+    'idx_teams_team': ('Teams', ('team',)),
+    'idx_users_role_team': ('Users', ('role', 'team')),
+    'idx_users_team': ('Users', ('team',)),
+}
 
 
 def initialize_data():
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     cursor = conn.cursor()
+    if cursor.execute('PRAGMA user_version').fetchone()[0] != schema_version:
+        # tables from an older layout (or from to_sql) are dropped and loaded again from the CSV files
+        for table in ('Players', 'Teams', 'Users', 'csv_rows', 'csv_sources'):
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
     # Create a table Players to store the data of players.
+    # A player traded during a season has one row per team.
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS Players (
         season INTEGER,
-        player_id INTEGER PRIMARY KEY,
+        player_id INTEGER,
         player TEXT,
         position TEXT,
         age INTEGER,
@@ -34,15 +60,16 @@ def initialize_data():
         block INTEGER,
         turnover INTEGER,
         personal_foul INTEGER,
-        FOREIGN KEY (team) REFERENCES Teams (team)
+        PRIMARY KEY (season, player_id, team),
+        FOREIGN KEY (season, team) REFERENCES Teams (season, team)
     )
     ''')
 
-    # Create a table Teams to store the data of teams.
+    # Create a table Teams to store the data of teams (one row per team and season).
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS Teams (
         season INTEGER,
-        team TEXT PRIMARY KEY,
+        team TEXT,
         playoffs INTEGER,
         total_points INTEGER,
         field_goals_percent REAL,
@@ -54,7 +81,8 @@ def initialize_data():
         steal INTEGER,
         block INTEGER,
         turnover INTEGER,
-        personal_foul INTEGER
+        personal_foul INTEGER,
+        PRIMARY KEY (season, team)
     )
     ''')
 
@@ -68,395 +96,266 @@ def initialize_data():
         team TEXT
     )
     ''')
+    sync_indexes(conn, indexes)
+    create_meta_tables(conn)
+    cursor.execute(f'PRAGMA user_version = {schema_version}')
     conn.commit()
-    conn.close()
 
 
-# import the data into the db system.
-def import_data():
-    conn = sqlite3.connect(db_file)
-    df_player.to_sql('Players', conn, if_exists='replace', index=False)
-    df_team.to_sql('Teams', conn, if_exists='replace', index=False)
-    df_user.to_sql('Users', conn, if_exists='replace', index=False)
-    conn.commit()
-    conn.close()
+# import the data into the db system: only the CSV files changed since the last import are read, and only
+# their changed rows are written. Users registered in the system are kept. workers > 0 parses the files in
+# that many processes (db_ingest); a reports dict gets the sync_csv report of each file read, by table.
+def import_data(force=False, workers=0, reports=None):
+    conn = get_connection(db_file)
+    # the triggers of the team-season and leaderboard rollups (nba_aggregates) keep them up to date through
+    # the import, except on a first load: that one fills Players without them and builds the rollups once
+    # at the end, which is far cheaper than row by row
+    if conn.execute('SELECT 1 FROM Players LIMIT 1').fetchone() is not None:
+        sync_aggregates(conn)
+    changed = {}
+    for table, path, key_columns in (('Teams', csv_team, ['season', 'team']),
+                                     ('Players', csv_player, ['season', 'player_id', 'team']),
+                                     # a player traded during the season is listed once per team; the last
+                                     # row (the current team) is kept
+                                     ('Users', csv_user, ['user_id'])):
+        report = {}
+        changed[table] = sync_csv(conn, table, path, key_columns, force, indexes=indexes, workers=workers,
+                                  report=report)
+        if report and reports is not None:
+            reports[table] = report
+        if report.get('invalid'):
+            print(f"{path}: {report['invalid']} invalid row(s) skipped")
+            for line, message, _ in report['errors']:
+                print(f"  line {line}: {message}" if line else f"  {message}")
+    rebuilt = sync_aggregates(conn)
+    if any(changed.values()) or rebuilt:
+        refresh_statistics(conn)
+        conn.commit()
+        # the rows changed underneath the result cache, and the users underneath their sessions
+        get_cache(db_file).clear()
+        if changed['Users']:
+            get_sessions(db_file).revalidate(NBAStore(db_file).get_user)
+    return changed
 
 
-# initialize the database(running this can recover the db)
-initialize_data()
-import_data()
+# initialize the database, a no-op when it is up to date with the CSV files (force=True reloads every row,
+# which can recover the db)
+def bootstrap(force=False):
+    initialize_data()
+    return import_data(force)
 
 
 # register for the new users
 def register_user(player_id, username, password, team):
     role = 'player'
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT username FROM Users WHERE username = ?
-    ''', (username,))
-    if cursor.fetchone():
+    store = NBAStore(db_file)
+    if store.username_exists(username):
         print(f"User name {username} has been used. Please use another user name.")
-        conn.close()
         return
-    cursor.execute('''
-        SELECT team FROM Teams WHERE team = ?
-    ''', (team,))
-    if not cursor.fetchone():
+    if not store.team_exists(team):
         print(f"Team {team} does not exist in the database. Please enter a valid team.")
-        conn.close()
         return
-    try:
-        cursor.execute('''
-            INSERT INTO Users (user_id, username, password, role, team)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (player_id, username, password, role, team))
-        conn.commit()
+    if store.add_user(player_id, username, password, role, team):
         print(f"User {username} (Player ID: {player_id}) has been registered successfully.")
-        conn.close()
         return True
-    except sqlite3.IntegrityError:
+    else:
         print(f"User name {username} has been used. Please use another user name.")
-        conn.close()
         return False
 
 
-# login for the users
+# login for the users: returns a session (nba_sessions) holding the role and team, which every operation of
+# the menus is authorized with instead of looking the user up again
 def login_user(username, password):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            SELECT password, role FROM Users WHERE username = ?
-        ''', (username,))
-        result = cursor.fetchone()
-        if result is None:
-            print("The user name does not exist")
-            return None
-        stored_password, role = result
-        if password == str(stored_password):
-            print(f"The user {username} logged in successfully, role: {role}")
-            return role
-        else:
-            print("The password is wrong!")
-            return None
-    finally:
-        conn.close()
+    result = NBAStore(db_file).get_credentials(username)
+    if result is None:
+        print("The user name does not exist")
+        return None
+    stored_password, role, team = result
+    if password == str(stored_password):
+        print(f"The user {username} logged in successfully, role: {role}")
+        return get_sessions(db_file).create(username, role, team)
+    else:
+        print("The password is wrong!")
+        return None
+
+
+def is_live(session):
+    # a session ends at logout, after nba_sessions.session_ttl seconds unused, or when its user is deleted
+    # or changed
+    if get_sessions(db_file).get(session.token) is None:
+        print("Your session has ended, please log in again.")
+        return False
+    return True
 
 
-def view_all_teams(admin_username):
+def is_admin(session):
+    if not is_live(session):
+        return False
+    if session.role != 'admin':
+        print("Only admin can do this operation.")
+        return False
+    return True
+
+
+def view_all_teams(session):
+    if not is_admin(session):
+        return
     year = input("Please input the season(remain blank will return all years): ")
     team_name = input("Please input the Team Name(remain blank will return all teams): ")
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    if year and team_name:
-        cursor.execute('SELECT * FROM Teams WHERE season = ? AND team = ?', (year, team_name))
-    elif year:
-        cursor.execute('SELECT * FROM Teams WHERE season = ?', (year,))
-    elif team_name:
-        cursor.execute('SELECT * FROM Teams WHERE team = ?', (team_name,))
-    else:
-        cursor.execute('SELECT * FROM Teams')
-    teams = cursor.fetchall()
-    print(f"{admin_username} can check the information of all teams:")
-    print('Title for output: ', '\n', list(df_team.columns))
-    for team in teams:
-        print(team)
-    conn.close()
+    print(f"{session.username} can check the information of all teams:")
+    print('Title for output: ', '\n', team_columns)
+    write_rows(NBAStore(db_file).find_teams(season=year or None, team=team_name or None))
 
 
-def view_all_players(admin_username):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+def view_all_players(session):
+    if not is_admin(session):
+        return
     player_name = input("Please input the Player name(Blank will return all players): ")
     season = input("Please input the season(Blank will return all seasons): ")
-    if player_name and season:
-        cursor.execute('''
-                SELECT * FROM Players WHERE player = ? AND season = ?
-            ''', (player_name, int(season)))
-    elif player_name:
-        cursor.execute('''
-                SELECT * FROM Players WHERE player = ?
-            ''', (player_name,))
-    elif season:
-        cursor.execute('''
-                SELECT * FROM Players WHERE season = ?
-            ''', (int(season),))
-    else:
-        cursor.execute('SELECT * FROM Players')
-    players = cursor.fetchall()
-    print(f"{admin_username} can check the information of all players: ")
-    print('Title for output: ', '\n', list(df_player.columns))
-    for player in players:
-        print(player)
-    conn.close()
+    print(f"{session.username} can check the information of all players: ")
+    print('Title for output: ', '\n', player_columns)
+    write_rows(NBAStore(db_file).find_players(player=player_name or None, season=int(season) if season else None))
 
 
-def view_all_users(admin_username):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+def view_all_users(session):
+    if not is_admin(session):
+        return
     username = input("Please enter a username to filter (leave blank for all usernames): ")
     role = input("Please enter a role to filter (leave blank for all roles): ")
     team = input("Please enter a team to filter (leave blank for all teams): ")
-    query = "SELECT user_id, username, role, team FROM Users WHERE 1=1"
-    params = []
-    if username:
-        query += " AND username = ?"
-        params.append(username)
-    if role:
-        query += " AND role = ?"
-        params.append(role)
-    if team:
-        query += " AND team = ?"
-        params.append(team)
-    cursor.execute(query, tuple(params))
-    users = cursor.fetchall()
-    print(f"{admin_username} can view the following user information:")
+    print(f"{session.username} can view the following user information:")
     print("user_id | username | role | team")
-    for user in users:
-        print(user)
-    conn.close()
+    write_rows(NBAStore(db_file).find_users(username=username or None, role=role or None, team=team or None))
 
 
-def delete_user(admin_username):
+def delete_user(session):
+    if not is_admin(session):
+        return
     target_username = input("Please input the username to delete: ")
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM Users WHERE username = ?', (target_username,))
-    conn.commit()
-    print(f"User {target_username} has been deleted by {admin_username}")
-    conn.close()
+    NBAStore(db_file).delete_user(target_username)
+    print(f"User {target_username} has been deleted by {session.username}")
 
 
-def update_player_team():
+def update_player_team(session):
+    if not is_admin(session):
+        return
     player = input("Please input the Player's name: ")
     new_team = input("Please input the new Team's name: ")
     current_year = 2023
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT season, player_id, player, position, age 
-        FROM Players 
-        WHERE player = ? AND season = ?
-    ''', (player, current_year))
-    player_info = cursor.fetchone()
+    store = NBAStore(db_file)
+    player_info = store.get_player(player, current_year)
     if not player_info:
         print(f"No record found for player {player} in {current_year}.")
-        conn.close()
         return
     season, player_id, player, position, age = player_info
-    cursor.execute('''
-        INSERT INTO Players (season, player_id, player, position, age, team, total_points, field_goals_percent,
-                             three_points_percent, two_points_percent, free_throw_percent, total_rebound, assist,
-                             steal, block, turnover, personal_foul)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (season, player_id, player, position, age, new_team, 0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0, 0, 0, 0))
-    conn.commit()
+    if not store.add_player_team(season, player_id, player, position, age, new_team):
+        print(f"Player {player} already has a record with team {new_team} in {current_year}.")
+        return
     print(f"Player {player} has been added to team {new_team} for the {current_year} season.")
-    cursor.execute('''
-        SELECT * FROM Players WHERE player = ? AND season = ?
-    ''', (player, current_year))
-    all_records = cursor.fetchall()
     print(f"All records for player {player} in {current_year}:")
-    for record in all_records:
-        print(record)
-    conn.close()
+    write_rows(store.find_players(player=player, season=current_year))
 
 
-def update_team_playoffs():
+def update_team_playoffs(session):
+    if not is_admin(session):
+        return
     team = input("Please input the Team's name: ")
     season = int(input("Please input the season year: "))
     playoffs = int(input("Enter playoffs status(1 for yes, 0 for no): "))
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE Teams SET playoffs = ? WHERE team = ? AND season = ?', (playoffs, team, season))
-    conn.commit()
+    store = NBAStore(db_file)
+    store.set_playoffs(team, season, playoffs)
     print(f"Updated record for team {team} in season {season}:")
-    cursor.execute('''
-            SELECT * FROM Teams WHERE team = ? AND season = ?
-        ''', (team, season))
-    updated_team_info = cursor.fetchone()
-    print(updated_team_info)
-    conn.close()
+    print(store.get_team(team, season))
 
 
-def delete_player():
+def delete_player(session):
+    if not is_admin(session):
+        return
     player = input("Please input the Player Name: ")
     season = int(input("Please input the season year: "))
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM Players WHERE player = ? AND season = ?', (player, season))
-    conn.commit()
+    NBAStore(db_file).delete_players(player, season)
     print(f"The player {player} from season {season} has been deleted.")
-    conn.close()
 
 
-def is_scout(username):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    # check whether the user is a scout.
-    cursor.execute('''
-        SELECT team, role FROM Users WHERE username = ?
-    ''', (username,))
-    result = cursor.fetchone()
-    conn.close()
-    if result is None:
-        print("The user does not exist.")
+def is_scout(session):
+    # the team of a live scout session, else None
+    if not is_live(session):
         return None
-    team, role = result
-    if role != 'scout':
+    if session.role != 'scout':
         print("Only scout can do this operation.")
         return None
-    return team
+    return session.team
 
 
-def view_scout_team_players(username):
-    team = is_scout(username)
+def view_scout_team_players(session):
+    team = is_scout(session)
     if team is None:
         return
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
     player_name = input("Please input the Player name(Blank will return all players): ")
     season = input("Please input the season(Blank will return all seasons): ")
-    if player_name and season:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ? AND player = ? AND season = ?
-            ''', (team, player_name, int(season)))
-    elif player_name:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ? AND player = ?
-            ''', (team, player_name))
-    elif season:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ? AND season = ?
-            ''', (team, int(season)))
-    else:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ?
-            ''', (team,))
-    players = cursor.fetchall()
-    print(f"{username} can check the data of player from team {team}")
-    print('Title for output: ', '\n', list(df_player.columns))
-    for player in players:
-        print(player)
-    conn.close()
-
-
-def view_young_players(username):
-    if is_scout(username) is None:
+    print(f"{session.username} can check the data of player from team {team}")
+    print('Title for output: ', '\n', player_columns)
+    write_rows(NBAStore(db_file).find_players(player=player_name or None, season=int(season) if season else None,
+                                              team=team))
+
+
+def view_young_players(session):
+    if is_scout(session) is None:
         return
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
     current_year = 2023
     position = input("Please enter a position to filter (leave blank for all positions): ")
     age_limit = input("Please enter an age limit (leave blank for age < 25): ")
     team = input("Please enter a team to filter (leave blank for all teams): ")
     age_limit = int(age_limit) if age_limit else 25
-    query = '''
-        SELECT * FROM Players WHERE season = ? AND age = ?
-    '''
-    params = [current_year, age_limit]
-    if position:
-        query += ' AND position = ?'
-        params.append(position)
-    if team:
-        query += ' AND team = ?'
-        params.append(team)
-    cursor.execute(query, tuple(params))
-    young_players = cursor.fetchall()
-    print(f"{username} can check the players in all teams whose age < {age_limit}.")
+    print(f"{session.username} can check the players in all teams whose age < {age_limit}.")
     print("Title for output:\n", ["season", "player_id", "player", "position", "age", "team", "total_points",
                                   "field_goals_percent", "three_points_percent", "two_points_percent",
                                   "free_throw_percent", "total_rebound", "assist", "steal", "block",
                                   "turnover", "personal_foul"])
-    print('Title for output: ', '\n', list(df_player.columns))
-    for player in young_players:
-        print(player)
-
-    conn.close()
+    print('Title for output: ', '\n', player_columns)
+    write_rows(NBAStore(db_file).find_young_players(current_year, age_limit, position=position or None,
+                                                    team=team or None))
 
 
-def view_team_info_by_year(username):
+def view_team_info_by_year(session):
     year = input("Please input the year (leave blank to view all years): ")
-    team = is_scout(username)
+    team = is_scout(session)
     if team is None:
         return
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    if year:
-        cursor.execute('''
-            SELECT * FROM Teams WHERE team = ? AND season = ?
-        ''', (team, year))
-    else:
-        cursor.execute('''
-            SELECT * FROM Teams WHERE team = ?
-        ''', (team,))
-    team_info = cursor.fetchall()
-    print(f"{username} can check the data of the team {team}")
-    print('Title for output: ', '\n', list(df_team.columns))
-    for info in team_info:
-        print(info)
-    conn.close()
-
-
-def is_player(username):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT team, role FROM Users WHERE username = ?
-    ''', (username,))
-    result = cursor.fetchone()
-    conn.close()
-    if result is None:
-        print("The player does not exist.")
+    print(f"{session.username} can check the data of the team {team}")
+    print('Title for output: ', '\n', team_columns)
+    write_rows(NBAStore(db_file).find_teams(season=year or None, team=team))
+
+
+def is_player(session):
+    # the team of a live player session, else None
+    if not is_live(session):
         return None
-    team, role = result
-    if role != 'player':
+    if session.role != 'player':
         print("Only player can do this information!")
         return None
-    return team
+    return session.team
 
 
-def view_current_team_player(username):
-    team = is_player(username)
+def view_current_team_player(session):
+    team = is_player(session)
     if team is None:
         return
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
     current_year = 2023
     player_name = input("Please input the Player name(Blank will return all players): ")
-    if player_name:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ? AND player = ? AND season = ?
-            ''', (team, player_name, current_year))
-    else:
-        cursor.execute('''
-                SELECT * FROM Players WHERE team = ? AND season = ?
-            ''', (team, current_year))
-    players = cursor.fetchall()
-    print(f"{username} can check the data of players from team {team} in season {current_year}")
-    print('Title for output: ', '\n', list(df_player.columns))
-    for player in players:
-        print(player)
-    conn.close()
-
-
-def view_current_team_info(username):
-    team = is_player(username)
+    print(f"{session.username} can check the data of players from team {team} in season {current_year}")
+    print('Title for output: ', '\n', player_columns)
+    write_rows(NBAStore(db_file).find_players(player=player_name or None, season=current_year, team=team))
+
+
+def view_current_team_info(session):
+    team = is_player(session)
     if team is None:
         return
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
     current_year = 2023
-    cursor.execute('''
-        SELECT * FROM Teams WHERE team = ? AND season = ?
-    ''', (team, current_year))
-    team_info = cursor.fetchall()
-    print(f"{username} can check the data of team{team} in season {current_year}.")
-    print('Title for output: ', '\n', list(df_team.columns))
-    for info in team_info:
-        print(info)
-    conn.close()
+    print(f"{session.username} can check the data of team{team} in season {current_year}.")
+    print('Title for output: ', '\n', team_columns)
+    write_rows(NBAStore(db_file).find_teams(season=current_year, team=team))
 
 
 def register():
@@ -468,9 +367,9 @@ def register():
     register_user(user_id, username, password, team)
 
 
-def admin_menu(username):
-    while True:
-        print(f"\n Welcome {username}, Please choose your operations: ")
+def admin_menu(session):
+    while is_live(session):
+        print(f"\n Welcome {session.username}, Please choose your operations: ")
         print("1. View all information of all Teams.")
         print("2. View all information of all Players.")
         print("3. View all information of all Users.")
@@ -481,59 +380,62 @@ def admin_menu(username):
         print("8. Log Out.")
         choice = input("Please make a decision: ")
         if choice == "1":
-            view_all_teams(username)
+            view_all_teams(session)
         elif choice == "2":
-            view_all_players(username)
+            view_all_players(session)
         elif choice == "3":
-            view_all_users(username)
+            view_all_users(session)
         elif choice == "4":
-            update_team_playoffs()
+            update_team_playoffs(session)
         elif choice == "5":
-            delete_player()
+            delete_player(session)
         elif choice == "6":
-            delete_user(username)
+            delete_user(session)
         elif choice == "7":
-            update_player_team()
+            update_player_team(session)
         elif choice == "8":
+            get_sessions(db_file).end(session.token)
             print("Logged out.\n")
             break
         else:
             print("Invalid choice, please try again.")
 
 
-def scout_menu(username):
-    while True:
-        print(f"\nWelcome Scout {username}, Please choose your operation:")
+def scout_menu(session):
+    while is_live(session):
+        print(f"\nWelcome Scout {session.username}, Please choose your operation:")
         print("1. View team players information")
         print("2. View all young players information (under 25 years old) in 2023")
         print("3. View team information")
         print("4. Logout")
         choice = input("Please input the option number: ")
         if choice == "1":
-            view_scout_team_players(username)
+            view_scout_team_players(session)
         elif choice == "2":
-            view_young_players(username)
+            view_young_players(session)
         elif choice == "3":
-            view_team_info_by_year(username)
+            view_team_info_by_year(session)
         elif choice == "4":
+            get_sessions(db_file).end(session.token)
             print("Logged out.\n")
             break
         else:
             print("Invalid choice, please try again.")
 
 
-def player_menu(username):
-    while True:
-        print(f"\n Welcome Player {username}, Please choose your operation:")
+def player_menu(session):
+    while is_live(session):
+        print(f"\n Welcome Player {session.username}, Please choose your operation:")
         print("1. View team players information in 2023")
         print("2. View team information in 2023")
         print("3. Logout")
         choice = input("Please input the option number: ")
         if choice == "1":
-            view_current_team_player(username)
+            view_current_team_player(session)
         elif choice == "2":
-            view_current_team_info(username)
+            view_current_team_info(session)
         elif choice == "3":
+            get_sessions(db_file).end(session.token)
             print("Logged out.\n")
             break
         else:
@@ -563,17 +465,19 @@ def login():
     username = input("Please input your username: ")
     password = input("Please input your password: ")
     # Login and get role
-    role = login_user(username, password)
+    session = login_user(username, password)
+    role = session.role if session else None
     if role == "admin":
-        admin_menu(username)
+        admin_menu(session)
     elif role == "scout":
-        scout_menu(username)
+        scout_menu(session)
     elif role == "player":
-        player_menu(username)
+        player_menu(session)
     else:
         print("Login failed or invalid role, please try again.")
 
 
 # Start the system
 if __name__ == "__main__":
+    bootstrap()
     main_menu()
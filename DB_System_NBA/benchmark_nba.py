@@ -0,0 +1,700 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import db_metrics
+from CSC3170_project import bootstrap, csv_player, db_file, indexes
+from db_bootstrap import create_meta_tables, sync_csv, sync_indexes
+from db_cache import ResultCache
+from db_pool import PRAGMAS, close_all, get_connection
+from db_results import stream_rows, write_rows
+from nba_aggregates import check_aggregates, leader_stats, sync_aggregates, team_rollup_query, team_stats_select
+from nba_store import NBAStore
+
+# the hot Players lookups of the menus, with the columns their parameters are drawn from
+player_queries = [
+    ('player and season', 'SELECT * FROM Players WHERE player = ? AND season = ?', ('player', 'season')),
+    ('player', 'SELECT * FROM Players WHERE player = ?', ('player',)),
+    ('team and season', 'SELECT * FROM Players WHERE team = ? AND season = ?', ('team', 'season')),
+    ('team and player', 'SELECT * FROM Players WHERE team = ? AND player = ?', ('team', 'player')),
+    ('young players', 'SELECT * FROM Players WHERE season = ? AND age = ? AND position = ?',
+     ('season', 'age', 'position')),
+]
+
+
+def ensure_database():
+    bootstrap()
+
+
+def sample_operations(conn):
+    # the statements behind the menus: a login, a role check and the view that follows it
+    users = conn.execute('SELECT username, team FROM Users').fetchall()
+    players = conn.execute('SELECT DISTINCT player, season FROM Players').fetchall()
+    operations = []
+    for i in range(max(len(users), len(players))):
+        username, team = users[i % len(users)]
+        player, season = players[i % len(players)]
+        operations.append(('SELECT password, role FROM Users WHERE username = ?', (username,)))
+        operations.append(('SELECT team, role FROM Users WHERE username = ?', (username,)))
+        operations.append(('SELECT * FROM Teams WHERE season = ? AND team = ?', (season, team)))
+        operations.append(('SELECT * FROM Players WHERE player = ? AND season = ?', (player, season)))
+    return operations
+
+
+def run_per_call(operations):
+    # what every function did before: open a connection, run one statement, close it
+    for sql, params in operations:
+        conn = sqlite3.connect(db_file)
+        conn.execute(sql, params).fetchall()
+        conn.close()
+
+
+def run_pooled(operations):
+    for sql, params in operations:
+        get_connection(db_file).execute(sql, params).fetchall()
+
+
+def run_threads(target, operations, threads):
+    workers = [threading.Thread(target=target, args=(operations[i::threads],)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def benchmark_connections(n=20000, threads=(1, 4)):
+    # operations per second with a connection per call against the pooled thread-local connections
+    ensure_database()
+    operations = sample_operations(get_connection(db_file))[:n]
+    print(f"{'threads':>8} {'per-call ops/s':>16} {'pooled ops/s':>14} {'speedup':>8}")
+    for count in threads:
+        start = time.perf_counter()
+        run_threads(run_per_call, operations, count)
+        per_call_rate = len(operations) / (time.perf_counter() - start)
+        close_all()
+        start = time.perf_counter()
+        run_threads(run_pooled, operations, count)
+        pooled_rate = len(operations) / (time.perf_counter() - start)
+        print(f"{count:>8} {per_call_rate:>16,.0f} {pooled_rate:>14,.0f} {pooled_rate / per_call_rate:>7.1f}x")
+    close_all()
+
+
+def build_scaled_players(path, rows):
+    # a Players table of `rows` rows: the real table repeated, each copy shifted by 10 seasons so that the
+    # keys stay unique and every season keeps the size and value spread of a real one
+    ensure_database()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('ATTACH DATABASE ? AS source', (os.path.abspath(db_file),))
+    conn.execute(conn.execute("SELECT sql FROM source.sqlite_master WHERE name = 'Players'").fetchone()[0])
+    copies = -(-rows // conn.execute('SELECT count(*) FROM source.Players').fetchone()[0])
+    columns = [row[1] for row in conn.execute('PRAGMA source.table_info(Players)')]
+    shifted = ', '.join('season + 10 * copy' if column == 'season' else column for column in columns)
+    conn.execute(f'''
+        INSERT INTO Players
+        WITH RECURSIVE copies(copy) AS (SELECT 0 UNION ALL SELECT copy + 1 FROM copies WHERE copy < ?)
+        SELECT {shifted} FROM copies, source.Players ORDER BY copy, season, player_id, team LIMIT ?
+    ''', (copies - 1, rows))
+    conn.commit()
+    conn.execute('DETACH DATABASE source')
+    return conn
+
+
+def time_queries(conn, probes, table='Players'):
+    timings = {}
+    for label, sql, _ in player_queries:
+        sql = sql.replace('FROM Players', f'FROM {table}')
+        start = time.perf_counter()
+        for params in probes[label]:
+            conn.execute(sql, params).fetchall()
+        timings[label] = (time.perf_counter() - start) / len(probes[label])
+    return timings
+
+
+def benchmark_indexes(rows=10_000_000, scans=3, searches=500, seed=3170, directory=None):
+    # latency of the hot Players lookups on a synthetically scaled table: without any key (the table
+    # to_sql used to create), with the declared primary key only, and with the managed secondary indexes.
+    # A lookup that scans the table is timed with fewer probes.
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        start = time.perf_counter()
+        conn = build_scaled_players(os.path.join(scratch, 'scaled_players.db'), rows)
+        print(f"built {rows:,} Players rows in {time.perf_counter() - start:.1f} s")
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        rng = random.Random(seed)
+        count = conn.execute('SELECT max(rowid) FROM Players').fetchone()[0]
+        sample = [conn.execute('SELECT player, season, team, age, position FROM Players WHERE rowid = ?',
+                               (rng.randint(1, count),)).fetchone() for _ in range(searches)]
+        fields = ('player', 'season', 'team', 'age', 'position')
+        probes = {label: [tuple(row[fields.index(column)] for column in columns) for row in sample]
+                  for label, _, columns in player_queries}
+        conn.execute('CREATE TABLE Players_unkeyed AS SELECT * FROM Players')
+        few = {label: params[:scans] for label, params in probes.items()}
+        unkeyed = time_queries(conn, few, 'Players_unkeyed')
+        conn.execute('DROP TABLE Players_unkeyed')
+        keyed = time_queries(conn, few)
+        start = time.perf_counter()
+        sync_indexes(conn, {name: index for name, index in indexes.items() if index[0] == 'Players'})
+        conn.commit()
+        print(f"created the Players indexes in {time.perf_counter() - start:.1f} s")
+        indexed = time_queries(conn, probes)
+        print(f"{'query':>18} {'no key ms':>10} {'primary key ms':>15} {'indexed ms':>11} {'speedup':>9}")
+        for label, _, _ in player_queries:
+            print(f"{label:>18} {unkeyed[label] * 1000:>10.1f} {keyed[label] * 1000:>15.1f} "
+                  f"{indexed[label] * 1000:>11.3f} {unkeyed[label] / indexed[label]:>8.0f}x")
+        conn.close()
+
+
+def list_fetchall(conn, out):
+    # what the views did before: materialize the result, then print it row by row
+    cursor = conn.execute('SELECT * FROM Players')
+    rows = cursor.fetchall()
+    first = time.perf_counter()
+    for row in rows:
+        print(row, file=out)
+    return first
+
+
+def list_streamed(conn, out):
+    rows = stream_rows(conn, 'Players')
+    row = next(rows)
+    first = time.perf_counter()
+    out.write(f'{row}\n')
+    write_rows(rows, out)
+    return first
+
+
+def benchmark_streaming(sizes=(100_000, 1_000_000, 2_000_000), directory=None):
+    # listing the whole Players table (the admin view with blank filters) as it grows: time to the first
+    # row, total time and peak Python memory, fetchall-and-print against keyset pages and batched writes
+    print(f"{'rows':>10} {'method':>9} {'first row ms':>13} {'total s':>8} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory(dir=directory) as scratch, open(os.devnull, 'w') as out:
+        for rows in sizes:
+            path = os.path.join(scratch, f'players_{rows}.db')
+            build_scaled_players(path, rows).close()
+            conn = sqlite3.connect(path)
+            for label, method in (('fetchall', list_fetchall), ('streamed', list_streamed)):
+                start = time.perf_counter()
+                first = method(conn, out)
+                total = time.perf_counter() - start
+                # tracing every allocation slows the run down, so memory is measured in a second one
+                tracemalloc.start()
+                method(conn, out)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{rows:>10,} {label:>9} {(first - start) * 1000:>13.1f} {total:>8.2f} "
+                      f"{peak / 2 ** 20:>9.1f}")
+            conn.close()
+            os.remove(path)
+
+
+def time_statement(conn, sql, probes):
+    start = time.perf_counter()
+    for params in probes:
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) / len(probes)
+
+
+def time_writes(conn, rows):
+    # each row inserted and deleted again, one commit per statement like the store
+    start = time.perf_counter()
+    for row in rows:
+        conn.execute(f'INSERT INTO Players VALUES ({", ".join("?" * len(row))})', row)
+        conn.commit()
+        conn.execute('DELETE FROM Players WHERE season = ? AND player_id = ? AND team = ?',
+                     (row[0], row[1], row[5]))
+        conn.commit()
+    return (time.perf_counter() - start) / (2 * len(rows))
+
+
+def benchmark_aggregates(rows=1_000_000, probes=50, writes=200, seed=3170, directory=None):
+    # the team-season and leaderboard rollups on a scaled Players table: computing them ad hoc from Players
+    # (with the managed indexes) against reading the materialized tables, and what the triggers add to a
+    # write
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        conn = build_scaled_players(os.path.join(scratch, 'scaled_players.db'), rows)
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        sync_indexes(conn, {name: index for name, index in indexes.items() if index[0] == 'Players'})
+        conn.commit()
+        rng = random.Random(seed)
+        keys = conn.execute('SELECT DISTINCT season, team FROM Players').fetchall()
+        team_probes = [rng.choice(keys) for _ in range(probes)]
+        season_probes = [(season,) for season, _ in team_probes]
+        stat = leader_stats[0]
+        ad_hoc_leaders = (f'SELECT player_id, player, team, {stat} FROM Players WHERE season = ? '
+                          f'ORDER BY {stat} DESC, player_id, team LIMIT 10')
+        before = {
+            'team and season': time_statement(conn, team_rollup_query('season = ? AND team = ?'), team_probes),
+            'season': time_statement(conn, team_rollup_query('season = ?'), season_probes),
+            'all seasons': time_statement(conn, team_rollup_query(), [()] * 3),
+            'season leaders': time_statement(conn, ad_hoc_leaders, season_probes),
+        }
+        sample = [conn.execute('SELECT * FROM Players WHERE rowid = ?', (rng.randint(1, rows),)).fetchone()
+                  for _ in range(writes)]
+        # the same player joining another team of the season, then leaving it
+        moves = [(row[:5] + ('ZZZ',) + row[6:]) for row in sample]
+        plain_write = time_writes(conn, moves)
+        start = time.perf_counter()
+        sync_aggregates(conn)
+        conn.commit()
+        print(f"{rows:,} Players rows: built the rollups in {time.perf_counter() - start:.2f} s")
+        after = {
+            'team and season': time_statement(
+                conn, f'SELECT {team_stats_select} FROM TeamSeasonStats WHERE season = ? AND team = ?', team_probes),
+            'season': time_statement(conn, f'SELECT {team_stats_select} FROM TeamSeasonStats WHERE season = ?',
+                                     season_probes),
+            'all seasons': time_statement(conn, f'SELECT {team_stats_select} FROM TeamSeasonStats', [()] * 3),
+            'season leaders': time_statement(
+                conn, 'SELECT player_id, player, team, value FROM SeasonLeaders WHERE stat = ? AND season = ? '
+                      'ORDER BY value DESC, player_id, team LIMIT 10', [(stat, season) for season, in season_probes]),
+        }
+        print(f"{'rollup':>16} {'ad hoc ms':>10} {'materialized ms':>16} {'speedup':>8}")
+        for label in before:
+            print(f"{label:>16} {before[label] * 1000:>10.3f} {after[label] * 1000:>16.3f} "
+                  f"{before[label] / after[label]:>7.0f}x")
+        # leaders first, so every delete of a leader row exercises the refill
+        leader_moves = [row[:5] + ('ZZZ',) + row[6:] for row in conn.execute(
+            'SELECT p.* FROM SeasonLeaders l JOIN Players p USING (season, player_id, team) '
+            'WHERE l.stat = ? LIMIT ?', (stat, writes))]
+        triggered_write = time_writes(conn, moves)
+        leader_write = time_writes(conn, leader_moves)
+        print(f"write with triggers: {plain_write * 1000:.3f} ms -> {triggered_write * 1000:.3f} ms per statement "
+              f"({leader_write * 1000:.3f} ms for a leader)")
+        start = time.perf_counter()
+        differences = check_aggregates(conn)
+        print(f"consistency check: {len(differences)} difference(s) in {time.perf_counter() - start:.2f} s")
+        conn.close()
+
+
+def build_scaled_columns(directory, rows):
+    # the Players columns of build_scaled_players(path, rows): the same rows in the same order
+    import numpy as np
+    from nba_columnar import ColumnTable, encode_column, write_table
+    ensure_database()
+    conn = sqlite3.connect(db_file)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(Players)')]
+    base = list(zip(*conn.execute('SELECT * FROM Players ORDER BY season, player_id, team')))
+    conn.close()
+    copies = -(-rows // len(base[0]))
+    arrays = {}
+    dictionaries = {}
+    for name, values in zip(columns, base):
+        array, dictionary = encode_column(list(values))
+        if dictionary is not None:
+            dictionaries[name] = dictionary
+        array = np.tile(array, copies)[:rows]
+        if name == 'season':
+            array = array + 10 * np.repeat(np.arange(copies, dtype=array.dtype), len(base[0]))[:rows]
+        arrays[name] = array
+    write_table(directory, arrays, dictionaries=dictionaries)
+    return ColumnTable(directory)
+
+
+def best_of(function, repeat=2):
+    # (result, seconds) of the fastest of a few runs; the first also pages the data in
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def benchmark_columnar(rows=2_000_000, directory=None):
+    # analytics over a scaled Players history three ways: SQL in SQLite (with the managed indexes), the
+    # rows of SQLite aggregated in Python, and the memory-mapped columns of nba_columnar. Every result is
+    # checked against the SQLite one.
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        start = time.perf_counter()
+        conn = build_scaled_players(os.path.join(scratch, 'scaled_players.db'), rows)
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        sync_indexes(conn, {name: index for name, index in indexes.items() if index[0] == 'Players'})
+        conn.commit()
+        players = build_scaled_columns(os.path.join(scratch, 'columns'), rows)
+        print(f"built {rows:,} Players rows in SQLite and as columns in {time.perf_counter() - start:.1f} s")
+        seasons = (2000, 2000 + conn.execute('SELECT max(season) - 2000 FROM Players').fetchone()[0] // 2)
+
+        def python_group_by():
+            groups = {}
+            for season, team, points, percent in conn.execute(
+                    'SELECT season, team, total_points, field_goals_percent FROM Players'):
+                group = groups.get((season, team))
+                if group is None:
+                    group = groups[season, team] = [0, 0, 0.0]
+                group[0] += 1
+                group[1] += points
+                group[2] += percent
+            return sorted((season, team, count, points, percent / count)
+                          for (season, team), (count, points, percent) in groups.items())
+
+        def columnar_group_by():
+            result = players.group_by(['season', 'team'], {'players': ('count', None),
+                                                           'points': ('sum', 'total_points'),
+                                                           'percent': ('mean', 'field_goals_percent')})
+            return list(zip(*[result[name].tolist() for name in ('season', 'team', 'players', 'points', 'percent')]))
+
+        def same(a, b):
+            # a count is compared as a one-row result
+            a, b = (value if isinstance(value, list) else [(value,)] for value in (a, b))
+            return len(a) == len(b) and all(
+                all(abs(x - y) < 1e-9 if isinstance(x, float) else x == y for x, y in zip(row_a, row_b))
+                for row_a, row_b in zip(a, b))
+        queries = [
+            ('filter and count',
+             lambda: conn.execute("SELECT count(*) FROM Players WHERE season BETWEEN ? AND ? AND position = 'PG' "
+                                  "AND age <= 22", seasons).fetchone()[0],
+             None,
+             lambda: int(players.mask(season=seasons, position='PG', age=(None, 22)).sum())),
+            ('group by season, team',
+             lambda: conn.execute('SELECT season, team, count(*), sum(total_points), avg(field_goals_percent) '
+                                  'FROM Players GROUP BY season, team ORDER BY season, team').fetchall(),
+             python_group_by, columnar_group_by),
+            ('top 10 points',
+             lambda: conn.execute('SELECT player_id, team, total_points FROM Players '
+                                  'ORDER BY total_points DESC, player_id, team LIMIT 10').fetchall(),
+             None,
+             lambda: players.rows_of(players.top_k('total_points', 10, ties=('player_id', 'team')),
+                                     ['player_id', 'team', 'total_points'])),
+            ('top 10 per season',
+             lambda: conn.execute(
+                 'WITH seasons AS (SELECT DISTINCT season FROM Players) '
+                 'SELECT p.season, p.player_id, p.team, p.total_points FROM seasons JOIN Players AS p '
+                 'ON p.rowid IN (SELECT rowid FROM Players WHERE season = seasons.season '
+                 'ORDER BY total_points DESC, player_id, team LIMIT 10) '
+                 'ORDER BY p.season, p.total_points DESC, p.player_id, p.team').fetchall(),
+             None,
+             lambda: players.rows_of(players.top_k('total_points', 10, by='season', ties=('player_id', 'team')),
+                                     ['season', 'player_id', 'team', 'total_points'])),
+        ]
+        print(f"{'query':>22} {'SQLite s':>9} {'Python rows s':>14} {'columnar s':>11} {'speedup':>8}")
+        for label, sql, python, columnar in queries:
+            expected, sql_seconds = best_of(sql, 1)
+            python_seconds = None
+            if python is not None:
+                result, python_seconds = best_of(python, 1)
+                assert same(result, expected), label
+            result, columnar_seconds = best_of(columnar)
+            assert same(result, expected), label
+            print(f"{label:>22} {sql_seconds:>9.3f} {'' if python_seconds is None else f'{python_seconds:.3f}':>14} "
+                  f"{columnar_seconds:>11.4f} {sql_seconds / columnar_seconds:>7.0f}x")
+        touched = sum(players.column(name).nbytes for name in ('season', 'team', 'total_points',
+                                                               'field_goals_percent'))
+        _, seconds = best_of(columnar_group_by)
+        print(f"group by reads {touched / 2 ** 20:.0f} MiB of columns at {touched / seconds / 2 ** 30:.2f} GiB/s")
+        conn.close()
+
+
+# the menu actions of a mixed admin/scout/player workload, each as the menus call the store
+def write_scaled_csv(path, rows):
+    # Player_Totals.csv repeated to `rows` rows, each copy shifted by 10 seasons like build_scaled_players;
+    # written copy by copy, so a file of any size can be made
+    with open(csv_player, 'rb') as source:
+        header = source.readline()
+        lines = [line.rstrip(b'\r\n').split(b',', 1) for line in source if line.strip()]
+    with open(path, 'wb') as out:
+        out.write(header)
+        copy = written = 0
+        while written < rows:
+            chunk = lines[:rows - written]
+            out.writelines(b'%d,%s\n' % (int(season) + 10 * copy, rest) for season, rest in chunk)
+            written += len(chunk)
+            copy += 1
+
+
+def load_single_shot(conn, path, key_columns):
+    # the cold load before db_ingest: the whole file through pandas.read_csv, then one executemany
+    import pandas as pd
+    df = pd.read_csv(path, encoding='gbk')
+    columns = list(df.columns)
+    rows = [[None if value != value else value for value in row] for row in df.itertuples(index=False, name=None)]
+    key_index = [columns.index(column) for column in key_columns]
+    with conn:
+        conn.executemany(f'INSERT OR REPLACE INTO Players ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" * len(columns))})', rows)
+        conn.executemany('INSERT OR REPLACE INTO csv_rows (source, row_key, digest) VALUES (?, ?, ?)',
+                         (('Players', json.dumps([row[i] for i in key_index]),
+                           hashlib.blake2b(json.dumps(row).encode(), digest_size=16).hexdigest()) for row in rows))
+    return len(rows)
+
+
+def run_ingest(method, workers, csv_path, db_path, players_sql):
+    # one cold load of a Players CSV into a new database; runs in a process of its own, so that ru_maxrss
+    # is the peak memory of this load (parsing processes not included)
+    conn = sqlite3.connect(db_path)
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    conn.execute(players_sql)
+    create_meta_tables(conn)
+    players_indexes = {name: index for name, index in indexes.items() if index[0] == 'Players'}
+    sync_indexes(conn, players_indexes)
+    conn.commit()
+    key_columns = ['season', 'player_id', 'team']
+    start = time.perf_counter()
+    if method == 'read_csv':
+        rows = load_single_shot(conn, csv_path, key_columns)
+    else:
+        report = {}
+        sync_csv(conn, 'Players', csv_path, key_columns, indexes=players_indexes, workers=workers, report=report)
+        rows = report['rows']
+    seconds = time.perf_counter() - start
+    conn.close()
+    return rows, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_ingest(rows=5_000_000, workers=(0, 2), directory=None):
+    # a cold load of a Players CSV of `rows` rows: pandas.read_csv of the whole file against the streamed,
+    # typed blocks of sync_csv, in this process and with parsing processes
+    ensure_database()
+    conn = sqlite3.connect(db_file)
+    players_sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'Players'").fetchone()[0]
+    conn.close()
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        csv_path = os.path.join(scratch, 'players.csv')
+        write_scaled_csv(csv_path, rows)
+        print(f"{rows:,} rows, {os.path.getsize(csv_path) / 2 ** 20:,.0f} MiB of CSV")
+        print(f"{'method':>9} {'workers':>8} {'seconds':>8} {'rows/s':>10} {'peak RSS MiB':>13}")
+        for method, count in [('read_csv', 0)] + [('streamed', count) for count in workers]:
+            db_path = os.path.join(scratch, f'{method}_{count}.db')
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                loaded, seconds, peak = pool.submit(run_ingest, method, count, csv_path, db_path,
+                                                    players_sql).result()
+            print(f"{method:>9} {count:>8} {seconds:>8.1f} {loaded / seconds:>10,.0f} {peak:>13,.0f}")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+
+def login(store, username):
+    return store.get_credentials(username)
+
+
+def admin_teams(store, season, team):
+    return sum(1 for _ in store.find_teams(season=season, team=team))
+
+
+def admin_players(store, player, season):
+    return sum(1 for _ in store.find_players(player=player, season=season))
+
+
+def admin_users(store, role, team):
+    return sum(1 for _ in store.find_users(role=role, team=team))
+
+
+def admin_playoffs(store, team, season, playoffs):
+    store.set_playoffs(team, season, playoffs)
+    return store.get_team(team, season)
+
+
+# the scout and player operations are authorized with the session of a login (nba_sessions), as in the menus
+def scout_team_players(store, token, player, season):
+    team = store.sessions.get(token).team
+    return sum(1 for _ in store.find_players(player=player, season=season, team=team))
+
+
+def scout_young_players(store, token, position, age):
+    store.sessions.get(token)
+    return sum(1 for _ in store.find_young_players(2023, age, position=position))
+
+
+def scout_team_info(store, token, season):
+    team = store.sessions.get(token).team
+    return sum(1 for _ in store.find_teams(season=season, team=team))
+
+
+def player_team_players(store, token, player):
+    team = store.sessions.get(token).team
+    return sum(1 for _ in store.find_players(player=player, season=2023, team=team))
+
+
+def player_team_info(store, token):
+    team = store.sessions.get(token).team
+    return sum(1 for _ in store.find_teams(season=2023, team=team))
+
+
+# operation -> share of the requests
+workload_mix = {
+    login: 20,
+    admin_teams: 3,
+    admin_players: 3,
+    admin_users: 2,
+    admin_playoffs: 1,
+    scout_team_players: 12,
+    scout_young_players: 8,
+    scout_team_info: 8,
+    player_team_players: 25,
+    player_team_info: 18,
+}
+
+
+def workload_operations(store, n, seed=3170):
+    # n (operation, arguments) pairs drawn from the mix, with arguments sampled from the data; blank menu
+    # filters become None, so every branch of the menus occurs
+    rng = random.Random(seed)
+    conn = store.conn
+    users = {role: [row[0] for row in conn.execute('SELECT username FROM Users WHERE role = ?', (role,))]
+             for role in ('admin', 'scout', 'player')}
+    # a logged-in session of every scout and player
+    tokens = {role: [store.sessions.create(username, role, team).token for username, team in conn.execute(
+        'SELECT username, team FROM Users WHERE role = ?', (role,))] for role in ('scout', 'player')}
+    players = conn.execute('SELECT player, season FROM Players').fetchall()
+    teams = conn.execute('SELECT team, season, playoffs FROM Teams').fetchall()
+
+    def maybe(value):
+        return value if rng.random() < 0.5 else None
+
+    def arguments(operation):
+        player, season = rng.choice(players)
+        team, team_season, playoffs = rng.choice(teams)
+        if operation is login:
+            return (rng.choice(users[rng.choice(('admin', 'scout', 'player'))]),)
+        if operation is admin_teams:
+            return maybe(team_season), maybe(team)
+        if operation is admin_players:
+            # a listing of every player is rare, a filtered search is not
+            return (player, maybe(season)) if rng.random() < 0.9 else (None, maybe(season))
+        if operation is admin_users:
+            return maybe(rng.choice(('admin', 'scout', 'player'))), maybe(team)
+        if operation is admin_playoffs:
+            return team, team_season, playoffs
+        if operation is scout_team_players:
+            return rng.choice(tokens['scout']), maybe(player), maybe(season)
+        if operation is scout_young_players:
+            return rng.choice(tokens['scout']), maybe(rng.choice(('PG', 'SG', 'SF', 'PF', 'C'))), rng.randint(19, 25)
+        if operation is scout_team_info:
+            return rng.choice(tokens['scout']), maybe(season)
+        if operation is player_team_players:
+            return rng.choice(tokens['player']), maybe(player)
+        return (rng.choice(tokens['player']),)
+
+    chosen = rng.choices(list(workload_mix), weights=list(workload_mix.values()), k=n)
+    return [(operation, arguments(operation)) for operation in chosen]
+
+
+def run_workload(store, operations, latencies):
+    for operation, args in operations:
+        start = time.perf_counter()
+        operation(store, *args)
+        latencies.append((operation.__name__, time.perf_counter() - start))
+
+
+def percentile(ordered, q):
+    # nearest rank
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def print_latencies(label, values):
+    ordered = sorted(values)
+    print(f"{label:>20} {len(ordered):>7} {percentile(ordered, 0.5) * 1000:>8.3f} "
+          f"{percentile(ordered, 0.9) * 1000:>8.3f} {percentile(ordered, 0.99) * 1000:>8.3f} "
+          f"{ordered[-1] * 1000:>9.3f}")
+
+
+def benchmark_workload(n=20000, threads=(1, 4), seed=3170, cached=True):
+    # replay a mixed admin/scout/player workload through NBAStore on the thread pool sizes given: throughput
+    # and latency percentiles (ms) overall and per operation. Writes (admin_playoffs) store the value a team
+    # already has, so the data is unchanged afterwards.
+    ensure_database()
+    store = NBAStore(db_file, cached=cached)
+    operations = workload_operations(store, n, seed)
+    print(f"result cache {'on' if cached else 'off'}")
+    for count in threads:
+        if store.cache is not None:
+            store.cache = ResultCache()  # cold, with its own counters
+        latencies = []
+        workers = [threading.Thread(target=run_workload, args=(store, operations[i::count], latencies))
+                   for i in range(count)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print(f"\n{count} thread(s): {len(latencies)} operations in {elapsed:.2f} s, "
+              f"{len(latencies) / elapsed:,.0f} ops/s")
+        print(f"{'operation':>20} {'count':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>9}")
+        print_latencies('all', [seconds for _, seconds in latencies])
+        by_operation = {}
+        for name, seconds in latencies:
+            by_operation.setdefault(name, []).append(seconds)
+        for operation in workload_mix:
+            if operation.__name__ in by_operation:
+                print_latencies(operation.__name__, by_operation[operation.__name__])
+        if store.cache is not None:
+            print(store.cache_stats())
+    close_all()
+
+
+def benchmark_metrics(n=20000, rounds=3, seed=3170):
+    # the cost of db_metrics: the workload on one thread without the result cache, so every operation
+    # reaches SQLite, with the metrics off and on in turns (best round of each), then the templates that
+    # took the most time
+    ensure_database()
+    store = NBAStore(db_file, cached=False)
+    operations = workload_operations(store, n, seed)
+    run_workload(store, operations, [])  # warm the page cache
+    best = {}
+    for _ in range(rounds):
+        for on in (False, True):
+            db_metrics.enable(on)
+            close_all()  # reopened with the connection class of the setting
+            db_metrics.metrics.reset()
+            start = time.perf_counter()
+            run_workload(store, operations, [])
+            elapsed = time.perf_counter() - start
+            best[on] = min(best.get(on, elapsed), elapsed)
+    snapshot = db_metrics.metrics.snapshot()
+    db_metrics.enable(False)
+    close_all()
+    for on in (False, True):
+        print(f"metrics {'on ' if on else 'off'}: {n} operations in {best[on]:.2f} s, {n / best[on]:,.0f} ops/s, "
+              f"{best[on] / n * 1e6:.1f} us per operation")
+    statements = sum(query['count'] for query in snapshot['queries'])
+    print(f"overhead {(best[True] - best[False]) / best[False]:+.1%}, "
+          f"{(best[True] - best[False]) / max(statements, 1) * 1e6:.1f} us per statement ({statements} statements)")
+    print(f"\n{'seconds':>8} {'count':>7} {'rows':>8} {'p50 ms':>8} {'p99 ms':>8}  query")
+    for query in snapshot['queries'][:10]:
+        print(f"{query['seconds']:>8.3f} {query['count']:>7} {query['rows']:>8} {query['p50_ms']:>8} "
+              f"{query['p99_ms']:>8}  {query['query'][:80]}")
+
+
+if __name__ == "__main__":
+    # python benchmark_nba.py connections [N]     per-call connections against the pool
+    # python benchmark_nba.py indexes [ROWS]      Players lookups on a scaled table, without/with indexes
+    # python benchmark_nba.py streaming [ROWS...]  listing the whole Players table as it grows
+    # python benchmark_nba.py aggregates [ROWS]   rollups computed ad hoc against the materialized ones
+    # python benchmark_nba.py columnar [ROWS]     analytics in SQLite, in Python over rows and over columns
+    # python benchmark_nba.py ingest [ROWS] [WORKERS...]  a cold load of a large CSV, read whole and streamed
+    # python benchmark_nba.py workload [N] [THREADS...]   mixed admin/scout/player requests through NBAStore
+    #                                                     (UNCACHED=1 in the environment reads SQLite every time)
+    # python benchmark_nba.py metrics [N]         the workload without and with db_metrics
+    if sys.argv[1:2] == ['indexes']:
+        benchmark_indexes(int(sys.argv[2]) if len(sys.argv) > 2 else 10_000_000)
+    elif sys.argv[1:2] == ['streaming']:
+        benchmark_streaming(tuple(int(rows) for rows in sys.argv[2:]) or (100_000, 1_000_000, 2_000_000))
+    elif sys.argv[1:2] == ['aggregates']:
+        benchmark_aggregates(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    elif sys.argv[1:2] == ['columnar']:
+        benchmark_columnar(int(sys.argv[2]) if len(sys.argv) > 2 else 2_000_000)
+    elif sys.argv[1:2] == ['ingest']:
+        benchmark_ingest(int(sys.argv[2]) if len(sys.argv) > 2 else 5_000_000,
+                         tuple(int(count) for count in sys.argv[3:]) or (0, 2))
+    elif sys.argv[1:2] == ['workload']:
+        benchmark_workload(int(sys.argv[2]) if len(sys.argv) > 2 else 20000,
+                           tuple(int(count) for count in sys.argv[3:]) or (1, 4), cached=not os.environ.get('UNCACHED'))
+    elif sys.argv[1:2] == ['metrics']:
+        benchmark_metrics(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+    else:
+        benchmark_connections(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
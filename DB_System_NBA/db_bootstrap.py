@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from db_ingest import parse_csv
+
+# rows sync_csv writes per transaction: commits are not what a load waits on, and the WAL of a 50M-row load
+# stays a bounded size
+transaction_rows = 1_000_000
+# invalid rows a sync reports by line and message; the rest are only counted
+max_reported_errors = 20
+
+# bookkeeping of what was loaded from each CSV file: the file fingerprint, and a digest per row so that a
+# changed file only rewrites the rows that changed in it
+META_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS csv_sources (
+        source TEXT PRIMARY KEY,
+        path TEXT,
+        size INTEGER,
+        mtime_ns INTEGER,
+        checksum TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS csv_rows (
+        source TEXT,
+        row_key TEXT,
+        digest TEXT,
+        PRIMARY KEY (source, row_key)
+    ) WITHOUT ROWID
+    ''',
+    # the row keys a sync has read so far, to find the rows gone from the file at the end; a table rather
+    # than a set in memory (or a temp table, which temp_store keeps in memory) so a file of any size fits
+    '''
+    CREATE TABLE IF NOT EXISTS csv_seen (
+        source TEXT,
+        row_key TEXT,
+        PRIMARY KEY (source, row_key)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def create_meta_tables(conn):
+    for statement in META_TABLES:
+        conn.execute(statement)
+
+
+def file_checksum(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as csv_file:
+        for block in iter(lambda: csv_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_block(conn, upsert, changed, invalid):
+    # upsert the changed rows of a block and return those written; when one breaks a constraint of the
+    # table (a CHECK, a UNIQUE column) the block is written again row by row and the offending rows are
+    # added to invalid instead
+    try:
+        conn.executemany(upsert, (row for _, _, row in changed))
+        return changed
+    except sqlite3.IntegrityError:
+        written = []
+        for entry in changed:
+            try:
+                conn.execute(upsert, entry[2])
+                written.append(entry)
+            except sqlite3.IntegrityError as error:
+                invalid.append((None, f'{error}: {entry[2]}', entry[0]))
+        return written
+
+
+def sync_csv(conn, table, path, key_columns, force=False, encoding='gbk', indexes=None, workers=0,
+             report=None):
+    # bring `table` up to date with a CSV file and return the number of rows written, or None when the
+    # file is unchanged since the last sync (same size and mtime, or same checksum) and was not even read.
+    # Rows are upserted on key_columns and only when their content changed since the last sync; rows gone
+    # from the file are deleted. Rows the application changed or added itself are left alone unless the
+    # file changes the same key. When a key repeats in the file, its last row wins.
+    # The file is streamed in blocks (db_ingest), typed and checked against the declared columns of the
+    # table, and written with one executemany per block and a commit every transaction_rows rows, so memory
+    # does not grow with the file. Invalid rows are skipped (a row that was loaded before keeps its old
+    # values). On the first load of an empty table its indexes among `indexes` (name -> (table, columns))
+    # are dropped and built once after the rows are in. workers > 0 parses in that many processes. A
+    # report dict gets the rows read and written, the invalid ones (with the first max_reported_errors
+    # messages), the seconds taken and rows per second.
+    stat = os.stat(path)
+    loaded = conn.execute('SELECT size, mtime_ns, checksum FROM csv_sources WHERE source = ?',
+                          (table,)).fetchone()
+    if not force and loaded and loaded[:2] == (stat.st_size, stat.st_mtime_ns):
+        return None
+    checksum = file_checksum(path)
+    if not force and loaded and loaded[2] == checksum:
+        # touched but not modified
+        conn.execute('UPDATE csv_sources SET size = ?, mtime_ns = ? WHERE source = ?',
+                     (stat.st_size, stat.st_mtime_ns, table))
+        conn.commit()
+        return None
+    start = time.perf_counter()
+    columns, blocks = parse_csv(conn, table, path, key_columns, encoding, workers)
+    values = [column for column in columns if column not in key_columns]
+    upsert = (f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+              f'ON CONFLICT ({", ".join(key_columns)}) DO ')
+    upsert += f'UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in values)}' \
+        if values else 'NOTHING'
+    # nothing recorded yet: every row is new and none can have been removed
+    first = conn.execute('SELECT 1 FROM csv_rows WHERE source = ? LIMIT 1', (table,)).fetchone() is None
+    deferred = {}
+    if first and conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is None:
+        # should the load fail, initialize_data() creates them again
+        deferred = {name: index_columns for name, (index_table, index_columns) in (indexes or {}).items()
+                    if index_table == table}
+        for name in deferred:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.execute('DELETE FROM csv_seen WHERE source = ?', (table,))
+    read = written = uncommitted = 0
+    invalid_rows = 0
+    errors = []
+    for rows, invalid in blocks:
+        read += len(rows) + len(invalid)
+        current = {key: (digest, row) for key, digest, row in rows}
+        kept = [key for _, _, key in invalid if key is not None]
+        if first:
+            previous = {}
+        else:
+            previous = dict(conn.execute(
+                'SELECT row_key, digest FROM csv_rows WHERE source = ? AND row_key IN '
+                '(SELECT value FROM json_each(?))', (table, json.dumps(list(current)))))
+            conn.executemany('INSERT OR IGNORE INTO csv_seen (source, row_key) VALUES (?, ?)',
+                             ((table, key) for key in [*current, *kept]))
+        changed = write_block(conn, upsert, [(key, digest, row) for key, (digest, row) in current.items()
+                                             if force or previous.get(key) != digest], invalid)
+        conn.executemany('INSERT OR REPLACE INTO csv_rows (source, row_key, digest) VALUES (?, ?, ?)',
+                         ((table, key, digest) for key, digest, _ in changed))
+        written += len(changed)
+        invalid_rows += len(invalid)
+        errors += invalid[:max_reported_errors - len(errors)]
+        uncommitted += len(rows)
+        if uncommitted >= transaction_rows:
+            conn.commit()
+            uncommitted = 0
+    removed = 0
+    if not first:
+        # the rows of the table whose keys were recorded but not seen in the file this time
+        seen = ('NOT EXISTS (SELECT 1 FROM csv_seen '
+                'WHERE csv_seen.source = ? AND csv_seen.row_key = csv_rows.row_key)')
+        keys = ', '.join(f"json_extract(row_key, '$[{i}]')" for i in range(len(key_columns)))
+        conn.execute(f'DELETE FROM {table} WHERE ({", ".join(key_columns)}) IN '
+                     f'(SELECT {keys} FROM csv_rows WHERE source = ? AND {seen})', (table, table))
+        removed = conn.execute(f'DELETE FROM csv_rows WHERE source = ? AND {seen}', (table, table)).rowcount
+        conn.execute('DELETE FROM csv_seen WHERE source = ?', (table,))
+    conn.execute('INSERT OR REPLACE INTO csv_sources (source, path, size, mtime_ns, checksum) '
+                 'VALUES (?, ?, ?, ?, ?)', (table, path, stat.st_size, stat.st_mtime_ns, checksum))
+    conn.commit()
+    if deferred:
+        # CREATE INDEX sorts in temporary files, which temp_store = MEMORY (db_pool) keeps in RAM: several
+        # GiB for a 50M-row table instead of the page cache
+        temp_store = conn.execute('PRAGMA temp_store').fetchone()[0]
+        conn.execute('PRAGMA temp_store = FILE')
+        for name, index_columns in deferred.items():
+            conn.execute(f'CREATE INDEX {name} ON {table} ({", ".join(index_columns)})')
+        conn.commit()
+        conn.execute(f'PRAGMA temp_store = {temp_store}')
+    seconds = time.perf_counter() - start
+    if report is not None:
+        report.update({'rows': read, 'written': written, 'removed': removed, 'invalid': invalid_rows,
+                       'errors': errors, 'seconds': seconds,
+                       'rows_per_second': read / seconds if seconds else 0.0})
+    return written + removed
+
+
+def refresh_statistics(conn):
+    # without statistics the planner cannot tell a selective index (player) from a coarse one (team) when
+    # both match an equality; sampled ones (analysis_limit) tie them on large tables, so this is a full
+    # ANALYZE (about 6 s on 10M Players rows, a tenth of building the indexes)
+    conn.execute('ANALYZE')
+
+
+def index_columns(conn, name):
+    return tuple(row[2] for row in conn.execute(f'PRAGMA index_info({name})'))
+
+
+def sync_indexes(conn, indexes, prefix='idx_'):
+    # make the database hold exactly the given secondary indexes (name -> (table, columns)): indexes named
+    # with the prefix that are not in the set, or index other columns, are dropped, missing ones created
+    existing = {name: table for name, table in conn.execute(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND substr(name, 1, ?) = ?",
+        (len(prefix), prefix))}
+    dropped = []
+    for name, table in existing.items():
+        if indexes.get(name) != (table, index_columns(conn, name)):
+            conn.execute(f'DROP INDEX {name}')
+            dropped.append(name)
+    created = []
+    for name, (table, columns) in indexes.items():
+        if name not in existing or name in dropped:
+            conn.execute(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})')
+            created.append(name)
+    if created:
+        refresh_statistics(conn)
+    return created, dropped
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# results kept per database, and how long (seconds) one is served before it is read again; the time to live
+# bounds how stale a result can get when another process writes the database
+cache_size = 4096
+cache_ttl = 60.0
+# a search with more rows than this is streamed without being kept, so a listing of a whole table never
+# ends up in memory
+max_cached_rows = 1000
+# what get() returns for a query that is not cached (None is a cached "no such row")
+missing = object()
+
+
+def normalize(sql):
+    # the same query with different spacing or line breaks shares an entry
+    return ' '.join(sql.split())
+
+
+def same_value(a, b):
+    # the menus pass the season as typed ('2023') and SQLite compares it to the integer column as 2023
+    return a == b or str(a) == str(b)
+
+
+class ResultCache:
+    # an LRU of query results with a time to live, keyed on (normalized SQL, parameters). Every entry is
+    # tagged with its table and the column values its query fixes, e.g. ('Teams', {'team': 'LAL',
+    # 'season': 2023}); a write to a row invalidates only the entries of that table whose fixed values agree
+    # with the row, so writing LAL 2023 keeps the BOS entries and drops "every team in 2023".
+    def __init__(self, size=None, ttl=None, max_rows=None):
+        self.size = size or cache_size
+        self.ttl = cache_ttl if ttl is None else ttl
+        self.max_rows = max_cached_rows if max_rows is None else max_rows
+        self.entries = OrderedDict()  # key -> (expires, table, fixed, result), least recently used first
+        self.lock = threading.Lock()
+        # bumped by every write; a result read before a write finished is not stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return missing
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key, table, fixed, result, generation):
+        # generation is self.generation from before the result was read
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, table, fixed, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table, rows):
+        # drop the entries of the table whose fixed values agree with one of the written rows (dicts of
+        # column -> value; a column a row leaves out matches anything)
+        with self.lock:
+            self.generation += 1
+            stale = [key for key, (expires, entry_table, fixed, result) in self.entries.items()
+                     if entry_table == table and any(
+                         all(same_value(value, row[column]) for column, value in fixed.items() if column in row)
+                         for row in rows)]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
+
+
+caches = {}
+caches_lock = threading.Lock()
+
+
+def get_cache(db_file):
+    # the result cache of a database file, shared by every NBAStore on it in this process
+    key = os.path.abspath(db_file)
+    with caches_lock:
+        cache = caches.get(key)
+        if cache is None:
+            cache = caches[key] = ResultCache()
+        return cache
+
+
+def clear_all():
+    with caches_lock:
+        for cache in caches.values():
+            cache.clear()
@@ -0,0 +1,185 @@
+import csv
+import hashlib
+import io
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# CSV files are read in blocks of about block_size bytes, each ending at a line break, so a file of any size
+# is parsed in bounded memory; a block (some 40,000 Players rows) is also what goes to one executemany
+block_size = 4 << 20
+# blocks each parsing process may be ahead of the writer
+blocks_ahead = 2
+
+
+def column_kind(declared):
+    # the affinity SQLite gives a declared column type
+    declared = declared.upper()
+    if 'INT' in declared:
+        return 'integer'
+    if 'CHAR' in declared or 'CLOB' in declared or 'TEXT' in declared:
+        return 'text'
+    if 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared:
+        return 'real'
+    return 'numeric'
+
+
+def to_integer(text):
+    # '12.0' is 12, '12.5' and 'x' are errors
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            number = float(text)
+        except ValueError:
+            number = None
+        if number is None or not number.is_integer():
+            raise ValueError(f'{text!r} is not an integer') from None
+        return int(number)
+
+
+def to_numeric(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def table_schema(conn, table):
+    # {column: (kind, required)} of a table as it is declared in the database; primary key columns count as
+    # required, since a NULL in one never matches the key of an upsert
+    return {name: (column_kind(declared), bool(notnull or pk))
+            for _, name, declared, notnull, default, pk in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def read_header(path, encoding='gbk'):
+    with open(path, 'rb') as csv_file:
+        return next(csv.reader([csv_file.readline().decode(encoding)]), [])
+
+
+def read_blocks(path, size=block_size):
+    # (number of the first line, bytes) of the blocks of whole rows after the header. A block only ends at
+    # a line break outside quotes (an even number of quotes before it); neither '"' nor '\n' can be part of
+    # a multi-byte character in gbk or utf-8, so the file is cut as raw bytes.
+    with open(path, 'rb') as csv_file:
+        csv_file.readline()
+        line = 2
+        rest = b''
+        for data in iter(lambda: csv_file.read(size), b''):
+            block = rest + data
+            end = block.rfind(b'\n') + 1
+            while end and block.count(b'"', 0, end) % 2:
+                end = block.rfind(b'\n', 0, end - 1) + 1
+            if end:
+                yield line, block[:end]
+                line += block.count(b'\n', 0, end)
+            rest = block[end:]
+        if rest.strip():
+            yield line, rest
+
+
+converters = {'integer': to_integer, 'real': float, 'text': str, 'numeric': to_numeric}
+# the builtins first tried on a whole row; they are several times faster than the functions above and only
+# fail on values those have to look at ('12.0' for an integer) or reject
+fast_converters = {'integer': int, 'real': float, 'text': str, 'numeric': to_numeric}
+
+
+def row_key(row, key_index):
+    # None when a key value is missing
+    key = [row[i] for i in key_index]
+    return None if None in key else json.dumps(key)
+
+
+def convert_fields(fields, convert, names):
+    # the typed row and the error of the last column that failed, or None
+    row = []
+    message = None
+    for to, text, name in zip(convert, fields, names):
+        try:
+            row.append(to(text) if text else None)
+        except ValueError as error:
+            message = f'{name}: {error}'
+            row.append(None)
+    return row, message
+
+
+def parse_block(block, first_line, spec):
+    # the rows of a block as (row key, digest, values) typed after the declared columns, and the rows that
+    # fail validation as (line, message, row key or None). The row key is the JSON of the key values and
+    # the digest a hash of the fields as they are in the file (a tenth of the cost of hashing the typed
+    # row), as sync_csv stores them. This also runs in the parsing processes, so it only takes picklable
+    # arguments.
+    encoding, names, kinds, required, key_index = spec
+    fast = [fast_converters[kind] for kind in kinds]
+    convert = [converters[kind] for kind in kinds]
+    rows = []
+    invalid = []
+    reader = csv.reader(io.StringIO(block.decode(encoding), newline=''))
+    line = first_line
+    for fields in reader:
+        if fields:
+            try:
+                row = [to(text) if text else None for to, text in zip(fast, fields)]
+                message = None
+            except ValueError:
+                row, message = convert_fields(fields, convert, names)
+            if len(fields) != len(names):
+                invalid.append((line, f'{len(fields)} fields, the header has {len(names)}', None))
+            elif message is not None:
+                invalid.append((line, message, row_key(row, key_index)))
+            elif any(row[i] is None for i in required):
+                empty = next(names[i] for i in required if row[i] is None)
+                invalid.append((line, f'{empty} is empty', row_key(row, key_index)))
+            else:
+                rows.append((json.dumps([row[i] for i in key_index]),
+                             hashlib.blake2b('\x1f'.join(fields).encode(), digest_size=16).hexdigest(), row))
+        line = first_line + reader.line_num
+    return rows, invalid
+
+
+def parse_csv(conn, table, path, key_columns, encoding='gbk', workers=0):
+    # the columns of a CSV file and a stream of parse_block results for its blocks, in file order. Every
+    # column of the file must be one of the table and the key columns must be among them; other columns
+    # of the table are left to their defaults. workers > 0 parses the blocks in that many processes while
+    # this one writes, with at most blocks_ahead blocks per process waiting in memory.
+    schema = table_schema(conn, table)
+    names = read_header(path, encoding)
+    unknown = [name for name in names if name not in schema]
+    if unknown or not set(key_columns) <= set(names):
+        raise ValueError(f'{path} does not match table {table}: '
+                         f'{", ".join(unknown) or "a key column is missing"}')
+    spec = (encoding, names, [schema[name][0] for name in names],
+            [i for i, name in enumerate(names) if schema[name][1]],
+            [names.index(column) for column in key_columns])
+    if not workers:
+        return names, (parse_block(block, line, spec) for line, block in read_blocks(path))
+    return names, parse_in_processes(path, spec, workers)
+
+
+def parse_in_processes(path, spec, workers):
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for line, block in read_blocks(path):
+            pending.append(pool.submit(parse_block, block, line, spec))
+            if len(pending) >= workers * blocks_ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+if __name__ == "__main__":
+    # python db_ingest.py [force] [WORKERS]   import the CSV files of the project, reporting rows per second
+    from CSC3170_project import import_data, initialize_data
+    args = sys.argv[1:]
+    initialize_data()
+    reports = {}
+    import_data('force' in args, int(next((arg for arg in args if arg.isdigit()), 0)), reports)
+    for table, report in reports.items():
+        print(f"{table}: {report['rows']:,} rows read, {report['written']:,} written, {report['removed']:,} removed, "
+              f"{report['invalid']:,} invalid in {report['seconds']:.2f} s ({report['rows_per_second']:,.0f} rows/s)")
+    if not reports:
+        print('the CSV files are unchanged since the last import')
@@ -0,0 +1,367 @@
+import atexit
+import bisect
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+from db_cache import caches, normalize
+
+# Timings of every statement run on a connection of db_pool, per query template (the SQL with its
+# parameters as placeholders): a latency histogram, the rows returned (changed, for a write) and the
+# errors, with the result cache lookups of NBAStore, the cost of opening connections and a log of the slow
+# statements and their plans. Off unless METRICS is set in the environment or enable() is called; a
+# connection opened while it is off is a plain sqlite3.Connection, so that nothing is paid per statement.
+enabled = bool(os.environ.get('METRICS'))
+# a statement whose execute and fetches together take longer (seconds) goes to the slow-query log
+slow_query_seconds = float(os.environ.get('SLOW_QUERY_MS', 50)) / 1000
+# slow statements kept in memory; SLOW_QUERY_LOG names a file they are also appended to, as JSON lines.
+# An entry holds the types of the parameters, never their values: they include passwords and user names.
+slow_log_size = 100
+slow_log_file = os.environ.get('SLOW_QUERY_LOG')
+# upper bounds (seconds) of the latency buckets, as Prometheus histograms have them; a last +Inf is implied
+latency_buckets = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+# statements of more templates than this are counted together under 'other', so memory stays bounded
+max_templates = 1000
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(latency_buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(latency_buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # the upper bound of the bucket the q-quantile falls in (the largest finite one past the last)
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(latency_buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return latency_buckets[-1]
+
+    def cumulative(self):
+        # (le, observations at most le) of each bucket, ending with +Inf
+        total = 0
+        buckets = []
+        for bound, count in zip(latency_buckets + ('+Inf',), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def snapshot(self):
+        return {'count': self.count, 'seconds': self.sum,
+                'mean_ms': self.sum / self.count * 1000 if self.count else 0.0,
+                'p50_ms': self.quantile(0.5) * 1000 if self.count else 0.0,
+                'p99_ms': self.quantile(0.99) * 1000 if self.count else 0.0,
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class QueryStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+        self.slow = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}  # template -> QueryStats
+        self.connections = Histogram()
+        self.slow_log = deque(maxlen=slow_log_size)
+        self.started = time.time()
+
+    def stats(self, template):
+        # with the lock held
+        stats = self.queries.get(template)
+        if stats is None:
+            if len(self.queries) >= max_templates:
+                template = 'other'
+                stats = self.queries.get(template)
+            if stats is None:
+                stats = self.queries[template] = QueryStats()
+        return stats
+
+    def record(self, template, seconds, rows, failed=False, slow=None):
+        # slow: the slow-query log entry of the statement, if it was one
+        with self.lock:
+            stats = self.stats(template)
+            stats.latency.observe(seconds)
+            stats.rows += rows
+            stats.errors += failed
+            if slow is not None:
+                stats.slow += 1
+                self.slow_log.append(slow)
+        if slow is not None and slow_log_file:
+            with open(slow_log_file, 'a') as log:
+                log.write(json.dumps(slow) + '\n')
+
+    def record_cache(self, template, hit):
+        with self.lock:
+            stats = self.stats(template)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def record_connection(self, seconds):
+        with self.lock:
+            self.connections.observe(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.queries = {}
+            self.connections = Histogram()
+            self.slow_log.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        # everything as one JSON-ready dict, the templates that took the most time first
+        with self.lock:
+            queries = sorted(self.queries.items(), key=lambda item: -item[1].latency.sum)
+            return {
+                'enabled': enabled,
+                'since': self.started,
+                'slow_query_ms': slow_query_seconds * 1000,
+                'queries': [{'query': template, **stats.latency.snapshot(), 'rows': stats.rows,
+                             'errors': stats.errors, 'slow': stats.slow, 'cache_hits': stats.cache_hits,
+                             'cache_misses': stats.cache_misses} for template, stats in queries],
+                'connections': self.connections.snapshot(),
+                'slow_log': list(self.slow_log),
+                'result_caches': {path: cache.stats() for path, cache in list(caches.items())},
+            }
+
+    def prometheus(self):
+        # the text exposition format of Prometheus
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def histogram(name, help_text, histograms):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, values in histograms:
+                prefix = f'{labels},' if labels else ''
+                for bound, count in values.cumulative():
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{suffix} {values.sum}')
+                lines.append(f'{name}_count{suffix} {values.count}')
+
+        def counter(name, help_text, values):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{{{labels}}} {value}' for labels, value in values)
+
+        with self.lock:
+            queries = [(f'query="{label(template)}"', stats) for template, stats in self.queries.items()]
+            lines = []
+            histogram('nba_query_duration_seconds', 'Time in execute and the fetches of a statement.',
+                      [(labels, stats.latency) for labels, stats in queries if stats.latency.count])
+            counter('nba_query_rows_total', 'Rows returned by the statements of a query.',
+                    [(labels, stats.rows) for labels, stats in queries if stats.latency.count])
+            counter('nba_query_errors_total', 'Statements of a query that raised an error.',
+                    [(labels, stats.errors) for labels, stats in queries if stats.latency.count])
+            counter('nba_slow_queries_total', 'Statements slower than the slow-query threshold.',
+                    [(labels, stats.slow) for labels, stats in queries if stats.latency.count])
+            counter('nba_result_cache_lookups_total', 'Result cache lookups of a query, by result.',
+                    [(f'{labels},result="{result}"', count) for labels, stats in queries
+                     for result, count in (('hit', stats.cache_hits), ('miss', stats.cache_misses))
+                     if stats.cache_hits or stats.cache_misses])
+            histogram('nba_connection_open_seconds', 'Time to open and configure a pooled connection.',
+                      [('', self.connections)])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def parameter_types(params):
+    if isinstance(params, dict):
+        return {name: type(value).__name__ for name, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def explain(conn, sql, params):
+    # the EXPLAIN QUERY PLAN lines of a statement; on a plain cursor, so the EXPLAIN is not recorded itself
+    if sql.lstrip()[:6].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLAC'):
+        return None
+    try:
+        return [detail for _, _, _, detail in sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql,
+                                                                        params)]
+    except sqlite3.Error as error:
+        return [f'no plan: {error}']
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # times execute and the fetches of its statement and counts the rows fetched; a statement is recorded
+    # when it has been read to the end, when the cursor runs the next one or is closed or dropped
+    sql = None
+    params = ()
+    seconds = 0.0
+    rows = 0
+    failed = False
+    many = False
+
+    def execute(self, sql, parameters=()):
+        self.finish()
+        start = time.perf_counter()
+        self.sql, self.params, self.rows, self.failed, self.many = sql, parameters, 0, False, False
+        try:
+            super().execute(sql, parameters)
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            self.seconds = time.perf_counter() - start
+            if self.failed or self.description is None:
+                # an error, or a statement that returns no rows: nothing left to fetch, and the rows of a
+                # write are the ones it changed
+                self.rows = max(self.rowcount, 0)
+                self.finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish()
+        start = time.perf_counter()
+        self.sql, self.params, self.rows, self.failed, self.many = sql, (), 0, False, True
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.seconds += time.perf_counter() - start
+        if row is None:
+            self.finish()
+        else:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self.seconds += time.perf_counter() - start
+        self.rows += len(rows)
+        if len(rows) < size:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.seconds += time.perf_counter() - start
+        self.rows += len(rows)
+        self.finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.seconds += time.perf_counter() - start
+            self.finish()
+            raise
+        self.seconds += time.perf_counter() - start
+        self.rows += 1
+        return row
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def __del__(self):
+        self.finish()
+
+    def finish(self):
+        sql = self.sql
+        if sql is None:
+            return
+        self.sql = None
+        template = normalize(sql)
+        slow = None
+        if self.seconds >= slow_query_seconds:
+            slow = {'time': time.time(), 'query': template, 'params': parameter_types(self.params),
+                    'ms': self.seconds * 1000, 'rows': self.rows,
+                    'plan': None if self.many else explain(self.connection, sql, self.params)}
+        metrics.record(template, self.seconds, max(self.rowcount, 0) if self.many else self.rows, self.failed,
+                       slow)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # every cursor instrumented, commits timed as the COMMIT template
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        metrics.record('COMMIT', time.perf_counter() - start, 0)
+
+
+def connection_factory():
+    # what db_pool opens connections with
+    return InstrumentedConnection if enabled else sqlite3.Connection
+
+
+def enable(on=True):
+    # applies to connections opened afterwards; db_pool.close_all() makes every thread open a new one
+    global enabled
+    enabled = on
+
+
+def dump(path):
+    # the metrics to a file: Prometheus text for a .prom file, JSON otherwise
+    with open(path, 'w') as out:
+        if path.endswith('.prom'):
+            out.write(metrics.prometheus())
+        else:
+            json.dump(metrics.snapshot(), out, indent=1)
+
+
+if enabled and os.environ.get('METRICS_FILE'):
+    # e.g. METRICS=1 METRICS_FILE=metrics.json python CSC3170_project.py
+    atexit.register(dump, os.environ['METRICS_FILE'])
+
+
+if __name__ == "__main__":
+    # python db_metrics.py [json | prometheus] [N]   replay N operations of the workload of benchmark_nba
+    # (default 5000) with the metrics on and print them
+    import db_metrics  # the module db_pool uses, not this __main__
+    db_metrics.enable()
+    from benchmark_nba import ensure_database, run_workload, workload_operations
+    from CSC3170_project import db_file
+    from nba_store import NBAStore
+    ensure_database()
+    store = NBAStore(db_file)
+    run_workload(store, workload_operations(store, int(sys.argv[2]) if len(sys.argv) > 2 else 5000), [])
+    print(db_metrics.metrics.prometheus() if sys.argv[1:2] == ['prometheus']
+          else json.dumps(db_metrics.metrics.snapshot(), indent=1))
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+import time
+
+import db_metrics
+
+# pragmas applied to every pooled connection
+PRAGMAS = {
+    "journal_mode": "WAL",  # readers do not block the writer and the writer does not block readers
+    "synchronous": "NORMAL",  # with WAL only a checkpoint waits for fsync
+    "cache_size": -65536,  # page cache per connection in KiB (64 MiB)
+    "mmap_size": 268435456,  # read the first 256 MiB of the file through a memory map
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # wait up to 5 s for a lock instead of failing with "database is locked"
+}
+
+
+class ConnectionPool:
+    # one long-lived connection per thread for a database file, opened and tuned on first use
+    def __init__(self, db_file, pragmas=None):
+        self.db_file = db_file
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []  # every open connection, so close_all() also reaches other threads' ones
+        self.opened = 0
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            start = time.perf_counter()
+            # instrumented while db_metrics is enabled
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, factory=db_metrics.connection_factory())
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            if db_metrics.enabled:
+                db_metrics.metrics.record_connection(time.perf_counter() - start)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+                self.opened += 1
+        return conn
+
+    def close_all(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        # a fresh thread-local, so every thread opens a new connection on its next call
+        self.local = threading.local()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(db_file):
+    key = os.path.abspath(db_file)
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = ConnectionPool(db_file)
+        return pool
+
+
+def get_connection(db_file):
+    # the calling thread's pooled connection to db_file; callers commit their writes but never close it
+    return get_pool(db_file).connection()
+
+
+def close_all():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close_all()
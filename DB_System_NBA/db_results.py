@@ -0,0 +1,104 @@
+import sys
+
+# rows fetched per query by keyset_pages, per fetchmany by iter_rows and written at once by write_rows
+default_page_size = 1000
+
+
+def iter_rows(cursor, batch_size=None):
+    # a cursor-backed generator: at most one batch of rows is held at a time
+    batch_size = batch_size or default_page_size
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def page_key(conn, table, columns):
+    # the key to page through the rows of a table whose given columns are fixed by equality: the rest of the
+    # columns of the index that fixes the most of them (the fewest left over on a tie), then the rowid, the
+    # tail of every index entry. Pages in that order are consecutive stretches of the index range the
+    # filter searches, so a page stops after its page_size rows instead of reading and sorting every match.
+    # Without such an index the key is the rowid alone.
+    best = None
+    for _, name, unique, origin, partial in conn.execute(f'PRAGMA index_list({table})'):
+        indexed = [column for _, _, column in conn.execute(f'PRAGMA index_info({name})')]
+        if partial or None in indexed:
+            continue  # a partial index or one on expressions cannot order every row
+        fixed = 0
+        while fixed < len(indexed) and indexed[fixed] in columns:
+            fixed += 1
+        if fixed and (best is None or (fixed, -len(indexed)) > (best[0], -len(best[1]))):
+            best = fixed, indexed
+    return (*best[1][best[0]:], 'rowid') if best else ('rowid',)
+
+
+def after_key(key, last):
+    # the condition on the rows after `last` in key order, and its parameters. SQLite sorts NULL first and
+    # a row value holding a NULL compares to nothing, so after a key with a NULL the comparison is spelled
+    # out column by column with IS (the rowid, last in every key, is never NULL).
+    if None not in last:
+        if len(key) == 1:
+            return f'{key[0]} > ?', list(last)
+        return f'({", ".join(key)}) > ({", ".join("?" * len(key))})', list(last)
+    terms = []
+    params = []
+    for i, column in enumerate(key):
+        equal = [f'{before} IS ?' for before in key[:i]]
+        params += last[:i]
+        if last[i] is None:
+            terms.append(' AND '.join(equal + [f'{column} IS NOT NULL']))
+        else:
+            terms.append(' AND '.join(equal + [f'{column} > ?']))
+            params.append(last[i])
+    return '(' + ') OR ('.join(terms) + ')', params
+
+
+def keyset_pages(conn, table, columns='*', where='', params=(), key=('rowid',), page_size=None):
+    # yield the rows of `SELECT columns FROM table WHERE where` a page at a time, ordered by the key
+    # columns, which must end in a unique one. Every page is its own query that resumes after the key of the
+    # previous page's last row (WHERE (key) > (last) ORDER BY key LIMIT page_size) instead of an OFFSET, and
+    # no read transaction stays open between pages. A page only reads its own rows when the key is the order
+    # of the index the filter searches (page_key), or the rowid for the whole table; with any other key each
+    # page finds and sorts all the matching rows it skips.
+    page_size = page_size or default_page_size
+    key_list = ', '.join(key)
+    select = f'SELECT {key_list}, {columns} FROM {table}'
+    order = f' ORDER BY {key_list} LIMIT ?'
+    last = None
+    while True:
+        if last is None:
+            rows = conn.execute(select + (f' WHERE {where}' if where else '') + order,
+                                (*params, page_size)).fetchall()
+        else:
+            after, after_params = after_key(key, last)
+            rows = conn.execute(select + (f' WHERE ({where}) AND ({after})' if where else f' WHERE {after}')
+                                + order, (*params, *after_params, page_size)).fetchall()
+        if not rows:
+            return
+        yield [row[len(key):] for row in rows]
+        if len(rows) < page_size:
+            return
+        last = rows[-1][:len(key)]
+
+
+def stream_rows(conn, table, columns='*', where='', params=(), key=('rowid',), page_size=None):
+    for page in keyset_pages(conn, table, columns, where, params, key, page_size):
+        yield from page
+
+
+def write_rows(rows, out=None, batch_size=None):
+    # print each row on its own line like print(row), but write them out a batch at a time; returns the
+    # number of rows written
+    out = out or sys.stdout
+    batch_size = batch_size or default_page_size
+    count = 0
+    lines = []
+    for row in rows:
+        lines.append(f'{row}\n')
+        if len(lines) >= batch_size:
+            out.write(''.join(lines))
+            count += len(lines)
+            lines.clear()
+    out.write(''.join(lines))
+    return count + len(lines)
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+from CSC3170_project import db_file
+
+
+class HTTPClient:
+    # one keep-alive HTTP/1.1 connection; requests are sent one after another
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.token = None
+
+    async def request(self, method, path, params=None, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        if params:
+            path += '?' + urlencode({name: value for name, value in params.items() if value is not None})
+        data = json.dumps(body).encode() if body is not None else b''
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n'
+        if self.token:
+            head += f'Authorization: Bearer {self.token}\r\n'
+        self.writer.write((head + '\r\n').encode('latin-1') + data)
+        await self.writer.drain()
+        status_line, *header_lines = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        headers = dict(line.split(': ', 1) for line in header_lines if line)
+        payload = await self.reader.readexactly(int(headers['Content-Length']))
+        if headers.get('Connection') == 'close':
+            self.close()
+        return int(status_line.split(' ')[1]), payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = self.reader = None
+
+
+def load_sample(path=db_file):
+    # credentials and query parameters drawn from the database the service runs on
+    conn = sqlite3.connect(path)
+    sample = {
+        'users': {role: conn.execute('SELECT username, password FROM Users WHERE role = ?', (role,)).fetchall()
+                  for role in ('admin', 'scout', 'player')},
+        'players': conn.execute('SELECT player, season FROM Players').fetchall(),
+        'teams': conn.execute('SELECT team, season, playoffs FROM Teams').fetchall(),
+    }
+    conn.close()
+    return sample
+
+
+def next_request(role, rng, sample):
+    # (label, method, path, params, body) of one request a client of the role sends, like workload_mix in
+    # benchmark_nba; admin writes store the value a team already has
+    player, season = rng.choice(sample['players'])
+    team, team_season, playoffs = rng.choice(sample['teams'])
+
+    def maybe(value):
+        return value if rng.random() < 0.5 else None
+
+    if role == 'admin':
+        return rng.choice([
+            ('teams', 'GET', '/teams', {'season': maybe(team_season), 'team': maybe(team)}, None),
+            ('players', 'GET', '/players', {'player': player, 'season': maybe(season)}, None),
+            ('users', 'GET', '/users', {'role': maybe('scout'), 'team': maybe(team)}, None),
+            ('playoffs', 'POST', '/teams/playoffs', None,
+             {'team': team, 'season': team_season, 'playoffs': playoffs}),
+        ])
+    if role == 'scout':
+        return rng.choice([
+            ('scout players', 'GET', '/scout/players', {'player': maybe(player), 'season': maybe(season)}, None),
+            ('young players', 'GET', '/scout/young-players',
+             {'age': rng.randint(19, 25), 'position': maybe(rng.choice(('PG', 'SG', 'SF', 'PF', 'C')))}, None),
+            ('scout team', 'GET', '/scout/team', {'season': maybe(season)}, None),
+        ])
+    return rng.choice([
+        ('player players', 'GET', '/player/players', {'player': maybe(player)}, None),
+        ('player team', 'GET', '/player/team', None, None),
+    ])
+
+
+async def client(host, port, role, requests, rng, sample, latencies, statuses):
+    # log in, then send requests back to back (a closed loop), timing each one
+    http = HTTPClient(host, port)
+    username, password = rng.choice(sample['users'][role])
+    try:
+        status, payload = await http.request('POST', '/login', body={'username': username, 'password': password})
+        statuses[status] = statuses.get(status, 0) + 1
+        if status != 200:
+            return
+        http.token = json.loads(payload)['token']
+        for _ in range(requests):
+            label, method, path, params, body = next_request(role, rng, sample)
+            start = time.perf_counter()
+            status, payload = await http.request(method, path, params, body)
+            latencies.append((label, time.perf_counter() - start))
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        http.close()
+
+
+def percentile(ordered, q):
+    # nearest rank
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_load(host, port, clients=64, requests=100, roles=(('admin', 1), ('scout', 3), ('player', 6)),
+                   seed=3170, sample=None):
+    # `clients` concurrent clients, each on its own connection with a role drawn from the weights, sending
+    # `requests` requests; prints requests/s and latency percentiles and returns them
+    rng = random.Random(seed)
+    sample = sample or load_sample()
+    latencies = []
+    statuses = {}
+    names, weights = zip(*roles)
+    tasks = [client(host, port, role, requests, random.Random(rng.random()), sample, latencies, statuses)
+             for role in rng.choices(names, weights=weights, k=clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    ordered = sorted(seconds for _, seconds in latencies)
+    result = {'clients': clients, 'requests': len(ordered), 'seconds': elapsed,
+              'requests_per_second': len(ordered) / elapsed, 'statuses': statuses,
+              'p50_ms': percentile(ordered, 0.5) * 1000, 'p99_ms': percentile(ordered, 0.99) * 1000,
+              'max_ms': ordered[-1] * 1000}
+    print(f"{clients} clients: {len(ordered)} requests in {elapsed:.2f} s, {result['requests_per_second']:,.0f} "
+          f"req/s, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms, "
+          f"statuses {dict(sorted(statuses.items()))}")
+    return result
+
+
+def start_service(workers=4, max_pending=256):
+    # the service in a child process on a free port; returns the process and its port
+    service = subprocess.Popen([sys.executable, 'nba_service.py', '0', str(workers), str(max_pending)],
+                               stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    line = service.stdout.readline()
+    if not line:
+        service.wait()
+        raise RuntimeError('the service did not start')
+    return service, int(line.split(':')[2].split(' ')[0])
+
+
+if __name__ == "__main__":
+    # python load_generator.py [CLIENTS...]           starts a service and runs each number of clients
+    # python load_generator.py HOST:PORT [CLIENTS...]  against a running service
+    # REQUESTS per client, and WORKERS and MAX_PENDING of the started service, come from the environment
+    # (defaults 100, 4 and 256)
+    args = sys.argv[1:]
+    requests = int(os.environ.get('REQUESTS', 100))
+    if args and ':' in args[0]:
+        host, port = args[0].rsplit(':', 1)
+        for count in [int(count) for count in args[1:]] or [64]:
+            asyncio.run(run_load(host, int(port), count, requests))
+    else:
+        service, port = start_service(int(os.environ.get('WORKERS', 4)), int(os.environ.get('MAX_PENDING', 256)))
+        try:
+            for count in [int(count) for count in args] or [1, 16, 64, 256]:
+                asyncio.run(run_load('127.0.0.1', port, count, requests))
+        finally:
+            service.terminate()
+            service.wait()
@@ -0,0 +1,200 @@
+import math
+import sys
+
+# Materialized rollups of Players. Triggers on Players keep them up to date in the same transaction as the
+# write, whichever path it comes from (the store, the menus, the CSV import), so reading a rollup never
+# scans Players:
+#   TeamSeasonStats  one row per team and season: the number of player rows, the totals, and the sum and
+#                    count of each percentage (their averages are computed on read)
+#   SeasonLeaders    the top leaders_size player rows of every season for each stat in leader_stats
+team_total_columns = ['total_points', 'total_rebound', 'assist', 'steal', 'block', 'turnover', 'personal_foul']
+# totals also read as an average per player row
+team_average_columns = ['total_points', 'assist']
+team_percent_columns = ['field_goals_percent', 'three_points_percent', 'two_points_percent', 'free_throw_percent']
+leader_stats = ['total_points', 'total_rebound', 'assist', 'steal', 'block']
+leaders_size = 10
+# the order of a leaderboard; player_id and team break ties, so the top rows of a season are always the same
+leader_order = 'value DESC, player_id, team'
+
+# the columns find_team_season_stats returns and the expressions that compute them from TeamSeasonStats
+team_stats_columns = (['season', 'team', 'players'] + team_total_columns
+                      + [f'average_{column}' for column in team_average_columns] + team_percent_columns)
+team_stats_select = ', '.join(
+    ['season', 'team', 'players'] + team_total_columns
+    + [f'CAST({column} AS REAL) / players' for column in team_average_columns]
+    + [f'{column}_sum / NULLIF({column}_count, 0)' for column in team_percent_columns])
+
+
+def table_definitions():
+    team_columns = ''.join(f'        {column} INTEGER,\n' for column in team_total_columns)
+    team_columns += ''.join(f'        {column}_sum REAL,\n        {column}_count INTEGER,\n'
+                            for column in team_percent_columns)
+    return {
+        'TeamSeasonStats': f'''CREATE TABLE TeamSeasonStats (
+        season INTEGER,
+        team TEXT,
+        players INTEGER,
+{team_columns}        PRIMARY KEY (season, team)
+    )''',
+        'SeasonLeaders': '''CREATE TABLE SeasonLeaders (
+        stat TEXT,
+        season INTEGER,
+        player_id INTEGER,
+        team TEXT,
+        player TEXT,
+        value NUMERIC,
+        PRIMARY KEY (stat, season, player_id, team)
+    )''',
+    }
+
+
+def add_row(row):
+    # trigger statements counting the Players row `row` (NEW) into the rollups
+    columns = team_total_columns + [f'{column}_{part}' for column in team_percent_columns
+                                    for part in ('sum', 'count')]
+    values = [f'COALESCE({row}.{column}, 0)' for column in team_total_columns]
+    for column in team_percent_columns:
+        values += [f'COALESCE({row}.{column}, 0.0)', f'{row}.{column} IS NOT NULL']
+    statements = [f'''INSERT INTO TeamSeasonStats (season, team, players, {', '.join(columns)})
+        VALUES ({row}.season, {row}.team, 1, {', '.join(values)})
+        ON CONFLICT (season, team) DO UPDATE SET players = players + 1,
+            {', '.join(f'{column} = {column} + excluded.{column}' for column in columns)}''']
+    for stat in leader_stats:
+        # only a row that can make the top of its season is written, and only then is the board cut back.
+        # The guards are explicit because an upsert on Players overrides any OR IGNORE/REPLACE in here, and
+        # in an update the refill of remove_row may have added the row already.
+        board = f"stat = '{stat}' AND season = {row}.season"
+        statements.append(f'''INSERT INTO SeasonLeaders (stat, season, player_id, team, player, value)
+        SELECT '{stat}', {row}.season, {row}.player_id, {row}.team, {row}.player, {row}.{stat}
+        WHERE {row}.{stat} IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM SeasonLeaders
+                            WHERE {board} AND player_id = {row}.player_id AND team = {row}.team)
+            AND ((SELECT count(*) FROM SeasonLeaders WHERE {board}) < {leaders_size}
+                 OR {row}.{stat} >= (SELECT min(value) FROM SeasonLeaders WHERE {board}))''')
+        statements.append(f'''DELETE FROM SeasonLeaders WHERE changes() > 0 AND {board} AND rowid NOT IN (
+            SELECT rowid FROM SeasonLeaders WHERE {board} ORDER BY {leader_order} LIMIT {leaders_size})''')
+    return statements
+
+
+def remove_row(row):
+    # trigger statements taking the Players row `row` (OLD) out of the rollups
+    changes = [f'{column} = {column} - COALESCE({row}.{column}, 0)' for column in team_total_columns]
+    for column in team_percent_columns:
+        changes += [f'{column}_sum = {column}_sum - COALESCE({row}.{column}, 0.0)',
+                    f'{column}_count = {column}_count - ({row}.{column} IS NOT NULL)']
+    key = f'season = {row}.season AND team = {row}.team'
+    statements = [f'''UPDATE TeamSeasonStats SET players = players - 1,
+            {', '.join(changes)}
+        WHERE {key}''',
+                  f'DELETE FROM TeamSeasonStats WHERE {key} AND players = 0',
+                  f'''DELETE FROM SeasonLeaders WHERE stat IN ({', '.join(f"'{stat}'" for stat in leader_stats)})
+            AND season = {row}.season AND player_id = {row}.player_id AND team = {row}.team''']
+    for stat in leader_stats:
+        # a board that lost a row is filled up again with the next best rows of the season in Players,
+        # which the primary key finds without reading the other seasons
+        board = f"stat = '{stat}' AND season = {row}.season"
+        count = f'(SELECT count(*) FROM SeasonLeaders WHERE {board})'
+        statements.append(f'''INSERT INTO SeasonLeaders (stat, season, player_id, team, player, value)
+        SELECT '{stat}', season, player_id, team, player, {stat} AS value FROM Players
+        WHERE season = {row}.season AND {stat} IS NOT NULL AND {count} < {leaders_size}
+            AND NOT EXISTS (SELECT 1 FROM SeasonLeaders AS leader
+                            WHERE leader.stat = '{stat}' AND leader.season = Players.season
+                                AND leader.player_id = Players.player_id AND leader.team = Players.team)
+        ORDER BY {leader_order} LIMIT {leaders_size} - {count}''')
+    return statements
+
+
+def trigger_definitions():
+    def trigger(name, event, statements):
+        body = ''.join(f'        {statement};\n' for statement in statements)
+        return f'CREATE TRIGGER {name} AFTER {event} ON Players\n    BEGIN\n{body}    END'
+    return {
+        'agg_players_insert': trigger('agg_players_insert', 'INSERT', add_row('NEW')),
+        'agg_players_delete': trigger('agg_players_delete', 'DELETE', remove_row('OLD')),
+        'agg_players_update': trigger('agg_players_update', 'UPDATE', remove_row('OLD') + add_row('NEW')),
+    }
+
+
+def team_rollup_query(where=''):
+    # TeamSeasonStats computed from scratch
+    columns = [f'COALESCE(sum({column}), 0)' for column in team_total_columns]
+    for column in team_percent_columns:
+        columns += [f'total({column})', f'count({column})']
+    return (f"SELECT season, team, count(*), {', '.join(columns)} FROM Players"
+            f"{f' WHERE {where}' if where else ''} GROUP BY season, team")
+
+
+def leaders_query():
+    # SeasonLeaders computed from scratch: a sorted LIMIT over each season's range of Players, several
+    # times faster than ranking the whole table with a window function
+    boards = ' UNION ALL '.join(
+        f"SELECT '{stat}', board.season, board.player_id, board.team, board.player, board.{stat} "
+        f"FROM seasons JOIN Players AS board ON board.rowid IN ("
+        f"SELECT rowid FROM Players WHERE season = seasons.season AND {stat} IS NOT NULL "
+        f"ORDER BY {stat} DESC, player_id, team LIMIT {leaders_size})" for stat in leader_stats)
+    return f'WITH seasons AS (SELECT DISTINCT season FROM Players) {boards}'
+
+
+def rebuild_aggregates(conn):
+    # recompute both rollups from Players; the caller commits
+    conn.execute('DELETE FROM TeamSeasonStats')
+    conn.execute(f'INSERT INTO TeamSeasonStats {team_rollup_query()}')
+    conn.execute('DELETE FROM SeasonLeaders')
+    conn.execute(f'INSERT INTO SeasonLeaders (stat, season, player_id, team, player, value) {leaders_query()}')
+
+
+def sync_aggregates(conn):
+    # create the rollup tables and their triggers; when a definition above has changed (or on first use)
+    # they are dropped, created again and rebuilt from Players. Returns whether they were rebuilt.
+    expected = {**table_definitions(), **trigger_definitions()}
+    existing = {name: (kind, sql) for kind, name, sql in conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE name IN ('TeamSeasonStats', 'SeasonLeaders') "
+        "OR (type = 'trigger' AND name LIKE 'agg\\_%' ESCAPE '\\')")}
+    if {name: sql for name, (kind, sql) in existing.items()} == expected:
+        return False
+    for name, (kind, sql) in sorted(existing.items(), key=lambda item: item[1][0] != 'trigger'):
+        conn.execute(f'DROP {kind.upper()} {name}')
+    for sql in expected.values():
+        conn.execute(sql)
+    rebuild_aggregates(conn)
+    return True
+
+
+def same(stored, expected):
+    if isinstance(stored, float) or isinstance(expected, float):
+        return math.isclose(stored, expected, rel_tol=1e-9, abs_tol=1e-9)
+    return stored == expected
+
+
+def check_aggregates(conn):
+    # compare both rollups with a full recompute; returns the differences as (table, key, stored row,
+    # recomputed row), with None for a row that is missing on one side
+    differences = []
+    for table, stored_sql, expected_sql, key_size in (
+            ('TeamSeasonStats', 'SELECT * FROM TeamSeasonStats', team_rollup_query(), 2),
+            ('SeasonLeaders', 'SELECT stat, season, player_id, team, player, value FROM SeasonLeaders',
+             leaders_query(), 4)):
+        stored = {row[:key_size]: row for row in conn.execute(stored_sql)}
+        expected = {row[:key_size]: row for row in conn.execute(expected_sql)}
+        for key in sorted(stored.keys() | expected.keys(), key=repr):
+            a, b = stored.get(key), expected.get(key)
+            if a is None or b is None or not all(same(x, y) for x, y in zip(a, b)):
+                differences.append((table, key, a, b))
+    return differences
+
+
+if __name__ == "__main__":
+    # python nba_aggregates.py [check | rebuild]
+    from CSC3170_project import bootstrap, db_file
+    from db_pool import get_connection
+    bootstrap()
+    conn = get_connection(db_file)
+    if sys.argv[1:2] == ['rebuild']:
+        rebuild_aggregates(conn)
+        conn.commit()
+        print('rebuilt TeamSeasonStats and SeasonLeaders from Players')
+    differences = check_aggregates(conn)
+    for table, key, stored, expected in differences[:20]:
+        print(f'{table} {key}: stored {stored}, recomputed {expected}')
+    print(f'{len(differences)} difference(s) between the rollups and a full recompute')
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,319 @@
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from db_bootstrap import file_checksum
+
+# The CSV stat histories stored column by column for analytics: each column is a .npy file that is
+# memory-mapped on use, so a filter, group-by or top-k reads only the columns it names, at the speed of
+# NumPy over contiguous arrays instead of row by row through SQLite tuples. Text columns are dictionary
+# encoded: <column>.npy holds int32 codes into <column>.values.npy, the sorted distinct strings, so code
+# order is string order. The columns follow the CSV files, not writes made through the application.
+columnar_dir = 'columnar'
+csv_sources = {'Players': 'Player_Totals.csv', 'Teams': 'Team_Totals.csv'}
+# group ids up to this many are counted with bincount directly; a larger key space is compacted first
+max_dense_groups = 1 << 24
+
+
+def encode_column(values):
+    # (array, dictionary): integers in the smallest of int32/int64 that holds them, floats as float64 and
+    # text as codes into its sorted distinct values
+    values = np.asarray(values)
+    if values.dtype.kind in 'OUS':
+        dictionary, codes = np.unique(values.astype(str), return_inverse=True)
+        return codes.astype(np.int32), dictionary
+    if values.dtype.kind in 'iub':
+        if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+            return values.astype(np.int32), None
+        return values.astype(np.int64), None
+    return values.astype(np.float64), None
+
+
+def write_table(directory, columns, source=None, dictionaries=None):
+    # store columns (name -> array or list, all the same length) under directory; a column named in
+    # dictionaries already holds codes into the sorted strings given there. Every build goes to a new
+    # version directory and manifest.json is replaced last, so a reader sees the old or the new table
+    # whole, and arrays it has already mapped stay valid.
+    dictionaries = dictionaries or {}
+    os.makedirs(directory, exist_ok=True)
+    version = f'v{max([int(name[1:]) for name in os.listdir(directory) if name[1:].isdigit()] or [0]) + 1}'
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    kinds = {}
+    rows = None
+    for name, values in columns.items():
+        if name in dictionaries:
+            array, dictionary = np.asarray(values, dtype=np.int32), np.asarray(dictionaries[name])
+        else:
+            array, dictionary = encode_column(values)
+        if rows is not None and len(array) != rows:
+            raise ValueError(f'column {name} has {len(array)} rows, not {rows}')
+        rows = len(array)
+        np.save(os.path.join(path, f'{name}.npy'), array)
+        if dictionary is not None:
+            np.save(os.path.join(path, f'{name}.values.npy'), dictionary)
+        kinds[name] = 'text' if dictionary is not None else array.dtype.name
+    manifest = {'version': version, 'rows': rows or 0, 'columns': kinds, 'source': source}
+    save_manifest(directory, manifest)
+    for name in os.listdir(directory):
+        if name != version and name[1:].isdigit():
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return manifest
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(directory, manifest):
+    # replaced in one step, so a reader never sees half a manifest
+    with open(os.path.join(directory, 'manifest.json.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(os.path.join(directory, 'manifest.json.tmp'), os.path.join(directory, 'manifest.json'))
+
+
+def build_table(table, csv_path=None, directory=None, encoding='gbk'):
+    # convert the CSV file of a table to columns; the file fingerprint is kept like sync_csv does
+    import pandas as pd
+    csv_path = csv_path or csv_sources[table]
+    directory = directory or os.path.join(columnar_dir, table)
+    stat = os.stat(csv_path)
+    df = pd.read_csv(csv_path, encoding=encoding)
+    columns = {name: df[name].fillna('').to_numpy() if df[name].dtype == object else df[name].to_numpy()
+               for name in df.columns}
+    source = {'path': csv_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+              'checksum': file_checksum(csv_path)}
+    return write_table(directory, columns, source)
+
+
+def open_table(table, directory=None, csv_path=None):
+    # the columns of a CSV table, converted again first when the file changed since the last build (a
+    # different size or mtime and a different checksum)
+    csv_path = csv_path or csv_sources[table]
+    directory = directory or os.path.join(columnar_dir, table)
+    manifest = read_manifest(directory)
+    source = (manifest or {}).get('source') or {}
+    stat = os.stat(csv_path)
+    if (source.get('size'), source.get('mtime_ns')) != (stat.st_size, stat.st_mtime_ns):
+        if source.get('checksum') != file_checksum(csv_path):
+            build_table(table, csv_path, directory)
+        else:
+            # touched but not modified
+            manifest['source'].update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            save_manifest(directory, manifest)
+    return ColumnTable(directory)
+
+
+class ColumnTable:
+    # a table stored by write_table. Columns are memory-mapped on first use and shared from then on.
+    # Queries combine three vectorized operations:
+    #   mask(**conditions)                      rows matching every condition, as a boolean array
+    #   group_by(keys, aggregates, mask)        count/sum/mean/min/max per distinct key
+    #   top_k(column, k, mask, by, ties)        row numbers of the k largest values, overall or per group
+    # and rows_of(indices, columns) turns row numbers into tuples with the text decoded.
+    def __init__(self, directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f'no columnar table in {directory}')
+        self.path = os.path.join(directory, manifest['version'])
+        self.rows = manifest['rows']
+        self.kinds = manifest['columns']
+        self.columns = list(self.kinds)
+        self.arrays = {}
+        self.dictionaries = {}
+
+    def column(self, name):
+        # the stored array: int32 codes for a text column
+        array = self.arrays.get(name)
+        if array is None:
+            if name not in self.kinds:
+                raise KeyError(f'no column {name}; the columns are {", ".join(self.columns)}')
+            array = self.arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return array
+
+    def dictionary(self, name):
+        values = self.dictionaries.get(name)
+        if values is None:
+            values = self.dictionaries[name] = np.load(os.path.join(self.path, f'{name}.values.npy'))
+        return values
+
+    def is_text(self, name):
+        return self.kinds[name] == 'text'
+
+    def values(self, name, rows=None):
+        # the decoded values of a column, of the given row numbers or all of them
+        array = self.column(name) if rows is None else self.column(name)[rows]
+        return self.dictionary(name)[array] if self.is_text(name) else np.asarray(array)
+
+    def code(self, name, value, side='left'):
+        # the position of a string among the sorted values of a text column (np.searchsorted)
+        return int(np.searchsorted(self.dictionary(name), str(value), side=side))
+
+    def condition(self, name, condition):
+        column = self.column(name)
+        if isinstance(condition, tuple):
+            # (low, high), both included; None leaves an end open
+            low, high = condition
+            if self.is_text(name):
+                low = None if low is None else self.code(name, low)
+                high = None if high is None else self.code(name, high, 'right') - 1
+            result = np.ones(len(column), dtype=bool)
+            if low is not None:
+                result &= column >= low
+            if high is not None:
+                result &= column <= high
+            return result
+        if isinstance(condition, (list, set, frozenset)):
+            if self.is_text(name):
+                condition = [self.text_code(name, value) for value in condition]
+            return np.isin(column, list(condition))
+        if self.is_text(name):
+            condition = self.text_code(name, condition)
+        return column == condition
+
+    def text_code(self, name, value):
+        # the code of a string, or -1 (which no row has) when the column never holds it
+        code = self.code(name, value)
+        dictionary = self.dictionary(name)
+        return code if code < len(dictionary) and dictionary[code] == str(value) else -1
+
+    def mask(self, **conditions):
+        # the rows where every column matches its condition: a value, a (low, high) range or a list of
+        # values, e.g. mask(season=(2010, 2019), position='PG', age=(None, 22))
+        result = None
+        for name, condition in conditions.items():
+            part = self.condition(name, condition)
+            result = part if result is None else np.logical_and(result, part, out=result)
+        return np.ones(self.rows, dtype=bool) if result is None else result
+
+    def key_codes(self, name, rows=None):
+        # (codes, size, decode): the values of a key column as integers in range(size), and the function
+        # from codes back to values
+        values = np.asarray(self.column(name) if rows is None else self.column(name)[rows])
+        if self.is_text(name):
+            dictionary = self.dictionary(name)
+            return values.astype(np.int64), len(dictionary), lambda codes: dictionary[codes]
+        if values.dtype.kind in 'iu' and len(values) and int(values.max()) - int(values.min()) < max_dense_groups:
+            low = int(values.min())
+            return np.subtract(values, low, dtype=np.int64), int(values.max()) - low + 1, lambda codes: codes + low
+        distinct, codes = np.unique(values, return_inverse=True)
+        return codes.astype(np.int64), len(distinct), lambda codes: distinct[codes]
+
+    def group_ids(self, keys, rows=None):
+        # (ids, decode): a group id per row, ordered like the keys, and the function from ids to a dict of
+        # key arrays
+        ids = None
+        span = 1
+
+        def decode(group_ids):
+            return {}
+        for name in keys:
+            codes, size, values = self.key_codes(name, rows)
+            if ids is None:
+                ids = codes
+            else:
+                ids *= size
+                ids += codes
+            span *= size
+
+            def decode(group_ids, previous=decode, name=name, size=size, values=values):
+                result = previous(group_ids // size)
+                result[name] = values(group_ids % size)
+                return result
+            if span > max_dense_groups:
+                # renumber the groups that occur, to keep the id space small enough for bincount
+                distinct, ids = np.unique(ids, return_inverse=True)
+                ids = ids.astype(np.int64)
+                span = len(distinct)
+
+                def decode(group_ids, previous=decode, distinct=distinct):
+                    return previous(distinct[group_ids])
+        if ids is None:
+            ids = np.zeros(self.rows if rows is None else len(rows), dtype=np.int64)
+        return ids, decode
+
+    def group_by(self, keys, aggregates, mask=None):
+        # one entry per distinct combination of the key columns among the masked rows, in key order: a dict
+        # of arrays with the keys and each aggregate, name -> (function, column) with function one of
+        # count, sum, mean, min, max
+        rows = None if mask is None else np.flatnonzero(mask)
+        ids, decode = self.group_ids(keys, rows)
+        size = int(ids.max()) + 1 if ids.size else 0
+        counts = np.bincount(ids, minlength=size)
+        present = np.flatnonzero(counts)
+        result = decode(present)
+        for name, (function, column) in aggregates.items():
+            if function == 'count':
+                result[name] = counts[present]
+                continue
+            values = np.asarray(self.column(column) if rows is None else self.column(column)[rows])
+            if function in ('sum', 'mean'):
+                sums = np.bincount(ids, weights=values, minlength=size)[present]
+                if function == 'mean':
+                    result[name] = sums / counts[present]
+                else:
+                    result[name] = sums.round().astype(np.int64) if values.dtype.kind in 'iu' else sums
+            elif function in ('min', 'max'):
+                if values.dtype.kind in 'iu':
+                    limit = np.iinfo(values.dtype)
+                    start = limit.max if function == 'min' else limit.min
+                else:
+                    start = np.inf if function == 'min' else -np.inf
+                reduced = np.full(size, start, dtype=values.dtype)
+                (np.minimum if function == 'min' else np.maximum).at(reduced, ids, values)
+                result[name] = reduced[present]
+            else:
+                raise ValueError(f'unknown aggregate {function}; use count, sum, mean, min or max')
+        return result
+
+    def top_k(self, column, k, mask=None, by=None, ties=(), largest=True):
+        # row numbers of the k largest (or smallest) values of a column among the masked rows, best first;
+        # with by, the best k of every group of that column, groups in key order. Equal values are ordered
+        # by the ties columns, then by row number.
+        rows = np.arange(self.rows) if mask is None else np.flatnonzero(mask)
+        values = np.asarray(self.column(column)[rows])
+        if by is None:
+            order, ends = np.arange(len(rows)), [len(rows)]
+        else:
+            ids, _ = self.group_ids([by], rows)
+            # a stable sort of small integer ids is a radix sort
+            order = np.argsort(ids.astype(np.int16) if ids.size and ids.max() < (1 << 15) else ids, kind='stable')
+            ends = np.cumsum(np.bincount(ids))
+        selected = []
+        start = 0
+        for end in ends:
+            segment = order[start:end]
+            start = end
+            if not len(segment):
+                continue
+            keys = values[segment] if largest else -values[segment].astype(np.float64)
+            if len(segment) > k:
+                # everything tied with the k-th value stays a candidate, the ties decide among them
+                kth = np.partition(keys, len(segment) - k)[len(segment) - k]
+                segment = segment[keys >= kth]
+                keys = keys[keys >= kth]
+            ranking = np.lexsort([rows[segment]] + [np.asarray(self.column(name)[rows[segment]])
+                                                    for name in reversed(ties)] + [-keys.astype(np.float64)])
+            selected.append(rows[segment[ranking[:k]]])
+        return np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+
+    def rows_of(self, indices, columns=None):
+        # tuples of the given row numbers, text decoded
+        columns = columns or self.columns
+        decoded = [self.values(name, indices).tolist() for name in columns]
+        return list(zip(*decoded))
+
+
+if __name__ == "__main__":
+    # python nba_columnar.py [TABLE...]   convert the CSV files (all by default) and describe the columns
+    for table in sys.argv[1:] or list(csv_sources):
+        manifest = build_table(table)
+        print(f"{table}: {manifest['rows']:,} rows in {os.path.join(columnar_dir, table, manifest['version'])}")
+        print('  ' + ', '.join(f'{name} {kind}' for name, kind in manifest['columns'].items()))
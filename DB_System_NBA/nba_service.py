@@ -0,0 +1,333 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
+from urllib.parse import parse_qsl, urlsplit
+
+import db_metrics
+from CSC3170_project import bootstrap, db_file, player_columns, team_columns
+from nba_aggregates import team_stats_columns
+from nba_sessions import get_sessions
+from nba_store import NBAStore
+
+reasons = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+           404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+           431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+user_columns = ['user_id', 'username', 'role', 'team']
+json_type = 'application/json'
+text_type = 'text/plain; version=0.0.4; charset=utf-8'  # what Prometheus scrapes
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def text(params, name, required=False):
+    # a string parameter; blank counts as not given, like a blank answer in the menus
+    value = params.get(name)
+    if value in (None, ''):
+        if required:
+            raise HTTPError(400, f'{name} is required')
+        return None
+    return str(value)
+
+
+def integer(params, name, required=False):
+    value = text(params, name, required)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, f'{name} must be an integer') from None
+
+
+def rows(columns, stream):
+    return {'columns': columns, 'rows': [list(row) for row in stream]}
+
+
+class NBAService:
+    # the menu operations as JSON endpoints over HTTP/1.1 with keep-alive, on asyncio streams. SQLite work
+    # runs on a bounded thread pool, each worker reusing its pooled connection; at most max_in_flight
+    # requests are handed to the pool at once and beyond max_pending requests in the service new ones are
+    # turned away with 503 instead of queueing without bound.
+    # Log in with POST /login {"username", "password"} and pass the returned token as
+    # "Authorization: Bearer <token>"; parameters go in the query string of GET and DELETE requests and in
+    # a JSON body for POST.
+    def __init__(self, db_file=db_file, workers=4, max_in_flight=None, max_pending=256,
+                 max_body=1 << 16, max_header=1 << 14):
+        self.store = NBAStore(db_file)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nba-db')
+        self.in_flight = asyncio.Semaphore(max_in_flight or workers)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.max_body = max_body
+        self.max_header = max_header
+        # the role and team of a user are looked up once, at login; each request then only finds its session
+        self.sessions = get_sessions(db_file)
+        self.routes = {
+            ('POST', '/login'): self.login,
+            ('POST', '/logout'): self.logout,
+            ('POST', '/register'): self.register,
+            ('GET', '/teams'): self.view_all_teams,
+            ('GET', '/players'): self.view_all_players,
+            ('GET', '/users'): self.view_all_users,
+            ('GET', '/cache'): self.view_cache_stats,
+            ('GET', '/sessions'): self.view_session_stats,
+            ('GET', '/metrics'): self.view_metrics,
+            ('DELETE', '/users'): self.delete_user,
+            ('POST', '/players/team'): self.update_player_team,
+            ('POST', '/teams/playoffs'): self.update_team_playoffs,
+            ('DELETE', '/players'): self.delete_player,
+            ('GET', '/scout/players'): self.view_scout_team_players,
+            ('GET', '/scout/young-players'): self.view_young_players,
+            ('GET', '/scout/team'): self.view_team_info_by_year,
+            ('GET', '/scout/team-stats'): self.view_team_season_stats,
+            ('GET', '/scout/leaders'): self.view_leaders,
+            ('GET', '/player/players'): self.view_current_team_player,
+            ('GET', '/player/team'): self.view_current_team_info,
+        }
+
+    # sessions and roles
+    def user(self, token, role):
+        # (username, team) of the session, which must belong to a user of the given role; a session ends
+        # when it expires or its user is deleted or changed, and then the client has to log in again
+        session = self.sessions.get(token) if token else None
+        if session is None:
+            raise HTTPError(401, 'log in first')
+        if session.role != role:
+            raise HTTPError(403, f'only {role} can do this operation')
+        return session.username, session.team
+
+    def login(self, params, token):
+        username = text(params, 'username', True)
+        result = self.store.get_credentials(username)
+        if result is None or str(params.get('password')) != str(result[0]):
+            raise HTTPError(401, 'wrong user name or password')
+        password, role, team = result
+        return 200, {'token': self.sessions.create(username, role, team).token, 'role': role}
+
+    def logout(self, params, token):
+        if token:
+            self.sessions.end(token)
+        return 200, {}
+
+    def register(self, params, token):
+        username = text(params, 'username', True)
+        team = text(params, 'team', True)
+        user_id = integer(params, 'user_id', True)
+        if self.store.username_exists(username):
+            raise HTTPError(409, f'user name {username} has been used')
+        if not self.store.team_exists(team):
+            raise HTTPError(400, f'team {team} does not exist')
+        if not self.store.add_user(user_id, username, text(params, 'password', True), 'player', team):
+            raise HTTPError(409, f'user id {user_id} or user name {username} has been used')
+        return 201, {'user_id': user_id, 'username': username, 'role': 'player', 'team': team}
+
+    # admin
+    def view_all_teams(self, params, token):
+        self.user(token, 'admin')
+        return 200, rows(team_columns, self.store.find_teams(integer(params, 'season'), text(params, 'team')))
+
+    def view_all_players(self, params, token):
+        self.user(token, 'admin')
+        return 200, rows(player_columns, self.store.find_players(text(params, 'player'),
+                                                                 integer(params, 'season')))
+
+    def view_all_users(self, params, token):
+        self.user(token, 'admin')
+        return 200, rows(user_columns, self.store.find_users(text(params, 'username'), text(params, 'role'),
+                                                             text(params, 'team')))
+
+    def view_cache_stats(self, params, token):
+        self.user(token, 'admin')
+        return 200, self.store.cache_stats() or {}
+
+    def view_session_stats(self, params, token):
+        self.user(token, 'admin')
+        return 200, self.sessions.stats()
+
+    def view_metrics(self, params, token):
+        # the statement metrics of db_metrics (run the service with METRICS=1), as Prometheus text or with
+        # ?format=json as JSON
+        self.user(token, 'admin')
+        if params.get('format') == 'json':
+            return 200, db_metrics.metrics.snapshot()
+        return 200, db_metrics.metrics.prometheus()
+
+    def delete_user(self, params, token):
+        self.user(token, 'admin')
+        return 200, {'deleted': self.store.delete_user(text(params, 'username', True))}
+
+    def update_player_team(self, params, token):
+        self.user(token, 'admin')
+        player = text(params, 'player', True)
+        team = text(params, 'team', True)
+        current_year = 2023
+        player_info = self.store.get_player(player, current_year)
+        if not player_info:
+            raise HTTPError(404, f'no record found for player {player} in {current_year}')
+        if not self.store.add_player_team(*player_info, team):
+            raise HTTPError(409, f'player {player} already has a record with team {team} in {current_year}')
+        return 200, rows(player_columns, self.store.find_players(player, current_year))
+
+    def update_team_playoffs(self, params, token):
+        self.user(token, 'admin')
+        team = text(params, 'team', True)
+        season = integer(params, 'season', True)
+        if not self.store.set_playoffs(team, season, integer(params, 'playoffs', True)):
+            raise HTTPError(404, f'no record for team {team} in season {season}')
+        return 200, rows(team_columns, [self.store.get_team(team, season)])
+
+    def delete_player(self, params, token):
+        self.user(token, 'admin')
+        return 200, {'deleted': self.store.delete_players(text(params, 'player', True),
+                                                          integer(params, 'season', True))}
+
+    # scout
+    def view_scout_team_players(self, params, token):
+        username, team = self.user(token, 'scout')
+        return 200, rows(player_columns, self.store.find_players(text(params, 'player'),
+                                                                 integer(params, 'season'), team))
+
+    def view_young_players(self, params, token):
+        self.user(token, 'scout')
+        age = integer(params, 'age')
+        return 200, rows(player_columns, self.store.find_young_players(
+            2023, 25 if age is None else age, text(params, 'position'), text(params, 'team')))
+
+    def view_team_info_by_year(self, params, token):
+        username, team = self.user(token, 'scout')
+        return 200, rows(team_columns, self.store.find_teams(integer(params, 'season'), team))
+
+    def view_team_season_stats(self, params, token):
+        self.user(token, 'scout')
+        return 200, rows(team_stats_columns, self.store.find_team_season_stats(integer(params, 'season'),
+                                                                               text(params, 'team')))
+
+    def view_leaders(self, params, token):
+        self.user(token, 'scout')
+        try:
+            leaders = self.store.get_leaders(text(params, 'stat', True), integer(params, 'season', True),
+                                             integer(params, 'limit'))
+        except ValueError as error:
+            raise HTTPError(400, str(error)) from None
+        return 200, rows(['player_id', 'player', 'team', 'value'], leaders)
+
+    # player
+    def view_current_team_player(self, params, token):
+        username, team = self.user(token, 'player')
+        return 200, rows(player_columns, self.store.find_players(text(params, 'player'), 2023, team))
+
+    def view_current_team_info(self, params, token):
+        username, team = self.user(token, 'player')
+        return 200, rows(team_columns, self.store.find_teams(2023, team))
+
+    # HTTP
+    def call(self, handler, params, token):
+        # runs on a pool thread: the query and the JSON encoding both stay off the event loop. A handler
+        # returning a str answers with it as plain text.
+        try:
+            status, payload = handler(params, token)
+        except HTTPError as error:
+            status, payload = error.status, {'error': str(error)}
+        except Exception as error:  # a bug or a database error, reported rather than dropping the connection
+            status, payload = 500, {'error': f'{type(error).__name__}: {error}'}
+        if isinstance(payload, str):
+            return status, payload.encode(), text_type
+        return status, json.dumps(payload).encode(), json_type
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            allowed = any(path == url.path for _, path in self.routes)
+            status = 405 if allowed else 404
+            return status, json.dumps({'error': reasons[status]}).encode(), json_type
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                params.update(json.loads(body))
+            except (ValueError, TypeError, AttributeError):
+                return 400, b'{"error": "the body must be a JSON object"}', json_type
+        authorization = headers.get('authorization', '')
+        token = authorization[7:] if authorization.startswith('Bearer ') else None
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return 503, b'{"error": "too many requests in progress"}', json_type
+        self.pending += 1
+        try:
+            async with self.in_flight:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, self.call, handler,
+                                                                        params, token)
+        finally:
+            self.pending -= 1
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 431, b'{"error": "request head too large"}', False)
+                    return
+                request_line, *header_lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                    headers = {}
+                    for line in header_lines:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self.respond(writer, 400, b'{"error": "malformed request"}', False)
+                    return
+                if length > self.max_body:
+                    await self.respond(writer, 413, b'{"error": "request body too large"}', False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, payload, content_type = await self.dispatch(method, target, headers, body)
+                await self.respond(writer, status, payload, keep_alive, content_type)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive, content_type=json_type):
+        writer.write(f'HTTP/1.1 {status} {reasons[status]}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8080, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=self.max_header)
+        address = server.sockets[0].getsockname()
+        print(f"NBA service on http://{address[0]}:{address[1]} with {self.workers} database workers",
+              flush=True)
+        if ready is not None:
+            ready(address)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python nba_service.py [PORT] [WORKERS] [MAX_PENDING]   port 0 picks a free one
+    bootstrap()
+    service = NBAService(workers=int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+                         max_pending=int(sys.argv[3]) if len(sys.argv) > 3 else 256)
+    try:
+        asyncio.run(service.serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.executor.shutdown()
@@ -0,0 +1,126 @@
+import os
+import secrets
+import threading
+import time
+
+# how long (seconds) a session lasts since it was last used; it also bounds how long a session outlives a
+# change to its user made by another process, which cannot end it
+session_ttl = 30 * 60.0
+# expired sessions nobody asks for again are dropped at a login at most this often (seconds)
+sweep_interval = 60.0
+
+
+class Session:
+    # what a login established about a user: the role and team the menus and the service authorize with,
+    # so checking a request reads no database
+    def __init__(self, token, username, role, team, expires):
+        self.token = token
+        self.username = username
+        self.role = role
+        self.team = team
+        self.expires = expires
+
+
+class SessionStore:
+    # the sessions of a database, by token. get() takes no lock: a dict lookup and a clock read are all a
+    # request pays to be authorized. A session ends at logout, when it has not been used for ttl seconds,
+    # or when its user is deleted or changed (end_user, called by NBAStore on every write to Users).
+    def __init__(self, ttl=None):
+        self.ttl = session_ttl if ttl is None else ttl
+        self.sessions = {}  # token -> Session
+        self.by_user = {}  # username -> tokens of its sessions
+        self.lock = threading.Lock()
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.created = 0
+        self.expired = 0
+        self.ended = 0
+
+    def create(self, username, role, team):
+        now = time.monotonic()
+        session = Session(secrets.token_urlsafe(18), username, role, team, now + self.ttl)
+        with self.lock:
+            if now >= self.next_sweep:
+                self.sweep(now)
+            self.sessions[session.token] = session
+            self.by_user.setdefault(username, set()).add(session.token)
+            self.created += 1
+        return session
+
+    def get(self, token):
+        # the live session of a token, or None; using it extends it
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if session.expires <= now:
+            with self.lock:
+                if self.remove(token) is not None:
+                    self.expired += 1
+            return None
+        session.expires = now + self.ttl
+        return session
+
+    def remove(self, token):
+        # with the lock held
+        session = self.sessions.pop(token, None)
+        if session is not None:
+            tokens = self.by_user.get(session.username)
+            tokens.discard(token)
+            if not tokens:
+                del self.by_user[session.username]
+        return session
+
+    def sweep(self, now):
+        # with the lock held
+        for token in [token for token, session in self.sessions.items() if session.expires <= now]:
+            self.remove(token)
+            self.expired += 1
+        self.next_sweep = now + sweep_interval
+
+    def end(self, token):
+        # logout
+        with self.lock:
+            self.remove(token)
+
+    def end_user(self, usernames):
+        # end every session of the given users; returns how many ended
+        with self.lock:
+            tokens = [token for username in usernames for token in self.by_user.get(username, ())]
+            for token in tokens:
+                self.remove(token)
+            self.ended += len(tokens)
+        return len(tokens)
+
+    def revalidate(self, get_user):
+        # after Users changed in bulk (a CSV import): end the sessions of users who are gone or whose
+        # (team, role) get_user(username) no longer gives
+        with self.lock:
+            users = {session.username: (session.team, session.role) for session in self.sessions.values()}
+        return self.end_user([username for username, user in users.items()
+                              if get_user(username) != user])
+
+    def clear(self):
+        with self.lock:
+            self.ended += len(self.sessions)
+            self.sessions.clear()
+            self.by_user.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'sessions': len(self.sessions), 'users': len(self.by_user), 'created': self.created,
+                    'expired': self.expired, 'ended': self.ended}
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+def get_sessions(db_file):
+    # the session store of a database file, shared by the menus, the service and every NBAStore on it in
+    # this process
+    key = os.path.abspath(db_file)
+    with stores_lock:
+        sessions = stores.get(key)
+        if sessions is None:
+            sessions = stores[key] = SessionStore()
+        return sessions
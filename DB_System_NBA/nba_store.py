@@ -0,0 +1,216 @@
+import os
+import sqlite3
+
+import db_metrics
+from db_cache import get_cache, missing, normalize
+from db_pool import get_connection
+from db_results import page_key, stream_rows
+from nba_aggregates import leader_order, leader_stats, leaders_size, team_stats_select
+from nba_sessions import get_sessions
+
+
+def filters(**values):
+    # "a = ? AND b = ?" and its parameters for the keyword values that are not None, in the given order
+    columns = [column for column, value in values.items() if value is not None]
+    return ' AND '.join(f'{column} = ?' for column in columns), tuple(values[column] for column in columns)
+
+
+# (database file, table, filtered columns) -> the page_key of the search; the indexes only change at a
+# bootstrap (sync_indexes), and a key that no index follows any more still pages correctly, only slower
+page_keys = {}
+
+
+class NBAStore:
+    # the queries of the NBA system as methods: lookups return a row or None, searches return a stream of
+    # rows (keyset pages of page_size rows), writes return whether or how many rows they changed. Nothing
+    # here prompts or prints; the menus in CSC3170_project are built on top of it.
+    # Reads go through the result cache of the database (db_cache), shared by every store on the file, and
+    # each write invalidates the cached results that could hold a row it changed; cached=False always reads
+    # SQLite. A write to Users also ends the sessions (nba_sessions) of the users it changed.
+    def __init__(self, db_file='NBA_STATS.db', cached=True):
+        self.db_file = db_file
+        self.cache = get_cache(db_file) if cached else None
+        self.sessions = get_sessions(db_file)
+
+    @property
+    def conn(self):
+        return get_connection(self.db_file)
+
+    def stream(self, table, columns, page_size, values):
+        # the rows matching the keyword values that are not None, in the order of the index that finds them
+        where, params = filters(**values)
+        fixed = tuple(column for column, value in values.items() if value is not None)
+        cache_key = (os.path.abspath(self.db_file), table, fixed)
+        key = page_keys.get(cache_key)
+        if key is None:
+            key = page_keys[cache_key] = page_key(self.conn, table, fixed)
+        return stream_rows(self.conn, table, columns, where, params, key, page_size)
+
+    def lookup(self, table, sql, params, **fixed):
+        # the first row of a query or None; fixed are the column values the query selects by
+        if self.cache is None:
+            return self.conn.execute(sql, params).fetchone()
+        key = (normalize(sql), params)
+        row = self.cache.get(key)
+        if db_metrics.enabled:
+            db_metrics.metrics.record_cache(key[0], row is not missing)
+        if row is missing:
+            generation = self.cache.generation
+            row = self.conn.execute(sql, params).fetchone()
+            self.cache.put(key, table, fixed, row, generation)
+        return row
+
+    def search(self, table, columns='*', page_size=None, **values):
+        # the rows matching the keyword values that are not None, streamed; a result of at most
+        # cache.max_rows rows is kept once it has been read to the end and served from memory after that
+        if self.cache is None:
+            return self.stream(table, columns, page_size, values)
+        where, params = filters(**values)
+        key = (normalize(f'SELECT {columns} FROM {table} WHERE {where}'), params)
+        rows = self.cache.get(key)
+        if db_metrics.enabled:
+            db_metrics.metrics.record_cache(key[0], rows is not missing)
+        if rows is not missing:
+            return iter(rows)
+        fixed = {column: value for column, value in values.items() if value is not None}
+        return self.read_through(key, table, fixed, self.stream(table, columns, page_size, values))
+
+    def read_through(self, key, table, fixed, rows):
+        generation = self.cache.generation
+        kept = []
+        for row in rows:
+            if kept is not None:
+                kept.append(row)
+                if len(kept) > self.cache.max_rows:
+                    kept = None
+            yield row
+        if kept is not None:
+            self.cache.put(key, table, fixed, tuple(kept), generation)
+
+    def invalidate(self, table, rows):
+        # rows: a dict of column values for each row a committed write changed
+        if self.cache is not None and rows:
+            self.cache.invalidate(table, rows)
+        if table == 'Users':
+            self.sessions.end_user([row['username'] for row in rows])
+
+    # Users
+    def get_user(self, username):
+        # (team, role) of a user
+        return self.lookup('Users', 'SELECT team, role FROM Users WHERE username = ?', (username,),
+                           username=username)
+
+    def get_credentials(self, username):
+        # (password, role, team) of a user: all a login needs to check it and start a session
+        return self.lookup('Users', 'SELECT password, role, team FROM Users WHERE username = ?', (username,),
+                           username=username)
+
+    def username_exists(self, username):
+        return self.lookup('Users', 'SELECT 1 FROM Users WHERE username = ?', (username,),
+                           username=username) is not None
+
+    def add_user(self, user_id, username, password, role, team):
+        # False when the user id or the username is taken
+        conn = self.conn
+        try:
+            conn.execute('INSERT INTO Users (user_id, username, password, role, team) VALUES (?, ?, ?, ?, ?)',
+                         (user_id, username, password, role, team))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return False
+        self.invalidate('Users', [{'user_id': user_id, 'username': username, 'role': role, 'team': team}])
+        return True
+
+    def delete_user(self, username):
+        conn = self.conn
+        deleted = conn.execute('DELETE FROM Users WHERE username = ? RETURNING user_id, username, role, team',
+                               (username,)).fetchall()
+        conn.commit()
+        self.invalidate('Users', [dict(zip(('user_id', 'username', 'role', 'team'), row)) for row in deleted])
+        return len(deleted)
+
+    def find_users(self, username=None, role=None, team=None, page_size=None):
+        # (user_id, username, role, team) rows
+        return self.search('Users', 'user_id, username, role, team', page_size,
+                           username=username, role=role, team=team)
+
+    # Teams
+    def team_exists(self, team):
+        return self.lookup('Teams', 'SELECT 1 FROM Teams WHERE team = ?', (team,), team=team) is not None
+
+    def find_teams(self, season=None, team=None, page_size=None):
+        return self.search('Teams', page_size=page_size, season=season, team=team)
+
+    def get_team(self, team, season):
+        return self.lookup('Teams', 'SELECT * FROM Teams WHERE team = ? AND season = ?', (team, season),
+                           team=team, season=season)
+
+    def set_playoffs(self, team, season, playoffs):
+        conn = self.conn
+        updated = conn.execute('UPDATE Teams SET playoffs = ? WHERE team = ? AND season = ? '
+                               'RETURNING season, team', (playoffs, team, season)).fetchall()
+        conn.commit()
+        self.invalidate('Teams', [{'season': row[0], 'team': row[1]} for row in updated])
+        return len(updated)
+
+    # Players
+    def find_players(self, player=None, season=None, team=None, page_size=None):
+        return self.search('Players', page_size=page_size, team=team, player=player, season=season)
+
+    def find_young_players(self, season, age, position=None, team=None, page_size=None):
+        # the players of a season of exactly the given age
+        return self.search('Players', page_size=page_size, season=season, age=age, position=position,
+                           team=team)
+
+    def get_player(self, player, season):
+        # (season, player_id, player, position, age) of the first record of a player in a season
+        return self.lookup('Players', 'SELECT season, player_id, player, position, age FROM Players '
+                                      'WHERE player = ? AND season = ?', (player, season),
+                           player=player, season=season)
+
+    def add_player_team(self, season, player_id, player, position, age, team):
+        # an empty stat line for a player joining a team; False when the player already has one there
+        conn = self.conn
+        try:
+            conn.execute('''
+                INSERT INTO Players (season, player_id, player, position, age, team, total_points,
+                                     field_goals_percent, three_points_percent, two_points_percent,
+                                     free_throw_percent, total_rebound, assist, steal, block, turnover,
+                                     personal_foul)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (season, player_id, player, position, age, team, 0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0, 0, 0, 0))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return False
+        self.invalidate('Players', [{'season': season, 'player_id': player_id, 'player': player,
+                                     'position': position, 'age': age, 'team': team}])
+        return True
+
+    def delete_players(self, player, season):
+        conn = self.conn
+        deleted = conn.execute('DELETE FROM Players WHERE player = ? AND season = ? '
+                               'RETURNING season, player_id, player, position, age, team',
+                               (player, season)).fetchall()
+        conn.commit()
+        self.invalidate('Players', [dict(zip(('season', 'player_id', 'player', 'position', 'age', 'team'), row))
+                                    for row in deleted])
+        return len(deleted)
+
+    # Rollups (nba_aggregates): small tables the triggers on Players keep current, read as they are
+    def find_team_season_stats(self, season=None, team=None, page_size=None):
+        # nba_aggregates.team_stats_columns rows: totals, averages per player and average percentages
+        return self.stream('TeamSeasonStats', team_stats_select, page_size, {'season': season, 'team': team})
+
+    def get_leaders(self, stat, season, limit=None):
+        # (player_id, player, team, value) rows of the best player rows of a season for a stat, best first
+        if stat not in leader_stats:
+            raise ValueError(f'leaders are kept for {", ".join(leader_stats)}, not {stat}')
+        return self.conn.execute(f'SELECT player_id, player, team, value FROM SeasonLeaders '
+                                 f'WHERE stat = ? AND season = ? ORDER BY {leader_order} LIMIT ?',
+                                 (stat, season, min(limit or leaders_size, leaders_size))).fetchall()
+
+    def cache_stats(self):
+        # hits, misses, evictions, ... of the result cache, None without one
+        return None if self.cache is None else self.cache.stats()
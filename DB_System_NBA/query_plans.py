@@ -0,0 +1,129 @@
+import builtins
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+
+import CSC3170_project as project
+import db_results
+from db_pool import close_all, get_connection
+
+
+def is_listing(sql):
+    # a query without any filter lists the whole table, so scanning it is the plan
+    match = re.search(r'\bWHERE\b(.*?)(\bORDER\b|\bLIMIT\b|$)', sql, re.IGNORECASE | re.DOTALL)
+    return match is None or not re.sub(r'\b1\s*=\s*1\b|[()]', '', match.group(1)).strip()
+
+
+def is_page(sql):
+    # a keyset page of db_results.keyset_pages
+    return re.search(r'\bORDER BY\b[\w, ]+\bLIMIT\s+\d+$', sql, re.IGNORECASE) is not None
+
+
+def template(sql):
+    # the statement with its literal values as placeholders: the trace shows every page of a listing as its
+    # own statement, resuming after a literal key, so the number of statements follows the data
+    return re.sub(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", '?', sql)
+
+
+def full_scans(conn, sql):
+    # the tables a statement reads from start to end (SCAN, with or without an index to walk), as it was
+    # run; a page that sorts the rows it found has to read all of them, however few it returns
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    return [detail for _, _, _, detail in plan
+            if detail.startswith('SCAN ') or (detail.startswith('USE TEMP B-TREE FOR ORDER BY') and is_page(sql))]
+
+
+def scenarios(conn):
+    # every menu function with answers for its input() prompts, covering each branch of its filters
+    scout, scout_password = conn.execute("SELECT username, password FROM Users WHERE role = 'scout'").fetchone()
+    player, player_password, team = conn.execute(
+        "SELECT username, password, team FROM Users WHERE role = 'player'").fetchone()
+    name = conn.execute('SELECT player FROM Players WHERE team = ? AND season = 2023', (team,)).fetchone()[0]
+    # the menus run with the session of a login
+    with contextlib.redirect_stdout(io.StringIO()):
+        admin = project.login_user('Admin_0', '121090506')
+        player_session = project.login_user(player, player_password)
+        scout = project.login_user(scout, scout_password)
+    cases = []
+    for season in ('2023', ''):
+        for team_name in (team, ''):
+            cases.append((project.view_all_teams, (admin,), [season, team_name]))
+        for player_name in (name, ''):
+            cases.append((project.view_all_players, (admin,), [player_name, season]))
+            cases.append((project.view_scout_team_players, (scout,), [player_name, season]))
+        cases.append((project.view_team_info_by_year, (scout,), [season]))
+    for username in (player, ''):
+        for role in ('player', ''):
+            for team_name in (team, ''):
+                cases.append((project.view_all_users, (admin,), [username, role, team_name]))
+    for position in ('SG', ''):
+        for team_name in (team, ''):
+            cases.append((project.view_young_players, (scout,), [position, '', team_name]))
+    for player_name in (name, ''):
+        cases.append((project.view_current_team_player, (player_session,), [player_name]))
+    cases += [
+        (project.view_current_team_info, (player_session,), []),
+        (project.login_user, (player, 'wrong'), []),
+        (project.register_user, (9999999, 'query_plans', 'secret', team), []),
+        (project.register_user, (9999999, 'query_plans', 'secret', team), []),
+        (project.update_player_team, (admin,), [name, 'query_plans']),
+        (project.update_team_playoffs, (admin,), [team, '2023', '1']),
+        (project.delete_player, (admin,), [name, '2023']),
+        (project.delete_user, (admin,), ['query_plans']),
+    ]
+    return cases
+
+
+def check_query_plans(verbose=False):
+    # run every query of CSC3170_project against a scratch copy of the database and fail when a filtered
+    # query scans a table instead of searching an index, or a page sorts its matches
+    db_file = project.db_file
+    page_size = db_results.default_page_size
+    with tempfile.TemporaryDirectory() as directory:
+        project.db_file = os.path.join(directory, 'query_plans.db')
+        # small pages, so that the listings also run the queries resuming after a page
+        db_results.default_page_size = 50
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                project.bootstrap()
+            conn = get_connection(project.db_file)
+            cases = scenarios(conn)
+            statements = []
+            conn.set_trace_callback(statements.append)
+            real_input = builtins.input
+            try:
+                for function, args, answers in cases:
+                    answers = iter(answers)
+                    builtins.input = lambda prompt='': next(answers)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        function(*args)
+            finally:
+                builtins.input = real_input
+                conn.set_trace_callback(None)
+            checked = set()
+            failures = []
+            for sql in statements:
+                sql = ' '.join(sql.split())
+                if sql in checked or not re.match(r'(SELECT|UPDATE|DELETE|INSERT)\b', sql, re.IGNORECASE):
+                    continue
+                checked.add(sql)
+                scans = full_scans(conn, sql)
+                if verbose:
+                    print(f"{'ok' if not scans else 'listing' if is_listing(sql) else 'SCAN':>8}  {sql}")
+                if scans and not is_listing(sql):
+                    failures.append(f"{sql}\n    -> {'; '.join(scans)}")
+        finally:
+            close_all()
+            project.db_file = db_file
+            db_results.default_page_size = page_size
+    assert not failures, 'full table scans:\n' + '\n'.join(failures)
+    print(f"{len(checked)} distinct statements of {len({template(sql) for sql in checked})} queries, "
+          f"no filtered query scans a table or sorts a page")
+
+
+if __name__ == "__main__":
+    # python query_plans.py [-v]   run from this directory, the CSV files are read to build a scratch db
+    check_query_plans('-v' in sys.argv[1:])
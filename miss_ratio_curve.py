@@ -0,0 +1,171 @@
+from array import array
+import csv
+import sys
+import time
+
+from page_trace import Trace, intern_pages, next_use_array, read_trace
+
+
+def lru_stack_distances(ids, distinct, max_size):
+    # histogram of LRU stack distances in one pass: a Fenwick tree over request positions marks the latest
+    # request of every page, so the distance of a re-request is the number of marks after its previous
+    # request plus one. hist[0] counts first requests (cold misses at every size) and distances beyond
+    # max_size share the last bucket.
+    n = len(ids)
+    tree = array("i", bytes(4 * (n + 1)))  # Fenwick tree, 1-based
+    last = array("q", [-1]) * distinct  # page -> position of its latest request
+    hist = array("q", bytes(8 * (max_size + 2)))
+    marks = 0  # number of marked positions, i.e. distinct pages seen so far
+    for t in range(n):
+        page = ids[t]
+        s = last[page]
+        if s < 0:
+            hist[0] += 1
+            marks += 1
+        else:
+            # marks in positions s+1 .. t-1 = marks - prefix(s + 1)
+            prefix = 0
+            i = s + 1
+            while i > 0:
+                prefix += tree[i]
+                i -= i & -i
+            hist[min(marks - prefix + 1, max_size + 1)] += 1
+            i = s + 1
+            while i <= n:
+                tree[i] -= 1
+                i += i & -i
+        i = t + 1
+        while i <= n:
+            tree[i] += 1
+            i += i & -i
+        last[page] = t
+    return hist
+
+
+def opt_stack_distances(ids, max_size):
+    # histogram of OPT stack distances (Mattson et al.): the stack is ordered so that its top c entries are
+    # what Belady's algorithm keeps in a buffer of c pages. On a request the page goes to the top and the
+    # displaced entries bubble down, each level keeping the one of two candidates that is needed sooner.
+    # The stack is cut at max_size, which is exact for every size up to max_size; the cost is the depth
+    # touched per request, at most max_size.
+    n = len(ids)
+    next_use = next_use_array(ids)
+    stack = []  # page ids, top first
+    depth_of = {}  # page -> index in stack
+    hist = array("q", bytes(8 * (max_size + 2)))  # hist[0]: not in the stack (miss at every size)
+    upcoming = {}  # page -> position of its next request, for pages in the stack
+    for t in range(n):
+        page = ids[t]
+        old = depth_of.get(page)
+        if old is None:
+            hist[0] += 1
+            bottom = len(stack)  # the carried entry ends up below the current bottom
+        else:
+            hist[old + 1] += 1
+            bottom = old
+        upcoming[page] = next_use[t]
+        if not stack:
+            stack.append(page)
+            depth_of[page] = 0
+            continue
+        if bottom == 0:
+            continue
+        carry = stack[0]
+        stack[0] = page
+        depth_of[page] = 0
+        for level in range(1, bottom):
+            resident = stack[level]
+            if upcoming[carry] < upcoming[resident]:
+                # the carried page is needed sooner, it stays at this level
+                stack[level] = carry
+                depth_of[carry] = level
+                carry = resident
+        if bottom < len(stack):
+            stack[bottom] = carry
+            depth_of[carry] = bottom
+        elif bottom < max_size:
+            depth_of[carry] = len(stack)
+            stack.append(carry)
+        else:
+            # falls out of the deepest tracked level: a miss at every size up to max_size from here on
+            del depth_of[carry]
+            del upcoming[carry]
+    return hist
+
+
+def misses_from_histogram(hist, requests, max_size):
+    # misses for a buffer of c pages = requests whose distance is 0 (cold) or larger than c
+    misses = []
+    hits = 0
+    for size in range(1, max_size + 1):
+        hits += hist[size]
+        misses.append(requests - hits)
+    return misses
+
+
+def miss_ratio_curve(pages, max_size, policies=("LRU", "OPT")):
+    # misses and miss ratio for every buffer size from 1 to max_size, each policy in a single pass
+    trace = pages if isinstance(pages, Trace) else intern_pages(pages)
+    n = len(trace)
+    curves = {}
+    timings = {}
+    for policy in policies:
+        start = time.perf_counter()
+        if policy == "LRU":
+            hist = lru_stack_distances(trace.ids, trace.distinct, max_size)
+        elif policy == "OPT":
+            hist = opt_stack_distances(trace.ids, max_size)
+        else:
+            raise ValueError(f"no one-pass miss-ratio curve for policy {policy!r}; use LRU or OPT")
+        curves[policy] = misses_from_histogram(hist, n, max_size)
+        timings[policy] = time.perf_counter() - start
+    rows = []
+    for size in range(1, max_size + 1):
+        row = {"buffer_size": size}
+        for policy in policies:
+            misses = curves[policy][size - 1]
+            row[f"{policy}_misses"] = misses
+            row[f"{policy}_miss_ratio"] = misses / n if n else 0.0
+        rows.append(row)
+    return rows, timings
+
+
+def write_curve_csv(rows, out_file):
+    writer = csv.DictWriter(out_file, fieldnames=list(rows[0]) if rows else ["buffer_size"])
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def check(trials=100, seed=3170):
+    # every point of both curves must equal a full simulation at that buffer size
+    import random
+    from page_replacement import simulate
+    rng = random.Random(seed)
+    for trial in range(trials):
+        n = rng.randint(0, 300)
+        pages = [rng.randrange(rng.randint(1, 30)) for _ in range(n)]
+        max_size = rng.randint(1, 25)
+        rows, timings = miss_ratio_curve(pages, max_size)
+        for row in rows:
+            for policy in ("LRU", "OPT"):
+                expected = simulate(policy, row["buffer_size"], pages)["misses"]
+                assert row[f"{policy}_misses"] == expected, \
+                    f"trial {trial}: {policy} at size {row['buffer_size']}: {row[f'{policy}_misses']} != {expected}"
+    print(f"LRU and OPT miss-ratio curves match per-size simulation on {trials} random traces")
+
+
+if __name__ == "__main__":
+    # python miss_ratio_curve.py FILE M [OUT.csv]   curves for buffer sizes 1..M of a trace file
+    # python miss_ratio_curve.py check             compare the curves against per-size simulation
+    if "check" in sys.argv[1:]:
+        check()
+    else:
+        trace = read_trace(sys.argv[1], use_mmap=True)
+        rows, timings = miss_ratio_curve(trace, int(sys.argv[2]))
+        for policy, seconds in timings.items():
+            print(f"{policy} curve over {len(trace)} requests in {seconds:.2f} s", file=sys.stderr)
+        if len(sys.argv) > 3:
+            with open(sys.argv[3], "w", newline="") as out_file:
+                write_curve_csv(rows, out_file)
+        else:
+            write_curve_csv(rows, sys.stdout)
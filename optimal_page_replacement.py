@@ -1,3 +1,7 @@
+import heapq
+import sys
+
+
 def optimal_page_replacement(n, m, pages):
     buffer = set()  # initialize a buffer
     # initialize a dictionary to store the positions of each page
@@ -36,9 +40,68 @@ def optimal_page_replacement(n, m, pages):
     return reads_from_disk
 
 
-line_1 = input().split()
-n = int(line_1[0])
-m = int(line_1[1])
-line_2 = input()
-pages = line_2.split()
-print(optimal_page_replacement(n, m, pages))
+def next_use_positions(n, pages):
+    # next_use[i] is the next position after i that requests pages[i]; pages that are never requested
+    # again get n + i, so every value is distinct and still beyond any real position
+    next_use = [0] * n
+    last_seen = {}
+    for i in range(n - 1, -1, -1):
+        next_use[i] = last_seen.get(pages[i], n + i)
+        last_seen[pages[i]] = i
+    return next_use
+
+
+def optimal_page_replacement_fast(n, m, pages):
+    # same result as optimal_page_replacement in O(n log n): the next uses are precomputed in one reverse
+    # pass and the buffered pages sit in a max-heap on their next use. A hit only pushes a fresh entry,
+    # stale entries are skipped when they reach the top.
+    next_use = next_use_positions(n, pages)
+    buffer = {}     # page -> position of its next use
+    heap = []       # (-next use, page), may hold stale entries
+    reads_from_disk = 0
+    for i in range(n):
+        current_page = pages[i]
+        if current_page not in buffer:
+            reads_from_disk += 1
+            if len(buffer) >= m:
+                # evict the page whose next use is the farthest away
+                while True:
+                    farthest_use, page = heapq.heappop(heap)
+                    if buffer.get(page) == -farthest_use:
+                        del buffer[page]
+                        break
+        buffer[current_page] = next_use[i]
+        heapq.heappush(heap, (-next_use[i], current_page))
+        if len(heap) > 2 * m + 64:
+            # too many stale entries from hits: rebuild the heap from the live ones
+            heap = [(-use, page) for page, use in buffer.items()]
+            heapq.heapify(heap)
+    return reads_from_disk
+
+
+def cross_check(trials=300, seed=3170):
+    # the fast simulator must report the same number of disk reads as the reference one
+    import random
+    rng = random.Random(seed)
+    for trial in range(trials):
+        n = rng.randint(0, 300)
+        m = rng.randint(1, 20)
+        distinct = rng.randint(1, 40)
+        pages = [str(rng.randrange(distinct)) for _ in range(n)]
+        expected = optimal_page_replacement(n, m, pages)
+        actual = optimal_page_replacement_fast(n, m, pages)
+        assert actual == expected, f"trial {trial}: n={n} m={m} pages={pages}: {actual} != {expected}"
+    print(f"optimal_page_replacement_fast matches the reference on {trials} random traces")
+
+
+if __name__ == "__main__":
+    # python optimal_page_replacement.py check    runs the cross-check instead of reading a trace
+    if "check" in sys.argv[1:]:
+        cross_check()
+    else:
+        line_1 = input().split()
+        n = int(line_1[0])
+        m = int(line_1[1])
+        line_2 = input()
+        pages = line_2.split()
+        print(optimal_page_replacement_fast(n, m, pages))
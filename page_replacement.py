@@ -0,0 +1,316 @@
+from array import array
+from collections import OrderedDict
+import heapq
+import sys
+import time
+
+from optimal_page_replacement import next_use_positions
+from page_trace import Trace, intern_pages, next_use_array, read_trace
+
+
+class Policy:
+    # one buffer of `capacity` pages; access(page) returns True on a hit and False on a miss (a disk read)
+    name = "policy"
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def prepare(self, pages, next_use=None):
+        # called with the whole trace before the first access; only OPT needs to look ahead and can be
+        # handed the next-use array of the trace instead of computing it
+        pass
+
+    def access(self, page):
+        raise NotImplementedError
+
+
+class LRU(Policy):
+    name = "LRU"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.buffer = OrderedDict()  # least recently used first
+
+    def access(self, page):
+        if page in self.buffer:
+            self.buffer.move_to_end(page)
+            return True
+        if len(self.buffer) >= self.capacity:
+            self.buffer.popitem(last=False)
+        self.buffer[page] = None
+        return False
+
+
+class CLOCK(Policy):
+    # second chance: the hand clears reference bits until it finds a frame whose bit is already clear
+    name = "CLOCK"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.frames = []  # page held by each frame
+        self.referenced = []  # reference bit of each frame
+        self.slot = {}  # page -> frame index
+        self.hand = 0
+
+    def access(self, page):
+        frame = self.slot.get(page)
+        if frame is not None:
+            self.referenced[frame] = True
+            return True
+        if len(self.frames) < self.capacity:
+            self.slot[page] = len(self.frames)
+            self.frames.append(page)
+            self.referenced.append(False)
+            return False
+        while self.referenced[self.hand]:
+            self.referenced[self.hand] = False
+            self.hand = (self.hand + 1) % self.capacity
+        del self.slot[self.frames[self.hand]]
+        self.frames[self.hand] = page
+        self.slot[page] = self.hand
+        self.hand = (self.hand + 1) % self.capacity
+        return False
+
+
+class LFU(Policy):
+    # evict the least frequently used page, the least recently used one among equals; counts start over
+    # when a page is evicted
+    name = "LFU"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.count = {}  # page -> access count while buffered
+        self.buckets = {}  # access count -> OrderedDict of pages, least recently used first
+        self.min_count = 0
+
+    def access(self, page):
+        count = self.count.get(page)
+        if count is not None:
+            bucket = self.buckets[count]
+            del bucket[page]
+            if not bucket:
+                del self.buckets[count]
+                if self.min_count == count:
+                    self.min_count = count + 1
+            self.count[page] = count + 1
+            self.buckets.setdefault(count + 1, OrderedDict())[page] = None
+            return True
+        if len(self.count) >= self.capacity:
+            bucket = self.buckets[self.min_count]
+            victim, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self.buckets[self.min_count]
+            del self.count[victim]
+        self.count[page] = 1
+        self.buckets.setdefault(1, OrderedDict())[page] = None
+        self.min_count = 1
+        return False
+
+
+class Two_Q(Policy):
+    # full 2Q (Johnson and Shasha): new pages enter the FIFO A1in, pages evicted from it are remembered in
+    # the ghost FIFO A1out, and only a page requested again while remembered is promoted to the LRU list Am
+    name = "2Q"
+
+    def __init__(self, capacity, in_ratio=0.25, out_ratio=0.5):
+        super().__init__(capacity)
+        self.in_size = max(1, int(capacity * in_ratio))
+        self.out_size = max(1, int(capacity * out_ratio))
+        self.a1_in = OrderedDict()  # oldest first
+        self.a1_out = OrderedDict()  # page ids only, oldest first
+        self.am = OrderedDict()  # least recently used first
+
+    def access(self, page):
+        if page in self.am:
+            self.am.move_to_end(page)
+            return True
+        if page in self.a1_in:
+            return True
+        if page in self.a1_out:
+            del self.a1_out[page]
+            self.reclaim()
+            self.am[page] = None
+        else:
+            self.reclaim()
+            self.a1_in[page] = None
+        return False
+
+    def reclaim(self):
+        if len(self.a1_in) + len(self.am) < self.capacity:
+            return
+        if len(self.a1_in) > self.in_size or not self.am:
+            victim, _ = self.a1_in.popitem(last=False)
+            self.a1_out[victim] = None
+            if len(self.a1_out) > self.out_size:
+                self.a1_out.popitem(last=False)
+        else:
+            self.am.popitem(last=False)
+
+
+class ARC(Policy):
+    # Adaptive Replacement Cache (Megiddo and Modha): T1/T2 hold pages seen once/more than once, the ghost
+    # lists B1/B2 remember what was evicted from them and move the target size p of T1
+    name = "ARC"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.p = 0
+        self.t1 = OrderedDict()  # least recently used first
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def replace(self, page):
+        if self.t1 and (len(self.t1) > self.p or (page in self.b2 and len(self.t1) == self.p)):
+            victim, _ = self.t1.popitem(last=False)
+            self.b1[victim] = None
+        else:
+            victim, _ = self.t2.popitem(last=False)
+            self.b2[victim] = None
+
+    def access(self, page):
+        if page in self.t1:
+            del self.t1[page]
+            self.t2[page] = None
+            return True
+        if page in self.t2:
+            self.t2.move_to_end(page)
+            return True
+        c = self.capacity
+        if page in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) / len(self.b1), 1))
+            self.replace(page)
+            del self.b1[page]
+            self.t2[page] = None
+            return False
+        if page in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) / len(self.b2), 1))
+            self.replace(page)
+            del self.b2[page]
+            self.t2[page] = None
+            return False
+        if len(self.t1) + len(self.b1) == c:
+            if len(self.t1) < c:
+                self.b1.popitem(last=False)
+                self.replace(page)
+            else:
+                self.t1.popitem(last=False)
+        else:
+            total = len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2)
+            if total >= c:
+                if total == 2 * c:
+                    self.b2.popitem(last=False)
+                self.replace(page)
+        self.t1[page] = None
+        return False
+
+
+class OPT(Policy):
+    # Belady's optimum, the same heap with lazy invalidation as optimal_page_replacement_fast
+    name = "OPT"
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.next_use = []
+        self.position = 0
+        self.buffer = {}  # page -> position of its next use
+        self.heap = []  # (-next use, page), may hold stale entries
+
+    def prepare(self, pages, next_use=None):
+        if next_use is not None:
+            self.next_use = next_use
+        elif isinstance(pages, (array, memoryview)):
+            # interned trace: one reverse pass into a compact array instead of a dictionary of positions
+            self.next_use = next_use_array(pages)
+        else:
+            self.next_use = next_use_positions(len(pages), pages)
+
+    def access(self, page):
+        next_use = self.next_use[self.position]
+        self.position += 1
+        hit = page in self.buffer
+        if not hit and len(self.buffer) >= self.capacity:
+            while True:
+                farthest_use, victim = heapq.heappop(self.heap)
+                if self.buffer.get(victim) == -farthest_use:
+                    del self.buffer[victim]
+                    break
+        self.buffer[page] = next_use
+        heapq.heappush(self.heap, (-next_use, page))
+        if len(self.heap) > 2 * self.capacity + 64:
+            self.heap = [(-use, buffered) for buffered, use in self.buffer.items()]
+            heapq.heapify(self.heap)
+        return hit
+
+
+POLICIES = {policy.name: policy for policy in (LRU, CLOCK, LFU, Two_Q, ARC, OPT)}
+
+
+def simulate(policy_name, m, pages, next_use=None):
+    # run one policy with a buffer of m pages over the trace (a sequence of page ids or a Trace);
+    # next_use optionally passes a precomputed next_use_array of the trace to OPT
+    if isinstance(pages, Trace):
+        pages = pages.ids
+    policy = POLICIES[policy_name](m)
+    start = time.perf_counter()
+    policy.prepare(pages, next_use)
+    access = policy.access
+    misses = 0
+    for page in pages:
+        if not access(page):
+            misses += 1
+    seconds = time.perf_counter() - start
+    n = len(pages)
+    return {"policy": policy_name, "buffer_size": m, "requests": n, "misses": misses,
+            "hit_ratio": (n - misses) / n if n else 0.0, "seconds": seconds}
+
+
+def compare_policies(m, pages, policy_names=tuple(POLICIES)):
+    return [simulate(name, m, pages) for name in policy_names]
+
+
+def print_results(results):
+    optimum = {result["buffer_size"]: result["misses"] for result in results if result["policy"] == "OPT"}
+    print(f"{'policy':>7} {'m':>8} {'misses':>10} {'hit ratio':>10} {'vs OPT':>8} {'seconds':>9}")
+    for result in results:
+        best = optimum.get(result["buffer_size"])
+        versus = f"{result['misses'] / best:.2f}x" if best else "-"
+        print(f"{result['policy']:>7} {result['buffer_size']:>8} {result['misses']:>10} "
+              f"{result['hit_ratio']:>10.4f} {versus:>8} {result['seconds']:>9.3f}")
+
+
+def check(trials=200, seed=3170):
+    # OPT must agree with the reference simulator and no other policy may beat it
+    import random
+    from optimal_page_replacement import optimal_page_replacement
+    rng = random.Random(seed)
+    for trial in range(trials):
+        n = rng.randint(0, 400)
+        m = rng.randint(1, 16)
+        pages = [rng.randrange(rng.randint(1, 40)) for _ in range(n)]
+        results = {result["policy"]: result["misses"] for result in compare_policies(m, pages)}
+        assert results["OPT"] == optimal_page_replacement(n, m, pages), f"trial {trial}: OPT disagrees"
+        interned = {result["policy"]: result["misses"] for result in compare_policies(m, intern_pages(pages))}
+        assert interned == results, f"trial {trial}: interned trace disagrees"
+        for name, misses in results.items():
+            assert results["OPT"] <= misses <= n, f"trial {trial}: {name} has {misses} misses"
+    print(f"all policies consistent with OPT on {trials} random traces")
+
+
+if __name__ == "__main__":
+    # input format of optimal_page_replacement.py: "n m" on the first line, the n page ids on the second;
+    # policy names given on the command line restrict the run, "check" runs the self-check instead.
+    # python page_replacement.py trace FILE m [policies...]   streams a whitespace-separated trace file
+    if "check" in sys.argv[1:]:
+        check()
+    elif sys.argv[1:2] == ["trace"]:
+        start = time.perf_counter()
+        trace = read_trace(sys.argv[2], use_mmap=True)
+        print(f"read {len(trace)} requests over {trace.distinct} pages in {time.perf_counter() - start:.2f} s")
+        print_results(compare_policies(int(sys.argv[3]), trace, tuple(sys.argv[4:]) or tuple(POLICIES)))
+    else:
+        line_1 = input().split()
+        n = int(line_1[0])
+        m = int(line_1[1])
+        pages = input().split()[:n]
+        print_results(compare_policies(m, pages, tuple(sys.argv[1:]) or tuple(POLICIES)))
@@ -0,0 +1,100 @@
+from array import array
+import mmap
+
+
+class Trace:
+    # a page trace with every page id interned to a dense integer, stored in one compact array
+    def __init__(self, ids=None, names=None):
+        self.ids = ids if ids is not None else array("i")  # interned id of every request, in order
+        self.names = names if names is not None else []  # interned id -> original page id (bytes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def distinct(self):
+        return len(self.names)
+
+
+def iter_chunks(path, chunk_size=1 << 20, use_mmap=False):
+    # yield the file as raw byte chunks, read with plain buffered reads or sliced out of a memory map
+    with open(path, "rb") as trace_file:
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # an empty file cannot be mapped
+                return
+            with mapped:
+                for offset in range(0, len(mapped), chunk_size):
+                    yield mapped[offset:offset + chunk_size]
+        else:
+            while True:
+                chunk = trace_file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+def iter_tokens(chunks):
+    # whitespace-separated page ids across chunk boundaries; only one chunk is held at a time
+    carry = b""
+    for chunk in chunks:
+        chunk = carry + chunk
+        tokens = chunk.split()
+        # a token touching the end of the chunk may continue in the next one
+        carry = tokens.pop() if tokens and not chunk[-1:].isspace() else b""
+        yield from tokens
+    if carry:
+        yield carry
+
+
+def read_trace(path, chunk_size=1 << 20, use_mmap=False, limit=None):
+    # stream a whitespace-separated trace file into a Trace; memory is one chunk plus 4 bytes per request
+    # and one dictionary entry per distinct page
+    trace = Trace()
+    intern = {}
+    ids = trace.ids
+    names = trace.names
+    batch = []
+    for count, token in enumerate(iter_tokens(iter_chunks(path, chunk_size, use_mmap))):
+        if limit is not None and count >= limit:
+            break
+        page_id = intern.get(token)
+        if page_id is None:
+            page_id = intern[token] = len(names)
+            names.append(token)
+        batch.append(page_id)
+        if len(batch) >= 65536:
+            ids.extend(batch)
+            batch.clear()
+    ids.extend(batch)
+    return trace
+
+
+def intern_pages(pages):
+    # build a Trace from an in-memory sequence of page ids
+    trace = Trace()
+    intern = {}
+    for page in pages:
+        page_id = intern.get(page)
+        if page_id is None:
+            page_id = intern[page] = len(trace.names)
+            trace.names.append(page)
+        trace.ids.append(page_id)
+    return trace
+
+
+def next_use_array(ids, distinct=None):
+    # reverse pass over interned ids: next_use[i] is the next position requesting ids[i], or n + i when the
+    # page is never requested again (the convention of optimal_page_replacement.next_use_positions)
+    n = len(ids)
+    if distinct is None:
+        distinct = max(ids) + 1 if n else 0
+    next_use = array("q", bytes(8 * n))
+    last_seen = array("q", [-1]) * distinct
+    for i in range(n - 1, -1, -1):
+        page = ids[i]
+        seen = last_seen[page]
+        next_use[i] = seen if seen >= 0 else n + i
+        last_seen[page] = i
+    return next_use
@@ -0,0 +1,97 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+from page_replacement import POLICIES, print_results, simulate
+from page_trace import Trace, intern_pages, next_use_array, read_trace
+
+# the trace as seen by a worker process: read-only memoryviews over memory-mapped files
+worker_pages = None
+worker_next_use = None
+worker_maps = []
+
+
+def write_array_file(values, directory=None):
+    # dump an array into a temporary file that the workers can map; returns its path
+    with tempfile.NamedTemporaryFile(prefix="sweep-", suffix=".bin", dir=directory, delete=False) as out:
+        values.tofile(out)
+    return out.name
+
+
+def map_array_file(path, typecode):
+    # a zero-copy view of an array file: every worker maps the same page-cache pages
+    if not os.path.getsize(path):
+        return array(typecode)
+    with open(path, "rb") as array_file:
+        mapped = mmap.mmap(array_file.fileno(), 0, access=mmap.ACCESS_READ)
+    worker_maps.append(mapped)
+    return memoryview(mapped).cast(typecode)
+
+
+def attach_trace(pages_path, next_use_path):
+    # process pool initializer
+    global worker_pages, worker_next_use
+    worker_pages = map_array_file(pages_path, "i")
+    worker_next_use = map_array_file(next_use_path, "q") if next_use_path else None
+
+
+def run_task(policy_name, size):
+    next_use = worker_next_use if policy_name == "OPT" else None
+    return simulate(policy_name, size, worker_pages, next_use)
+
+
+def sweep(pages, policies, sizes, workers=None):
+    # simulate every (policy, buffer size) pair over one trace across a process pool and return the results
+    # as one table sorted by policy and size. The interned trace (and OPT's next-use array, computed once)
+    # go to temporary files that each worker memory-maps, so nothing large is pickled to the workers.
+    for policy_name in policies:
+        if policy_name not in POLICIES:
+            raise ValueError(f"unknown policy {policy_name!r}; choose from {', '.join(POLICIES)}")
+    trace = pages if isinstance(pages, Trace) else intern_pages(pages)
+    tasks = [(policy_name, size) for policy_name in policies for size in sizes]
+    workers = workers or os.cpu_count() or 1
+    pages_path = write_array_file(trace.ids)
+    next_use_path = write_array_file(next_use_array(trace.ids, trace.distinct)) if "OPT" in policies else None
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks) or 1), initializer=attach_trace,
+                                 initargs=(pages_path, next_use_path)) as executor:
+            results = list(executor.map(run_task, *zip(*tasks))) if tasks else []
+    finally:
+        os.remove(pages_path)
+        if next_use_path:
+            os.remove(next_use_path)
+    order = {policy_name: i for i, policy_name in enumerate(policies)}
+    results.sort(key=lambda result: (order[result["policy"]], result["buffer_size"]))
+    return results
+
+
+def write_results_csv(results, out_file):
+    writer = csv.DictWriter(out_file, fieldnames=["policy", "buffer_size", "requests", "misses", "hit_ratio",
+                                                  "seconds"])
+    writer.writeheader()
+    writer.writerows(results)
+
+
+if __name__ == "__main__":
+    # python policy_sweep.py FILE SIZES [POLICIES] [WORKERS] [OUT.csv]
+    #   SIZES and POLICIES are comma-separated, e.g. 100,1000,10000 LRU,ARC,OPT 32
+    trace_path = sys.argv[1]
+    sizes = [int(size) for size in sys.argv[2].split(",")]
+    policies = sys.argv[3].split(",") if len(sys.argv) > 3 else list(POLICIES)
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    start = time.perf_counter()
+    trace = read_trace(trace_path, use_mmap=True)
+    read_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = sweep(trace, policies, sizes, workers)
+    print(f"read {len(trace)} requests in {read_time:.2f} s, swept {len(results)} configurations in "
+          f"{time.perf_counter() - start:.2f} s")
+    print_results(results)
+    if len(sys.argv) > 5:
+        with open(sys.argv[5], "w", newline="") as out_file:
+            write_results_csv(results, out_file)